@@ -0,0 +1,235 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures step time and peak memory of `BertModel` on synthetic inputs.
+
+Each invocation measures a single configuration, so that the peak memory of
+the process belongs to that configuration alone. Compare options by running
+the script once per setting, e.g.:
+
+  python benchmark_model.py --bert_config_file=$BERT_BASE_DIR/bert_config.json \
+    --do_train --seq_length=512 --recompute_grad_layers=0
+  python benchmark_model.py --bert_config_file=$BERT_BASE_DIR/bert_config.json \
+    --do_train --seq_length=512 --recompute_grad_layers=1
+
+To measure the unpadded encoder on a wide length distribution, compare e.g.
+`--min_seq_length=16 --unpadded_encoder=false` against
+`--min_seq_length=16 --unpadded_encoder=true`, and the NumPy inference engine
+against the TensorFlow graph with `--engine=numpy` and `--engine=tensorflow`.
+
+To measure the embedding stage alone, e.g. the `tf.gather()` and one-hot
+lookups on CPU, compare `--stage=embeddings --use_one_hot_embeddings=false`
+against `--stage=embeddings --use_one_hot_embeddings=true`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import resource
+import time
+import modeling
+import modeling_numpy
+import numpy as np
+import tensorflow as tf
+
+flags = tf.flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string(
+    "bert_config_file", None,
+    "The config json file corresponding to the pre-trained BERT model. "
+    "This specifies the model architecture.")
+
+flags.DEFINE_enum(
+    "engine", "tensorflow", ["tensorflow", "numpy"],
+    "Whether to time the TensorFlow graph or `modeling_numpy.NumpyBertModel`. "
+    "The NumPy engine only supports inference.")
+
+flags.DEFINE_bool(
+    "do_train", False,
+    "Whether to time a forward+backward training step instead of a forward "
+    "inference step.")
+
+flags.DEFINE_integer("batch_size", 8, "Batch size of the synthetic inputs.")
+
+flags.DEFINE_integer("seq_length", 128,
+                     "Sequence length of the synthetic inputs.")
+
+flags.DEFINE_integer(
+    "min_seq_length", None,
+    "If set, the number of real tokens of each example is drawn uniformly "
+    "from [min_seq_length, seq_length] and the rest is padding. Defaults to "
+    "no padding.")
+
+flags.DEFINE_integer("num_steps", 20, "Number of timed steps.")
+
+flags.DEFINE_integer("num_warmup_steps", 3,
+                     "Number of untimed steps run before timing starts.")
+
+flags.DEFINE_integer("random_seed", 12345,
+                     "Random seed for the synthetic inputs.")
+
+flags.DEFINE_integer(
+    "recompute_grad_layers", 0,
+    "If > 0, recompute the activations of every group of this many encoder "
+    "layers in the backward pass instead of keeping them in memory.")
+
+flags.DEFINE_enum(
+    "compute_dtype", "float32", ["float32", "float16", "bfloat16"],
+    "The dtype the encoder computes in.")
+
+flags.DEFINE_bool(
+    "unpadded_encoder", False,
+    "Whether the encoder's dense layers and layer normalization skip the "
+    "padding tokens.")
+
+flags.DEFINE_enum(
+    "stage", "encoder", ["encoder", "embeddings"],
+    "Whether to time the whole model or only the embedding stage (word, token "
+    "type and position embeddings and their layer normalization).")
+
+flags.DEFINE_bool(
+    "use_one_hot_embeddings", None,
+    "Whether the embeddings are looked up with one-hot matmuls or with "
+    "tf.gather(). If unset, `BertModel` picks one for the platform.")
+
+
+def create_synthetic_inputs(bert_config, batch_size, seq_length, rng,
+                            min_seq_length=None):
+  """Creates random `input_ids`, `input_mask` and `token_type_ids` arrays."""
+  input_ids = rng.randint(
+      0, bert_config.vocab_size, size=[batch_size, seq_length]).astype(np.int32)
+  input_mask = np.ones([batch_size, seq_length], dtype=np.int32)
+  if min_seq_length is not None:
+    lengths = rng.randint(min_seq_length, seq_length + 1, size=[batch_size])
+    for (i, length) in enumerate(lengths):
+      input_ids[i, length:] = 0
+      input_mask[i, length:] = 0
+  token_type_ids = np.zeros([batch_size, seq_length], dtype=np.int32)
+  token_type_ids[:, seq_length // 2:] = 1
+  return (input_ids, input_mask, token_type_ids)
+
+
+def measure_model(bert_config, is_training, inputs, num_steps,
+                  num_warmup_steps, stage="encoder",
+                  use_one_hot_embeddings=None):
+  """Returns the mean step time in seconds of `BertModel` on `inputs`.
+
+  If `stage` is "embeddings", only the ops up to the embedding output are run.
+  """
+  (input_ids, input_mask, token_type_ids) = inputs
+  with tf.Graph().as_default():
+    model = modeling.BertModel(
+        config=bert_config,
+        is_training=is_training,
+        input_ids=tf.constant(input_ids),
+        input_mask=tf.constant(input_mask),
+        token_type_ids=tf.constant(token_type_ids),
+        use_one_hot_embeddings=use_one_hot_embeddings)
+
+    if stage == "embeddings":
+      output = model.get_embedding_output()
+    else:
+      output = model.get_sequence_output()
+    if is_training:
+      loss = tf.reduce_mean(tf.square(output))
+      step_op = tf.train.GradientDescentOptimizer(1e-5).minimize(loss)
+    else:
+      step_op = tf.reduce_sum(output)
+
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      sess.run(tf.local_variables_initializer())
+      for _ in range(num_warmup_steps):
+        sess.run(step_op)
+      start_time = time.time()
+      for _ in range(num_steps):
+        sess.run(step_op)
+      elapsed = time.time() - start_time
+
+  return elapsed / num_steps
+
+
+def measure_numpy_model(bert_config, inputs, num_steps, num_warmup_steps):
+  """Returns the mean step time in seconds of `NumpyBertModel` on `inputs`."""
+  # Take the randomly initialized weights of a `BertModel`.
+  (input_ids, _, _) = inputs
+  with tf.Graph().as_default():
+    modeling.BertModel(
+        config=bert_config,
+        is_training=False,
+        input_ids=tf.constant(input_ids))
+    tvars = tf.trainable_variables()
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      values = sess.run(tvars)
+  weights = dict((var.op.name, value) for (var, value) in zip(tvars, values))
+
+  model = modeling_numpy.NumpyBertModel(bert_config, weights)
+  for _ in range(num_warmup_steps):
+    model.predict(*inputs)
+  start_time = time.time()
+  for _ in range(num_steps):
+    model.predict(*inputs)
+  elapsed = time.time() - start_time
+
+  return elapsed / num_steps
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  bert_config = modeling.BertConfig.from_json_file(FLAGS.bert_config_file)
+  bert_config.recompute_grad_layers = FLAGS.recompute_grad_layers
+  bert_config.compute_dtype = FLAGS.compute_dtype
+  bert_config.unpadded_encoder = FLAGS.unpadded_encoder
+
+  rng = np.random.RandomState(FLAGS.random_seed)
+  inputs = create_synthetic_inputs(bert_config, FLAGS.batch_size,
+                                   FLAGS.seq_length, rng,
+                                   FLAGS.min_seq_length)
+
+  if FLAGS.engine == "numpy":
+    if FLAGS.do_train:
+      raise ValueError("The numpy engine does not support `do_train`.")
+    if FLAGS.stage != "encoder":
+      raise ValueError("The numpy engine only times the whole model.")
+    step_time = measure_numpy_model(bert_config, inputs, FLAGS.num_steps,
+                                    FLAGS.num_warmup_steps)
+  else:
+    step_time = measure_model(bert_config, FLAGS.do_train, inputs,
+                              FLAGS.num_steps, FLAGS.num_warmup_steps,
+                              FLAGS.stage, FLAGS.use_one_hot_embeddings)
+
+  # `ru_maxrss` is the peak resident set size of this process, in kilobytes.
+  peak_memory_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+  tf.logging.info("***** Benchmark results *****")
+  tf.logging.info("  config = %s", bert_config.to_json_string().strip())
+  tf.logging.info("  engine = %s", FLAGS.engine)
+  tf.logging.info("  stage = %s", FLAGS.stage)
+  tf.logging.info("  mode = %s", "train" if FLAGS.do_train else "predict")
+  tf.logging.info("  batch_size = %d", FLAGS.batch_size)
+  tf.logging.info("  seq_length = %d", FLAGS.seq_length)
+  tf.logging.info("  real_token_fraction = %.3f", np.mean(inputs[1]))
+  tf.logging.info("  step_time_ms = %.2f", step_time * 1000.0)
+  tf.logging.info("  examples_per_sec = %.1f", FLAGS.batch_size / step_time)
+  tf.logging.info("  peak_memory_mb = %.1f", peak_memory_mb)
+
+
+if __name__ == "__main__":
+  flags.mark_flag_as_required("bert_config_file")
+  tf.app.run()
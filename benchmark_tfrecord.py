@@ -0,0 +1,147 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks disk footprint against decode throughput of TFRecord files."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import time
+import tensorflow as tf
+
+flags = tf.flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string(
+    "input_file", None,
+    "Input TF example files (can be a glob or comma separated), e.g. the "
+    "output of `create_pretraining_data.py`.")
+
+flags.DEFINE_string(
+    "output_dir", None,
+    "The output directory where the re-encoded copies and the results will "
+    "be written.")
+
+flags.DEFINE_enum(
+    "input_compression_type", "", ["", "GZIP", "ZLIB"],
+    "Compression of the files given in `input_file`.")
+
+flags.DEFINE_integer("batch_size", 1024,
+                     "Number of records fetched per `session.run` call.")
+
+flags.DEFINE_integer("num_passes", 3,
+                     "How many times to read each file. The best pass is kept.")
+
+COMPRESSION_TYPES = ["", "ZLIB", "GZIP"]
+
+
+def rewrite_records(input_files, input_compression_type, output_file,
+                    compression_type):
+  """Copies every record of `input_files` to `output_file`, re-compressed."""
+  options = None
+  if compression_type:
+    options = tf.python_io.TFRecordOptions(
+        getattr(tf.python_io.TFRecordCompressionType, compression_type))
+  input_options = None
+  if input_compression_type:
+    input_options = tf.python_io.TFRecordOptions(
+        getattr(tf.python_io.TFRecordCompressionType, input_compression_type))
+
+  num_records = 0
+  with tf.python_io.TFRecordWriter(output_file, options=options) as writer:
+    for input_file in input_files:
+      for record in tf.python_io.tf_record_iterator(
+          input_file, options=input_options):
+        writer.write(record)
+        num_records += 1
+  return num_records
+
+
+def measure_decode_throughput(input_file, compression_type, batch_size,
+                              num_passes):
+  """Returns the best records/sec over `num_passes` full reads of a file."""
+  best_records_per_sec = 0.0
+  with tf.Graph().as_default():
+    d = tf.data.TFRecordDataset(input_file, compression_type=compression_type)
+    d = d.batch(batch_size)
+    iterator = d.make_initializable_iterator()
+    next_batch = iterator.get_next()
+    num_records_op = tf.size(next_batch)
+
+    with tf.Session() as sess:
+      for _ in range(num_passes):
+        sess.run(iterator.initializer)
+        num_records = 0
+        start_time = time.time()
+        while True:
+          try:
+            num_records += sess.run(num_records_op)
+          except tf.errors.OutOfRangeError:
+            break
+        elapsed = time.time() - start_time
+        if elapsed > 0:
+          best_records_per_sec = max(best_records_per_sec,
+                                     num_records / elapsed)
+  return best_records_per_sec
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  tf.gfile.MakeDirs(FLAGS.output_dir)
+
+  input_files = []
+  for input_pattern in FLAGS.input_file.split(","):
+    input_files.extend(tf.gfile.Glob(input_pattern))
+
+  tf.logging.info("*** Input Files ***")
+  for input_file in input_files:
+    tf.logging.info("  %s" % input_file)
+
+  results = []
+  for compression_type in COMPRESSION_TYPES:
+    name = compression_type or "NONE"
+    output_file = os.path.join(FLAGS.output_dir,
+                               "benchmark.%s.tf_record" % name.lower())
+    num_records = rewrite_records(input_files, FLAGS.input_compression_type,
+                                  output_file, compression_type)
+    num_bytes = tf.gfile.Stat(output_file).length
+    records_per_sec = measure_decode_throughput(
+        output_file, compression_type, FLAGS.batch_size, FLAGS.num_passes)
+    results.append((name, num_records, num_bytes, records_per_sec))
+
+  uncompressed_bytes = float(results[0][2])
+  output_results_file = os.path.join(FLAGS.output_dir,
+                                     "benchmark_results.txt")
+  with tf.gfile.GFile(output_results_file, "w") as writer:
+    tf.logging.info("***** Benchmark results *****")
+    line = "%-6s %10s %14s %8s %14s" % ("type", "records", "bytes", "ratio",
+                                         "records/sec")
+    tf.logging.info(line)
+    writer.write(line + "\n")
+    for (name, num_records, num_bytes, records_per_sec) in results:
+      line = "%-6s %10d %14d %8.3f %14.1f" % (
+          name, num_records, num_bytes, num_bytes / uncompressed_bytes,
+          records_per_sec)
+      tf.logging.info(line)
+      writer.write(line + "\n")
+
+
+if __name__ == "__main__":
+  flags.mark_flag_as_required("input_file")
+  flags.mark_flag_as_required("output_dir")
+  tf.app.run()
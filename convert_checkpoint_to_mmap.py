@@ -0,0 +1,78 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Converts a TensorFlow checkpoint to a memory-mapped weights file.
+
+The output can be passed as `--init_checkpoint` to the run_* scripts and
+`extract_features.py`, and to `modeling_numpy.NumpyBertModel.from_checkpoint`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import mmap_checkpoint
+import tensorflow as tf
+
+flags = tf.flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string(
+    "init_checkpoint", None,
+    "The TensorFlow checkpoint to convert, e.g. "
+    "$BERT_BASE_DIR/bert_model.ckpt.")
+
+flags.DEFINE_string(
+    "output_file", None,
+    "The memory-mapped weights file to write, e.g. "
+    "$BERT_BASE_DIR/bert_model.mmap.")
+
+
+def convert_checkpoint(init_checkpoint, output_file):
+  """Converts a TensorFlow checkpoint to a memory-mapped weights file.
+
+  The variables are read and written one at a time, so only the largest one
+  is in memory at once.
+
+  Args:
+    init_checkpoint: Path of the checkpoint, e.g. ".../bert_model.ckpt".
+    output_file: Path of the weights file to write.
+
+  Returns:
+    The number of converted variables.
+  """
+  reader = tf.train.load_checkpoint(init_checkpoint)
+  name_to_shape = reader.get_variable_to_shape_map()
+  name_to_dtype = reader.get_variable_to_dtype_map()
+
+  names = sorted(name_to_shape.keys())
+  dtypes = [name_to_dtype[name].as_numpy_dtype for name in names]
+  shapes = [name_to_shape[name] for name in names]
+  mmap_checkpoint.write_weights(names, dtypes, shapes, reader.get_tensor,
+                                output_file)
+  return len(names)
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  num_variables = convert_checkpoint(FLAGS.init_checkpoint, FLAGS.output_file)
+  tf.logging.info("Wrote %d variables to %s", num_variables, FLAGS.output_file)
+
+
+if __name__ == "__main__":
+  flags.mark_flag_as_required("init_checkpoint")
+  flags.mark_flag_as_required("output_file")
+  tf.app.run()
@@ -48,6 +48,12 @@ flags.DEFINE_bool(
 
 flags.DEFINE_integer("max_seq_length", 128, "Maximum sequence length.")
 
+flags.DEFINE_enum(
+    "compression_type", "", ["", "GZIP", "ZLIB"],
+    "Compression of the output TFRecord files. The padded int64 ids compress "
+    "very well, so GZIP/ZLIB trade some CPU for a much smaller footprint. "
+    "`run_pretraining.py` must be given the same `compression_type`.")
+
 '''
 max_predictions_per_seq： 一个句子里最多有多少个[MASK] 标记
 '''
@@ -115,11 +121,16 @@ class TrainingInstance(object):
 
 
 def write_instance_to_example_files(instances, tokenizer, max_seq_length,
-                                    max_predictions_per_seq, output_files):
+                                    max_predictions_per_seq, output_files,
+                                    compression_type=None):
   """Create TF example files from `TrainingInstance`s."""
+  options = None
+  if compression_type:
+    options = tf.python_io.TFRecordOptions(
+        getattr(tf.python_io.TFRecordCompressionType, compression_type))
   writers = []
   for output_file in output_files:
-    writers.append(tf.python_io.TFRecordWriter(output_file))
+    writers.append(tf.python_io.TFRecordWriter(output_file, options=options))
 
   writer_index = 0
 
@@ -506,7 +517,8 @@ def main(_):
     tf.logging.info("  %s", output_file)
 
   write_instance_to_example_files(instances, tokenizer, FLAGS.max_seq_length,
-                                  FLAGS.max_predictions_per_seq, output_files)    # 调用write_instance_to_example_files函数以TFRecord格式保存数据
+                                  FLAGS.max_predictions_per_seq, output_files,
+                                  FLAGS.compression_type)    # 调用write_instance_to_example_files函数以TFRecord格式保存数据
 
 
 if __name__ == "__main__":
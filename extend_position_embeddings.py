@@ -0,0 +1,168 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Extends the position embeddings of a checkpoint for long documents.
+
+The learned [max_position_embeddings, hidden_size] table is copied until it
+covers `max_position_embeddings` positions (Beltagy et al., "Longformer: The
+Long-Document Transformer"), and the written `bert_config.json` switches the
+encoder to sliding window attention, so its memory and compute are linear in
+the sequence length. The output can be fine-tuned with the run_* scripts as
+it is, e.g. with `run_squad.py --max_seq_length=4096`:
+
+  python extend_position_embeddings.py \
+    --bert_config_file=$BERT_BASE_DIR/bert_config.json \
+    --init_checkpoint=$BERT_BASE_DIR/bert_model.ckpt \
+    --max_position_embeddings=4096 --attention_window=256 \
+    --output_dir=/tmp/bert_long
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import copy
+import os
+import modeling
+import modeling_numpy
+import numpy as np
+import tensorflow as tf
+
+flags = tf.flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string(
+    "bert_config_file", None,
+    "The config json file corresponding to the pre-trained BERT model.")
+
+flags.DEFINE_string(
+    "init_checkpoint", None,
+    "The checkpoint whose position embeddings are extended, e.g. "
+    "$BERT_BASE_DIR/bert_model.ckpt.")
+
+flags.DEFINE_string(
+    "output_dir", None,
+    "Where to write the extended checkpoint and its bert_config.json.")
+
+flags.DEFINE_integer(
+    "max_position_embeddings", 4096,
+    "The number of positions of the extended position embeddings.")
+
+flags.DEFINE_integer(
+    "attention_window", 256,
+    "The maximum distance between a token and the tokens it attends to. If "
+    "0, the encoder keeps the full attention.")
+
+flags.DEFINE_integer(
+    "num_global_tokens", 1,
+    "The number of tokens at the start of the sequence, e.g. [CLS], that "
+    "attend to and are attended by every token.")
+
+
+def extend_position_table(position_embeddings, max_position_embeddings):
+  """Copies the rows of a position embedding table up to a new length.
+
+  Args:
+    position_embeddings: float array of shape [num_positions, hidden_size].
+    max_position_embeddings: int. The number of rows of the extended table.
+
+  Returns:
+    float array of shape [max_position_embeddings, hidden_size] whose row `i`
+    is row `i % num_positions` of `position_embeddings`.
+  """
+  num_positions = position_embeddings.shape[0]
+  # 把学好的位置编码重复拷贝，直到覆盖新的长度
+  num_copies = (max_position_embeddings + num_positions - 1) // num_positions
+  return np.tile(position_embeddings,
+                 [num_copies, 1])[:max_position_embeddings]
+
+
+def extend_checkpoint(bert_config, init_checkpoint, max_position_embeddings,
+                      output_dir, attention_window=None, num_global_tokens=1,
+                      scope="bert"):
+  """Writes a copy of `init_checkpoint` with longer position embeddings.
+
+  The optimizer slots and the global step are not copied.
+
+  Args:
+    bert_config: `BertConfig` the checkpoint was trained with.
+    init_checkpoint: Path of the checkpoint.
+    max_position_embeddings: int. The number of positions of the output.
+    output_dir: Where to write the checkpoint and its `bert_config.json`.
+    attention_window: (optional) int. The `attention_window` of the output
+      config.
+    num_global_tokens: (optional) int. The `num_global_tokens` of the output
+      config.
+    scope: (optional) The variable scope the `BertModel` was built in.
+
+  Returns:
+    The `BertConfig` of the extended model.
+
+  Raises:
+    ValueError: The checkpoint already has `max_position_embeddings`
+      positions or more.
+  """
+  if max_position_embeddings <= bert_config.max_position_embeddings:
+    raise ValueError(
+        "The checkpoint already has %d position embeddings." %
+        bert_config.max_position_embeddings)
+
+  weights = {}
+  for (name, value) in modeling_numpy.load_weights_from_checkpoint(
+      init_checkpoint).items():
+    if name == "global_step" or name.endswith("/adam_m") or name.endswith(
+        "/adam_v"):
+      continue
+    weights[name] = np.asarray(value)
+
+  name = "%s/embeddings/position_embeddings" % scope
+  weights[name] = extend_position_table(weights[name], max_position_embeddings)
+
+  extended_config = copy.deepcopy(bert_config)
+  extended_config.max_position_embeddings = max_position_embeddings
+  extended_config.attention_window = attention_window
+  extended_config.num_global_tokens = num_global_tokens
+
+  tf.gfile.MakeDirs(output_dir)
+  modeling_numpy.save_weights_to_checkpoint(
+      weights, os.path.join(output_dir, "bert_model.ckpt"))
+  with tf.gfile.GFile(os.path.join(output_dir, "bert_config.json"),
+                      "w") as writer:
+    writer.write(extended_config.to_json_string())
+  return extended_config
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  bert_config = modeling.BertConfig.from_json_file(FLAGS.bert_config_file)
+  extended_config = extend_checkpoint(
+      bert_config,
+      FLAGS.init_checkpoint,
+      FLAGS.max_position_embeddings,
+      FLAGS.output_dir,
+      attention_window=FLAGS.attention_window or None,
+      num_global_tokens=FLAGS.num_global_tokens)
+  tf.logging.info("Wrote the extended checkpoint to %s", FLAGS.output_dir)
+  tf.logging.info("  max_position_embeddings = %d",
+                  extended_config.max_position_embeddings)
+  tf.logging.info("  attention_window = %s", extended_config.attention_window)
+
+
+if __name__ == "__main__":
+  flags.mark_flag_as_required("bert_config_file")
+  flags.mark_flag_as_required("init_checkpoint")
+  flags.mark_flag_as_required("output_dir")
+  tf.app.run()
@@ -23,6 +23,7 @@ import collections
 import json
 import re
 
+import inference_graph
 import modeling
 import tokenization
 import tensorflow as tf
@@ -48,6 +49,11 @@ flags.DEFINE_integer(
     "Sequences longer than this will be truncated, and sequences shorter "
     "than this will be padded.")
 
+flags.DEFINE_bool(
+    "dynamic_seq_length", False,
+    "Whether to pad each batch only to its longest example instead of to "
+    "`max_seq_length`. Not supported on TPU.")
+
 flags.DEFINE_string(
     "init_checkpoint", None,
     "Initial checkpoint (usually from a pre-trained BERT model).")
@@ -62,6 +68,12 @@ flags.DEFINE_bool(
 
 flags.DEFINE_integer("batch_size", 32, "Batch size for predictions.")
 
+flags.DEFINE_string(
+    "export_dir", None,
+    "If set, the model is also exported to this directory as a frozen, "
+    "optimized inference graph and SavedModel whose outputs are the `layers`, "
+    "named `layer_<index>` by their absolute index.")
+
 flags.DEFINE_bool("use_tpu", False, "Whether to use TPU or GPU/CPU.")
 
 flags.DEFINE_string("master", None,
@@ -72,10 +84,10 @@ flags.DEFINE_integer(
     "Only used if `use_tpu` is True. Total number of TPU cores to use.")
 
 flags.DEFINE_bool(
-    "use_one_hot_embeddings", False,
+    "use_one_hot_embeddings", None,
     "If True, tf.one_hot will be used for embedding lookups, otherwise "
     "tf.nn.embedding_lookup will be used. On TPUs, this should be True "
-    "since it is much faster.")
+    "since it is much faster. If unset, tf.one_hot is used on TPU only.")
 
 
 class InputExample(object):
@@ -97,8 +109,12 @@ class InputFeatures(object):
     self.input_type_ids = input_type_ids
 
 
-def input_fn_builder(features, seq_length):
-  """Creates an `input_fn` closure to be passed to TPUEstimator."""
+def input_fn_builder(features, seq_length, dynamic_seq_length=False):
+  """Creates an `input_fn` closure to be passed to TPUEstimator.
+
+  If `dynamic_seq_length` is True, `features` must be unpadded and every batch
+  is padded only to its longest example.
+  """
 
   all_unique_ids = []
   all_input_ids = []
@@ -117,6 +133,31 @@ def input_fn_builder(features, seq_length):
 
     num_examples = len(features)
 
+    if dynamic_seq_length:
+      # Unpadded features cannot be stacked into a constant, so they are fed
+      # from Python. This uses tf.py_func, which is fine off TPU.
+      def generator():
+        for feature in features:
+          yield {
+              "unique_ids": feature.unique_id,
+              "input_ids": feature.input_ids,
+              "input_mask": feature.input_mask,
+              "input_type_ids": feature.input_type_ids,
+          }
+
+      names = ["unique_ids", "input_ids", "input_mask", "input_type_ids"]
+      d = tf.data.Dataset.from_generator(
+          generator,
+          output_types=dict((name, tf.int32) for name in names),
+          output_shapes={
+              "unique_ids": [],
+              "input_ids": [None],
+              "input_mask": [None],
+              "input_type_ids": [None],
+          })
+      d = d.padded_batch(batch_size, padded_shapes=d.output_shapes)
+      return d
+
     # This is for demo purposes and does NOT scale to large data sets. We do
     # not use Dataset.from_generator() because that uses tf.py_func which is
     # not TPU compatible. The right way to load data is with TFRecordReader.
@@ -157,13 +198,22 @@ def model_fn_builder(bert_config, init_checkpoint, layer_indexes, use_tpu,
     input_mask = features["input_mask"]
     input_type_ids = features["input_type_ids"]
 
+    # Only the layers up to the deepest requested one are built, and the
+    # pooler is not needed.
+    # 只构建到需要的最深的那一层，不需要pooler
+    absolute_layer_indexes = [
+        x if x >= 0 else bert_config.num_hidden_layers + x
+        for x in layer_indexes
+    ]
     model = modeling.BertModel(
         config=bert_config,
         is_training=False,
         input_ids=input_ids,
         input_mask=input_mask,
         token_type_ids=input_type_ids,
-        use_one_hot_embeddings=use_one_hot_embeddings)
+        use_one_hot_embeddings=use_one_hot_embeddings,
+        max_layer_depth=max(absolute_layer_indexes) + 1,
+        use_pooler=False)
 
     if mode != tf.estimator.ModeKeys.PREDICT:
       raise ValueError("Only PREDICT modes are supported: %s" % (mode))
@@ -176,12 +226,12 @@ def model_fn_builder(bert_config, init_checkpoint, layer_indexes, use_tpu,
     if use_tpu:
 
       def tpu_scaffold():
-        tf.train.init_from_checkpoint(init_checkpoint, assignment_map)
+        modeling.init_from_checkpoint(init_checkpoint, assignment_map)
         return tf.train.Scaffold()
 
       scaffold_fn = tpu_scaffold
     else:
-      tf.train.init_from_checkpoint(init_checkpoint, assignment_map)
+      modeling.init_from_checkpoint(init_checkpoint, assignment_map)
 
     tf.logging.info("**** Trainable Variables ****")
     for var in tvars:
@@ -197,7 +247,7 @@ def model_fn_builder(bert_config, init_checkpoint, layer_indexes, use_tpu,
         "unique_id": unique_ids,
     }
 
-    for (i, layer_index) in enumerate(layer_indexes):
+    for (i, layer_index) in enumerate(absolute_layer_indexes):
       predictions["layer_output_%d" % i] = all_layers[layer_index]
 
     output_spec = tf.contrib.tpu.TPUEstimatorSpec(
@@ -207,8 +257,12 @@ def model_fn_builder(bert_config, init_checkpoint, layer_indexes, use_tpu,
   return model_fn
 
 
-def convert_examples_to_features(examples, seq_length, tokenizer):
-  """Loads a data file into a list of `InputBatch`s."""
+def convert_examples_to_features(examples, seq_length, tokenizer,
+                                 pad_to_max_seq_length=True):
+  """Loads a data file into a list of `InputBatch`s.
+
+  If `pad_to_max_seq_length` is False, the features are left unpadded.
+  """
 
   features = []
   for (ex_index, example) in enumerate(examples):
@@ -270,14 +324,15 @@ def convert_examples_to_features(examples, seq_length, tokenizer):
     input_mask = [1] * len(input_ids)
 
     # Zero-pad up to the sequence length.
-    while len(input_ids) < seq_length:
-      input_ids.append(0)
-      input_mask.append(0)
-      input_type_ids.append(0)
+    if pad_to_max_seq_length:
+      while len(input_ids) < seq_length:
+        input_ids.append(0)
+        input_mask.append(0)
+        input_type_ids.append(0)
 
-    assert len(input_ids) == seq_length
-    assert len(input_mask) == seq_length
-    assert len(input_type_ids) == seq_length
+      assert len(input_ids) == seq_length
+      assert len(input_mask) == seq_length
+      assert len(input_type_ids) == seq_length
 
     if ex_index < 5:
       tf.logging.info("*** Example ***")
@@ -345,8 +400,37 @@ def main(_):
 
   layer_indexes = [int(x) for x in FLAGS.layers.split(",")]
 
+  if FLAGS.dynamic_seq_length and FLAGS.use_tpu:
+    raise ValueError("`dynamic_seq_length` is not supported on TPU.")
+
   bert_config = modeling.BertConfig.from_json_file(FLAGS.bert_config_file)
 
+  if FLAGS.export_dir:
+    absolute_layer_indexes = [
+        x if x >= 0 else bert_config.num_hidden_layers + x
+        for x in layer_indexes
+    ]
+
+    def create_outputs(input_ids, input_mask, segment_ids):
+      model = modeling.BertModel(
+          config=bert_config,
+          is_training=False,
+          input_ids=input_ids,
+          input_mask=input_mask,
+          token_type_ids=segment_ids,
+          use_one_hot_embeddings=None,
+          max_layer_depth=max(absolute_layer_indexes) + 1,
+          use_pooler=False)
+      all_layers = model.get_all_encoder_layers()
+      return {
+          "layer_%d" % layer_index: all_layers[layer_index]
+          for layer_index in absolute_layer_indexes
+      }
+
+    inference_graph.export_inference_graph(
+        create_outputs, FLAGS.init_checkpoint, FLAGS.max_seq_length,
+        FLAGS.export_dir)
+
   tokenizer = tokenization.FullTokenizer(
       vocab_file=FLAGS.vocab_file, do_lower_case=FLAGS.do_lower_case)
 
@@ -360,7 +444,10 @@ def main(_):
   examples = read_examples(FLAGS.input_file)
 
   features = convert_examples_to_features(
-      examples=examples, seq_length=FLAGS.max_seq_length, tokenizer=tokenizer)
+      examples=examples,
+      seq_length=FLAGS.max_seq_length,
+      tokenizer=tokenizer,
+      pad_to_max_seq_length=not FLAGS.dynamic_seq_length)
 
   unique_id_to_feature = {}
   for feature in features:
@@ -382,7 +469,9 @@ def main(_):
       predict_batch_size=FLAGS.batch_size)
 
   input_fn = input_fn_builder(
-      features=features, seq_length=FLAGS.max_seq_length)
+      features=features,
+      seq_length=FLAGS.max_seq_length,
+      dynamic_seq_length=FLAGS.dynamic_seq_length)
 
   with codecs.getwriter("utf-8")(tf.gfile.Open(FLAGS.output_file,
                                                "w")) as writer:
@@ -0,0 +1,218 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Exports a task head as a frozen, optimized inference graph.
+
+The graph is built once with `is_training=False`, so that dropout is removed,
+its variables are folded into constants and the graph transforms below are
+applied to it. It is written both as a frozen GraphDef and as a SavedModel
+whose `serving_default` signature maps `input_ids`, `input_mask` and
+`segment_ids` to the outputs of the head. The run_* scripts export their heads
+with `--do_export`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import time
+import modeling
+import tensorflow as tf
+from tensorflow.tools.graph_transforms import TransformGraph
+
+FROZEN_GRAPH_NAME = "frozen_graph.pb"
+
+SAVED_MODEL_NAME = "saved_model"
+
+INPUT_NAMES = ["input_ids", "input_mask", "segment_ids"]
+
+# Identity ops are kept: the outputs of the graph are Identity ops.
+GRAPH_TRANSFORMS = [
+    "strip_unused_nodes(type=int32)",
+    "remove_nodes(op=CheckNumerics)",
+    "fold_constants(ignore_errors=true)",
+    "merge_duplicate_nodes",
+    "strip_unused_nodes(type=int32)",
+    "sort_by_execution_order",
+]
+
+
+def create_serving_inputs(max_seq_length):
+  """Creates the int32 [batch_size, max_seq_length] input placeholders."""
+  return [
+      tf.placeholder(tf.int32, [None, max_seq_length], name=name)
+      for name in INPUT_NAMES
+  ]
+
+
+def freeze_graph(create_outputs_fn, init_checkpoint, max_seq_length):
+  """Builds a task head and folds its variables into constants.
+
+  Args:
+    create_outputs_fn: Function taking the `input_ids`, `input_mask` and
+      `segment_ids` tensors and returning a dict from output names to tensors.
+      It must build the model with `is_training=False`.
+    init_checkpoint: The checkpoint the variables are restored from.
+    max_seq_length: int. The sequence length of the inputs.
+
+  Returns:
+    A tuple of the frozen `GraphDef` and of the sorted output names.
+
+  Raises:
+    ValueError: An output name is already used by an op of the model.
+  """
+  with tf.Graph().as_default() as graph:
+    (input_ids, input_mask, segment_ids) = create_serving_inputs(max_seq_length)
+    outputs = create_outputs_fn(input_ids, input_mask, segment_ids)
+
+    output_names = sorted(outputs.keys())
+    for name in output_names:
+      output = tf.identity(outputs[name], name=name)
+      if output.op.name != name:
+        raise ValueError("The output name `%s` is already used by the graph." %
+                         name)
+
+    (assignment_map, _) = modeling.get_assignment_map_from_checkpoint(
+        tf.global_variables(), init_checkpoint)
+    modeling.init_from_checkpoint(init_checkpoint, assignment_map)
+
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      sess.run(tf.local_variables_initializer())
+      graph_def = tf.graph_util.convert_variables_to_constants(
+          sess, graph.as_graph_def(), output_names)
+  return (graph_def, output_names)
+
+
+def optimize_graph(graph_def, output_names):
+  """Applies `GRAPH_TRANSFORMS` to a frozen `GraphDef`.
+
+  The constant subgraphs, e.g. the position embeddings sliced to the sequence
+  length, are folded and the duplicated ops are merged. The op fusions, e.g. of
+  a matmul with its bias add, are left to Grappler when the graph is loaded.
+  """
+  return TransformGraph(graph_def, INPUT_NAMES, output_names,
+                        GRAPH_TRANSFORMS)
+
+
+def write_saved_model(graph_def, output_names, saved_model_dir):
+  """Writes a frozen `GraphDef` as a SavedModel with a predict signature."""
+  if tf.gfile.Exists(saved_model_dir):
+    tf.gfile.DeleteRecursively(saved_model_dir)
+
+  with tf.Graph().as_default() as graph:
+    tf.import_graph_def(graph_def, name="")
+    inputs = {
+        name: graph.get_tensor_by_name(name + ":0") for name in INPUT_NAMES
+    }
+    outputs = {
+        name: graph.get_tensor_by_name(name + ":0") for name in output_names
+    }
+    signature = tf.saved_model.signature_def_utils.predict_signature_def(
+        inputs=inputs, outputs=outputs)
+
+    builder = tf.saved_model.builder.SavedModelBuilder(saved_model_dir)
+    with tf.Session() as sess:
+      builder.add_meta_graph_and_variables(
+          sess, [tf.saved_model.tag_constants.SERVING],
+          signature_def_map={
+              tf.saved_model.signature_constants
+              .DEFAULT_SERVING_SIGNATURE_DEF_KEY: signature
+          })
+    builder.save()
+
+
+def export_inference_graph(create_outputs_fn, init_checkpoint, max_seq_length,
+                           export_dir):
+  """Exports a task head as a frozen GraphDef and as a SavedModel.
+
+  Args:
+    create_outputs_fn: See `freeze_graph`.
+    init_checkpoint: The checkpoint the variables are restored from.
+    max_seq_length: int. The sequence length of the inputs.
+    export_dir: Where to write `FROZEN_GRAPH_NAME` and `SAVED_MODEL_NAME`.
+
+  Returns:
+    The path of the frozen GraphDef.
+  """
+  (graph_def, output_names) = freeze_graph(create_outputs_fn, init_checkpoint,
+                                           max_seq_length)
+  num_nodes = len(graph_def.node)
+  graph_def = optimize_graph(graph_def, output_names)
+  tf.logging.info("Optimized the frozen graph from %d to %d nodes", num_nodes,
+                  len(graph_def.node))
+
+  tf.gfile.MakeDirs(export_dir)
+  frozen_graph_file = os.path.join(export_dir, FROZEN_GRAPH_NAME)
+  with tf.gfile.GFile(frozen_graph_file, "wb") as writer:
+    writer.write(graph_def.SerializeToString())
+  write_saved_model(graph_def, output_names,
+                    os.path.join(export_dir, SAVED_MODEL_NAME))
+  tf.logging.info("Exported the inference graph to %s", export_dir)
+  return frozen_graph_file
+
+
+def load_frozen_graph(frozen_graph_file):
+  """Loads a GraphDef written by `export_inference_graph` into a `tf.Graph`."""
+  graph_def = tf.GraphDef()
+  with tf.gfile.GFile(frozen_graph_file, "rb") as reader:
+    graph_def.ParseFromString(reader.read())
+  graph = tf.Graph()
+  with graph.as_default():
+    tf.import_graph_def(graph_def, name="")
+  return graph
+
+
+def create_frozen_graph_predict_fn(frozen_graph_file, output_names):
+  """Loads a frozen graph into a session that stays open.
+
+  Returns:
+    A function taking the `input_ids`, `input_mask` and `segment_ids` arrays
+    and returning the list of the `output_names` arrays.
+  """
+  graph = load_frozen_graph(frozen_graph_file)
+  sess = tf.Session(graph=graph)
+  inputs = [graph.get_tensor_by_name(name + ":0") for name in INPUT_NAMES]
+  outputs = [graph.get_tensor_by_name(name + ":0") for name in output_names]
+
+  def predict_fn(input_ids, input_mask, segment_ids):
+    return sess.run(
+        outputs,
+        feed_dict=dict(zip(inputs, [input_ids, input_mask, segment_ids])))
+
+  return predict_fn
+
+
+def measure_latency(load_fn, requests):
+  """Measures the cold start and the per-request latency of a model.
+
+  Args:
+    load_fn: Function taking no argument, loading the model and returning a
+      function that runs one request.
+    requests: List of at least two requests.
+
+  Returns:
+    A tuple of the seconds taken to load the model and run the first request,
+    and of the mean seconds taken by each of the other requests.
+  """
+  start_time = time.time()
+  request_fn = load_fn()
+  request_fn(requests[0])
+  cold_start = time.time() - start_time
+
+  start_time = time.time()
+  for request in requests[1:]:
+    request_fn(request)
+  return (cold_start, (time.time() - start_time) / (len(requests) - 1))
@@ -0,0 +1,121 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import inference_graph
+import modeling
+import numpy as np
+import tensorflow as tf
+
+
+class InferenceGraphTest(tf.test.TestCase):
+
+  def create_config(self):
+    return modeling.BertConfig(
+        vocab_size=99,
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        intermediate_size=37,
+        max_position_embeddings=64,
+        type_vocab_size=2)
+
+  def create_inputs(self, batch_size=2, seq_length=7):
+    rng = np.random.RandomState(12345)
+    input_ids = rng.randint(0, 99, size=[batch_size, seq_length])
+    input_mask = np.ones([batch_size, seq_length], dtype=np.int32)
+    input_mask[0, seq_length // 2:] = 0
+    segment_ids = rng.randint(0, 2, size=[batch_size, seq_length])
+    return (input_ids.astype(np.int32), input_mask,
+            segment_ids.astype(np.int32))
+
+  def test_export_inference_graph(self):
+    config = self.create_config()
+    (input_ids, input_mask, segment_ids) = self.create_inputs()
+    init_checkpoint = os.path.join(self.get_temp_dir(), "model.ckpt")
+    export_dir = os.path.join(self.get_temp_dir(), "export")
+
+    def create_outputs(input_ids, input_mask, segment_ids):
+      model = modeling.BertModel(
+          config=config,
+          is_training=False,
+          input_ids=input_ids,
+          input_mask=input_mask,
+          token_type_ids=segment_ids)
+      return {"pooled_output": model.get_pooled_output()}
+
+    with tf.Graph().as_default():
+      outputs = create_outputs(
+          tf.constant(input_ids), tf.constant(input_mask),
+          tf.constant(segment_ids))
+      with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(tf.local_variables_initializer())
+        tf.train.Saver().save(sess, init_checkpoint)
+        expected = sess.run(outputs["pooled_output"])
+
+    frozen_graph_file = inference_graph.export_inference_graph(
+        create_outputs, init_checkpoint, 7, export_dir)
+
+    graph = inference_graph.load_frozen_graph(frozen_graph_file)
+    self.assertFalse([
+        op.name for op in graph.get_operations()
+        if op.type in ("VariableV2", "VarHandleOp")
+    ])
+
+    predict_fn = inference_graph.create_frozen_graph_predict_fn(
+        frozen_graph_file, ["pooled_output"])
+    (actual,) = predict_fn(input_ids, input_mask, segment_ids)
+    self.assertAllClose(expected, actual, rtol=1e-5, atol=1e-5)
+
+    with tf.Graph().as_default():
+      with tf.Session() as sess:
+        meta_graph_def = tf.saved_model.loader.load(
+            sess, [tf.saved_model.tag_constants.SERVING],
+            os.path.join(export_dir, inference_graph.SAVED_MODEL_NAME))
+        signature = meta_graph_def.signature_def[
+            tf.saved_model.signature_constants
+            .DEFAULT_SERVING_SIGNATURE_DEF_KEY]
+        self.assertEqual(
+            sorted(signature.inputs.keys()),
+            ["input_ids", "input_mask", "segment_ids"])
+        actual = sess.run(
+            signature.outputs["pooled_output"].name,
+            feed_dict={
+                signature.inputs["input_ids"].name: input_ids,
+                signature.inputs["input_mask"].name: input_mask,
+                signature.inputs["segment_ids"].name: segment_ids,
+            })
+    self.assertAllClose(expected, actual, rtol=1e-5, atol=1e-5)
+
+  def test_measure_latency(self):
+    calls = []
+
+    def load_fn():
+      return calls.append
+
+    (cold_start, secs_per_request) = inference_graph.measure_latency(
+        load_fn, [1, 2, 3])
+    self.assertEqual(calls, [1, 2, 3])
+    self.assertGreaterEqual(cold_start, 0.0)
+    self.assertGreaterEqual(secs_per_request, 0.0)
+
+
+if __name__ == "__main__":
+  tf.test.main()
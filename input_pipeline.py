@@ -0,0 +1,61 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""`tf.data` helpers shared by the input functions of the run_* scripts."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+
+def padded_batch_by_length(d, batch_size, drop_remainder,
+                           length_bucket_boundaries=None):
+  """Batches a dataset of unpadded examples, padding to the longest one.
+
+  The 1-D features are padded with zeros to the length of the longest
+  `input_ids` in each batch, and the scalar features are batched as is.
+
+  Args:
+    d: `tf.data.Dataset` of dicts of int32 Tensors.
+    batch_size: int. Batch size.
+    drop_remainder: bool. Whether to drop the last, smaller batch.
+    length_bucket_boundaries: (optional) list of ints. If given, the examples
+      are grouped into buckets of `input_ids` length with these upper
+      boundaries, and each batch is taken from a single bucket. This changes
+      the order of the examples, and a bucket's last batch may be smaller than
+      `batch_size` even when `drop_remainder` is True.
+
+  Returns:
+    The batched `tf.data.Dataset`.
+  """
+  padded_shapes = {}
+  for (name, shape) in d.output_shapes.items():
+    padded_shapes[name] = [None] * shape.ndims
+
+  def _example_length(example):
+    return tf.shape(example["input_ids"])[0]
+
+  if length_bucket_boundaries:
+    num_buckets = len(length_bucket_boundaries) + 1
+    return d.apply(
+        tf.contrib.data.bucket_by_sequence_length(
+            element_length_func=_example_length,
+            bucket_boundaries=length_bucket_boundaries,
+            bucket_batch_sizes=[batch_size] * num_buckets,
+            padded_shapes=padded_shapes))
+
+  return d.padded_batch(
+      batch_size, padded_shapes=padded_shapes, drop_remainder=drop_remainder)
@@ -0,0 +1,68 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import input_pipeline
+import tensorflow as tf
+
+
+class InputPipelineTest(tf.test.TestCase):
+
+  def create_dataset(self, lengths):
+
+    def generator():
+      for (i, length) in enumerate(lengths):
+        yield {"input_ids": [i + 1] * length, "label_ids": i}
+
+    return tf.data.Dataset.from_generator(
+        generator, {
+            "input_ids": tf.int32,
+            "label_ids": tf.int32
+        }, {
+            "input_ids": tf.TensorShape([None]),
+            "label_ids": tf.TensorShape([])
+        })
+
+  def test_padded_batch_by_length(self):
+    d = input_pipeline.padded_batch_by_length(
+        self.create_dataset([2, 4, 1]), batch_size=2, drop_remainder=False)
+    batch = d.make_one_shot_iterator().get_next()
+
+    with self.test_session() as sess:
+      first = sess.run(batch)
+      second = sess.run(batch)
+
+    self.assertAllEqual(first["input_ids"], [[1, 1, 0, 0], [2, 2, 2, 2]])
+    self.assertAllEqual(first["label_ids"], [0, 1])
+    self.assertAllEqual(second["input_ids"], [[3]])
+
+  def test_padded_batch_by_length_buckets(self):
+    d = input_pipeline.padded_batch_by_length(
+        self.create_dataset([2, 6, 3, 7]),
+        batch_size=2,
+        drop_remainder=False,
+        length_bucket_boundaries=[5])
+    batch = d.make_one_shot_iterator().get_next()
+
+    with self.test_session() as sess:
+      lengths = sorted(sess.run(batch)["input_ids"].shape[1] for _ in range(2))
+
+    self.assertEqual(lengths, [3, 7])
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -0,0 +1,172 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks a `serve_classifier.py` or `serve_squad.py` server.
+
+`concurrency` clients send `num_requests` requests in total, made of the
+instances of `input_file` (one JSON instance per line, see the servers), and
+the client-side latency percentiles and throughput are logged along with the
+`/metrics` of the server:
+
+  python load_generator.py --server_url=http://localhost:8000 \
+    --input_file=instances.jsonl --num_requests=1000 --concurrency=16
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import threading
+import time
+import serving
+import six
+import tensorflow as tf
+
+flags = tf.flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string("server_url", "http://localhost:8000",
+                    "The address of the server.")
+
+flags.DEFINE_string(
+    "input_file", None,
+    "File with one JSON instance per line, e.g. a string for "
+    "`serve_classifier.py`.")
+
+flags.DEFINE_integer("num_requests", 1000, "The total number of requests.")
+
+flags.DEFINE_integer("concurrency", 8,
+                     "The number of clients sending requests at once.")
+
+flags.DEFINE_integer("instances_per_request", 1,
+                     "The number of instances in every request.")
+
+flags.DEFINE_string(
+    "output_file", None,
+    "If set, where to write the results, e.g. /tmp/load_results.txt.")
+
+
+def read_instances(input_file):
+  """Reads the JSON instances of a file, one per line."""
+  instances = []
+  with tf.gfile.GFile(input_file, "r") as reader:
+    for line in reader:
+      line = line.strip()
+      if line:
+        instances.append(json.loads(line))
+  return instances
+
+
+def send_request(url, value):
+  """POSTs a JSON value and returns the decoded JSON response."""
+  request = six.moves.urllib.request.Request(
+      url,
+      data=json.dumps(value).encode("utf-8"),
+      headers={"Content-Type": "application/json"})
+  response = six.moves.urllib.request.urlopen(request)
+  try:
+    return json.loads(response.read().decode("utf-8"))
+  finally:
+    response.close()
+
+
+def run_load(url, instances, num_requests, concurrency,
+             instances_per_request):
+  """Sends requests from concurrent clients.
+
+  Returns:
+    A tuple of the list of the latencies in seconds of the successful
+    requests, of the number of failed requests and of the total seconds.
+  """
+  lock = threading.Lock()
+  latencies = []
+  num_errors = [0]
+  next_request = [0]
+
+  def client():
+    while True:
+      with lock:
+        request_index = next_request[0]
+        next_request[0] += 1
+      if request_index >= num_requests:
+        return
+      start = request_index * instances_per_request
+      request_instances = [
+          instances[(start + i) % len(instances)]
+          for i in range(instances_per_request)
+      ]
+
+      start_time = time.time()
+      try:
+        send_request(url + "/predict", {"instances": request_instances})
+      except (IOError, ValueError) as e:
+        tf.logging.warning("Request %d failed: %s", request_index, e)
+        with lock:
+          num_errors[0] += 1
+        continue
+      with lock:
+        latencies.append(time.time() - start_time)
+
+  start_time = time.time()
+  threads = [threading.Thread(target=client) for _ in range(concurrency)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return (latencies, num_errors[0], time.time() - start_time)
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  instances = read_instances(FLAGS.input_file)
+  (latencies, num_errors, total_secs) = run_load(
+      FLAGS.server_url, instances, FLAGS.num_requests, FLAGS.concurrency,
+      FLAGS.instances_per_request)
+
+  result = {
+      "num_requests": len(latencies),
+      "num_errors": num_errors,
+      "requests_per_sec": len(latencies) / total_secs,
+      "examples_per_sec":
+          len(latencies) * FLAGS.instances_per_request / total_secs,
+  }
+  if latencies:
+    result["p50_latency_ms"] = serving.percentile(latencies, 50) * 1000.0
+    result["p99_latency_ms"] = serving.percentile(latencies, 99) * 1000.0
+
+  response = six.moves.urllib.request.urlopen(FLAGS.server_url + "/metrics")
+  try:
+    for (key, value) in json.loads(response.read().decode("utf-8")).items():
+      result["server_" + key] = value
+  finally:
+    response.close()
+
+  writer = None
+  if FLAGS.output_file:
+    writer = tf.gfile.GFile(FLAGS.output_file, "w")
+  tf.logging.info("***** Load results *****")
+  for key in sorted(result.keys()):
+    tf.logging.info("  %s = %s", key, str(result[key]))
+    if writer:
+      writer.write("%s = %s\n" % (key, str(result[key])))
+  if writer:
+    writer.close()
+
+
+if __name__ == "__main__":
+  flags.mark_flag_as_required("input_file")
+  tf.app.run()
@@ -0,0 +1,144 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Reads and writes checkpoints as a single memory-mapped weights file.
+
+The file layout is:
+
+  MAGIC (8 bytes) | header length (uint64, little endian) | JSON header |
+  padding | tensor data
+
+The JSON header maps every variable name to its dtype, shape and the offset of
+its data from the start of the tensor data. Every tensor starts at a multiple
+of `ALIGNMENT` bytes from the start of the file, so the arrays returned by
+`load_weights` are aligned views of the memory map and are never copied.
+Processes that load the same file share its pages through the page cache.
+
+This module only needs NumPy, so that serving code can load weights without
+TensorFlow.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import json
+import os
+import struct
+import numpy as np
+
+MAGIC = b"BERTMMAP"
+
+# Matches EIGEN_MAX_ALIGN_BYTES, so TensorFlow can use the buffers as they are.
+ALIGNMENT = 64
+
+_PREFIX_FORMAT = "<8sQ"
+
+
+def _align(offset):
+  return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _create_header(names, dtypes, shapes):
+  """Returns the JSON header and the total size of the tensor data."""
+  tensors = collections.OrderedDict()
+  offset = 0
+  for (name, dtype, shape) in zip(names, dtypes, shapes):
+    offset = _align(offset)
+    nbytes = int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+    tensors[name] = collections.OrderedDict([
+        ("dtype", np.dtype(dtype).name),
+        ("shape", [int(x) for x in shape]),
+        ("offset", offset),
+    ])
+    offset += nbytes
+  header = json.dumps({"alignment": ALIGNMENT, "tensors": tensors})
+  return (header.encode("utf-8"), offset)
+
+
+def _read_header(weights_file):
+  """Returns the tensor index and the file offset of the tensor data."""
+  with open(weights_file, "rb") as reader:
+    prefix = reader.read(struct.calcsize(_PREFIX_FORMAT))
+    (magic, header_length) = struct.unpack(_PREFIX_FORMAT, prefix)
+    if magic != MAGIC:
+      raise ValueError("`%s` is not a memory-mapped weights file." %
+                       weights_file)
+    header = json.loads(reader.read(header_length).decode("utf-8"))
+  data_offset = _align(len(prefix) + header_length)
+  return (header["tensors"], data_offset)
+
+
+def write_weights(names, dtypes, shapes, get_tensor, output_file):
+  """Writes tensors to a memory-mapped weights file, one at a time.
+
+  Args:
+    names: list of variable names.
+    dtypes: list of NumPy dtypes, one per name.
+    shapes: list of shapes, one per name.
+    get_tensor: function that returns the array of a variable name. It is
+      called once per name, so that only one tensor is in memory at a time.
+    output_file: Path of the weights file to write.
+  """
+  (header, _) = _create_header(names, dtypes, shapes)
+  prefix = struct.pack(_PREFIX_FORMAT, MAGIC, len(header))
+  data_offset = _align(len(prefix) + len(header))
+
+  with open(output_file, "wb") as writer:
+    writer.write(prefix)
+    writer.write(header)
+    tensors = json.loads(header.decode("utf-8"))["tensors"]
+    for (name, dtype) in zip(names, dtypes):
+      writer.seek(data_offset + tensors[name]["offset"])
+      value = np.ascontiguousarray(get_tensor(name), dtype=dtype)
+      writer.write(value.tobytes())
+
+
+def is_mmap_checkpoint(path):
+  """Returns whether `path` is a memory-mapped weights file."""
+  if not os.path.isfile(path):
+    return False
+  with open(path, "rb") as reader:
+    return reader.read(len(MAGIC)) == MAGIC
+
+
+def list_variables(weights_file):
+  """Returns a list of (name, shape) like `tf.train.list_variables`."""
+  (tensors, _) = _read_header(weights_file)
+  return [(name, tensors[name]["shape"]) for name in sorted(tensors.keys())]
+
+
+def load_weights(weights_file):
+  """Memory-maps a weights file.
+
+  Args:
+    weights_file: Path of a file written by `write_weights`.
+
+  Returns:
+    An OrderedDict from variable name to a read-only array. The arrays are
+    views of the memory map, so the data is only read from disk when it is
+    accessed, and it is shared with other processes that map the same file.
+  """
+  (tensors, data_offset) = _read_header(weights_file)
+  buf = np.memmap(weights_file, dtype=np.uint8, mode="r")
+
+  weights = collections.OrderedDict()
+  for (name, info) in tensors.items():
+    dtype = np.dtype(info["dtype"])
+    shape = info["shape"]
+    start = data_offset + info["offset"]
+    end = start + int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+    weights[name] = buf[start:end].view(dtype).reshape(shape)
+  return weights
@@ -0,0 +1,92 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import convert_checkpoint_to_mmap
+import mmap_checkpoint
+import modeling
+import numpy as np
+import tensorflow as tf
+
+
+class MmapCheckpointTest(tf.test.TestCase):
+
+  def test_round_trip(self):
+    weights = {
+        "a/kernel": np.arange(15, dtype=np.float32).reshape([3, 5]),
+        "a/bias": np.arange(3, dtype=np.float32),
+        "global_step": np.array(7, dtype=np.int64),
+    }
+    names = sorted(weights.keys())
+    weights_file = os.path.join(self.get_temp_dir(), "round_trip.mmap")
+    mmap_checkpoint.write_weights(names, [weights[x].dtype for x in names],
+                                  [weights[x].shape for x in names],
+                                  weights.get, weights_file)
+
+    self.assertTrue(mmap_checkpoint.is_mmap_checkpoint(weights_file))
+    self.assertEqual(
+        mmap_checkpoint.list_variables(weights_file),
+        [("a/bias", [3]), ("a/kernel", [3, 5]), ("global_step", [])])
+
+    loaded = mmap_checkpoint.load_weights(weights_file)
+    for name in names:
+      self.assertEqual(loaded[name].dtype, weights[name].dtype)
+      self.assertAllEqual(loaded[name], weights[name])
+      self.assertEqual(
+          loaded[name].__array_interface__["data"][0] %
+          mmap_checkpoint.ALIGNMENT, 0)
+
+  def test_init_from_checkpoint(self):
+    init_checkpoint = os.path.join(self.get_temp_dir(), "model.ckpt")
+    weights_file = os.path.join(self.get_temp_dir(), "model.mmap")
+
+    with tf.Graph().as_default():
+      with tf.variable_scope("bert"):
+        tf.get_variable("kernel", initializer=tf.random_normal([4, 6]))
+        tf.get_variable("bias", initializer=tf.random_normal([6]))
+      with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        tf.train.Saver().save(sess, init_checkpoint)
+        expected = sess.run(tf.global_variables())
+
+    self.assertFalse(mmap_checkpoint.is_mmap_checkpoint(init_checkpoint))
+    self.assertEqual(
+        convert_checkpoint_to_mmap.convert_checkpoint(init_checkpoint,
+                                                      weights_file), 2)
+
+    with tf.Graph().as_default():
+      with tf.variable_scope("bert"):
+        tf.get_variable("kernel", shape=[4, 6])
+        tf.get_variable("bias", shape=[6])
+      tvars = tf.trainable_variables()
+      (assignment_map, initialized_variable_names
+      ) = modeling.get_assignment_map_from_checkpoint(tvars, weights_file)
+      self.assertIn("bert/kernel:0", initialized_variable_names)
+      modeling.init_from_checkpoint(weights_file, assignment_map)
+
+      with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        actual = sess.run(tf.global_variables())
+
+    for (expected_value, actual_value) in zip(expected, actual):
+      self.assertAllEqual(expected_value, actual_value)
+
+
+if __name__ == "__main__":
+  tf.test.main()
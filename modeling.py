@@ -22,6 +22,7 @@ import collections
 import copy
 import json
 import math
+import mmap_checkpoint
 import re
 import numpy as np
 import six
@@ -42,7 +43,15 @@ class BertConfig(object):
                attention_probs_dropout_prob=0.1,    # 注意力部分的dropout
                max_position_embeddings=512,    # 最大位置编码
                type_vocab_size=16,    # token_type_ids的词典大小，其实就是在next_sentence_prediction任务里的Segment A和Segment B。在下载的bert_config.json文件里也有说明，默认值为2
-               initializer_range=0.02):    # truncated_normal_initializer初始化方法的stdev
+               initializer_range=0.02,    # truncated_normal_initializer初始化方法的stdev
+               recompute_grad_layers=0,    # 每多少层做一次重计算(gradient checkpointing)，0表示不重计算
+               compute_dtype="float32",    # encoder的计算精度，可以是float32、float16或bfloat16
+               unpadded_encoder=False,    # encoder的逐位置计算是否跳过padding
+               num_attention_heads_per_layer=None,    # 每一层剪枝后保留的head数，None表示每层都是num_attention_heads
+               attention_window=None,    # 局部attention的窗口大小，None表示普通的全attention
+               num_global_tokens=1,    # 局部attention时，序列开头能看到所有token的全局token数(例如[CLS])
+               embedding_size=None,    # 词向量的维度，None表示和hidden_size相同
+               share_layer_weights=False):    # 所有encoder层是否共用一套参数
     """Constructs BertConfig.
 
     Args:
@@ -66,6 +75,46 @@ class BertConfig(object):
         `BertModel`.
       initializer_range: The stdev of the truncated_normal_initializer for
         initializing all weight matrices.
+      recompute_grad_layers: If > 0, the encoder layers are run in groups of
+        this many layers whose activations are not kept for backprop but
+        recomputed during the backward pass. Trades compute for memory during
+        training and has no effect at inference time.
+      compute_dtype: The dtype the encoder layers compute in: "float32",
+        "float16" or "bfloat16". The weights are always stored in float32, and
+        the embeddings, layer normalization and attention softmax always run
+        in float32 for numerical stability.
+      unpadded_encoder: If true, the position-wise ops of the encoder (dense
+        layers, activations and layer normalization) only run on the real
+        tokens of `input_mask`, packed into a [num_tokens, hidden_size]
+        matrix. Only the attention sees the padded [batch_size, seq_length]
+        layout. Needs dynamic shapes, so it is not supported on TPU.
+      num_attention_heads_per_layer: (optional) list of `num_hidden_layers`
+        ints, the number of attention heads of each encoder layer, e.g. after
+        pruning heads with `prune_heads.py`. The size of each head is still
+        `hidden_size / num_attention_heads`, so a layer with fewer heads has
+        smaller query, key, value and attention output kernels. If None, every
+        layer has `num_attention_heads` heads.
+      attention_window: (optional) int. If given, the encoder uses sliding
+        window attention: every token only attends to the tokens at most this
+        many positions away and to the global tokens, so the memory and
+        compute of the attention are linear in the sequence length, e.g. for
+        inputs of 4096 tokens. The position embeddings of a model pre-trained
+        on shorter inputs can be extended with
+        `extend_position_embeddings.py`. If None, every token attends to
+        every token.
+      num_global_tokens: The number of tokens at the start of the sequence,
+        e.g. [CLS], that attend to and are attended by every token when
+        `attention_window` is given.
+      embedding_size: (optional) The size of the word, position and token type
+        embeddings. If smaller than `hidden_size`, the embeddings are
+        projected to `hidden_size` before the encoder (the factorized
+        embedding parameterization of Lan et al., "ALBERT: A Lite BERT"), so
+        the embedding table has vocab_size * embedding_size instead of
+        vocab_size * hidden_size parameters. If None, it is `hidden_size`.
+      share_layer_weights: If true, all the encoder layers use the same
+        weights, stored once under "encoder/layer_shared" (ALBERT's
+        cross-layer parameter sharing). The encoder then has the parameters of
+        a single layer.
     """
     self.vocab_size = vocab_size
     self.hidden_size = hidden_size
@@ -78,6 +127,14 @@ class BertConfig(object):
     self.max_position_embeddings = max_position_embeddings
     self.type_vocab_size = type_vocab_size
     self.initializer_range = initializer_range
+    self.recompute_grad_layers = recompute_grad_layers
+    self.compute_dtype = compute_dtype
+    self.unpadded_encoder = unpadded_encoder
+    self.num_attention_heads_per_layer = num_attention_heads_per_layer
+    self.attention_window = attention_window
+    self.num_global_tokens = num_global_tokens
+    self.embedding_size = embedding_size
+    self.share_layer_weights = share_layer_weights
 
   @classmethod
   def from_dict(cls, json_object):
@@ -134,20 +191,51 @@ class BertModel(object):
                input_ids,
                input_mask=None,
                token_type_ids=None,
-               use_one_hot_embeddings=False,
-               scope=None):
+               use_one_hot_embeddings=None,
+               scope=None,
+               head_mask=None,
+               early_exit_fn=None,
+               max_layer_depth=None,
+               use_pooler=True,
+               cls_only_last_layer=False):
     """Constructor for BertModel.
 
     Args:
       config: `BertConfig` instance. 对象
       is_training: bool. true for training model, false for eval model. Controls 
         whether dropout will be applied. 表示训练还是eval，是会影响dropout
+        An eval model also caches its fused Q/K/V weights in local variables,
+        so `tf.local_variables_initializer()` must run after the weights are
+        initialized or restored, see `fused_qkv_projection`.
       input_ids: int32 Tensor of shape [batch_size, seq_length].
       input_mask: (optional) int32 Tensor of shape [batch_size, seq_length].
       token_type_ids: (optional) int32 Tensor of shape [batch_size, seq_length].
       use_one_hot_embeddings: (optional) bool. Whether to use one-hot word 
         embeddings or tf.embedding_lookup() for the word embeddings. 如果True，使用矩阵乘法实现提取词的Embedding；否则用tf.embedding_lookup()，对于TPU，使用前者更快，对于GPU和CPU，后者更快
+        If None, one-hot embeddings are used when the model is compiled by
+        XLA, e.g. on TPU, and `tf.gather()` otherwise, see `is_xla_compiled`.
+        This also applies to the token type embeddings. None表示根据平台自动选择
       scope: (optional) variable scope. Defaults to "bert". 变量的scope。默认是"bert"
+      head_mask: (optional) float Tensor of shape [num_hidden_layers,
+        num_attention_heads] that multiplies the output of every attention
+        head, e.g. to compute the gradient of the loss with respect to each
+        head. See `transformer_model`.
+      early_exit_fn: (optional) function that lets examples leave the encoder
+        after any layer but the last, see `transformer_model`. The sequence
+        and pooled outputs then only hold the examples that reached the last
+        layer, at the batch positions of `get_remaining_indices()`, and
+        `get_all_encoder_layers()` only holds the last layer.
+      max_layer_depth: (optional) int. If given, only the first
+        `max_layer_depth` encoder layers are built and run, e.g. to extract
+        the features of a lower layer. The sequence output is then the output
+        of the last built layer. 只构建前max_layer_depth层
+      use_pooler: (optional) bool. Whether to build the pooler. If False,
+        `get_pooled_output()` returns None.
+      cls_only_last_layer: (optional) bool. Whether the last encoder layer
+        only computes the output at the [CLS] position, which is all the
+        pooler reads. The sequence output and the last entry of
+        `get_all_encoder_layers()` are then of shape [batch_size, 1,
+        hidden_size]. See `transformer_model`. 分类任务只需要最后一层[CLS]的输出
 
     Raises:
       ValueError: The config is invalid or one of the input tensor shapes
@@ -157,6 +245,16 @@ class BertModel(object):
     if not is_training:    # 如果不是训练，那么把dropout都置为零
       config.hidden_dropout_prob = 0.0
       config.attention_probs_dropout_prob = 0.0
+      config.recompute_grad_layers = 0
+    if max_layer_depth is not None:
+      if not 1 <= max_layer_depth <= config.num_hidden_layers:
+        raise ValueError(
+            "`max_layer_depth` (%d) must be between 1 and the number of "
+            "layers (%d)" % (max_layer_depth, config.num_hidden_layers))
+      config.num_hidden_layers = max_layer_depth
+      if config.num_attention_heads_per_layer is not None:
+        config.num_attention_heads_per_layer = (
+            config.num_attention_heads_per_layer[:max_layer_depth])
 
     input_shape = get_shape_list(input_ids, expected_rank=2)
     batch_size = input_shape[0]
@@ -169,13 +267,19 @@ class BertModel(object):
     if token_type_ids is None:
       token_type_ids = tf.zeros(shape=[batch_size, seq_length], dtype=tf.int32)
 
-    with tf.variable_scope(scope, default_name="bert"):
+    # 权重始终以float32保存，需要低精度时在读取变量时cast成`compute_dtype`
+    compute_dtype = tf.as_dtype(config.compute_dtype)
+    embedding_size = config.embedding_size or config.hidden_size
+    with tf.variable_scope(
+        scope,
+        default_name="bert",
+        custom_getter=get_float32_variable_getter(compute_dtype)):
       with tf.variable_scope("embeddings"):
         # Perform embedding lookup on the word ids. # 词的Embedding lookup
         (self.embedding_output, self.embedding_table) = embedding_lookup(
             input_ids=input_ids,
             vocab_size=config.vocab_size,
-            embedding_size=config.hidden_size,
+            embedding_size=embedding_size,
             initializer_range=config.initializer_range,
             word_embedding_name="word_embeddings",
             use_one_hot_embeddings=use_one_hot_embeddings)
@@ -192,26 +296,34 @@ class BertModel(object):
             position_embedding_name="position_embeddings",
             initializer_range=config.initializer_range,
             max_position_embeddings=config.max_position_embeddings,
-            dropout_prob=config.hidden_dropout_prob)
+            dropout_prob=config.hidden_dropout_prob,
+            use_one_hot_embeddings=use_one_hot_embeddings)
 
       with tf.variable_scope("encoder"):
-        # This converts a 2D mask of shape [batch_size, seq_length] to a 3D
-        # mask of shape [batch_size, seq_length, seq_length] which is used
-        # for the attention scores.
+        # This converts a 2D mask of shape [batch_size, seq_length] to the
+        # additive bias of shape [batch_size, 1, 1, seq_length] which is
+        # broadcast against the attention scores of every layer.
         # 把shape为[batch_size, seq_length]的2D mask变成
-		    # shape为[batch_size, seq_length, seq_length]的3D mask
-		    # 以便后向的attention计算，例如# input_ids是经过padding的word_ids：[25, 120, 34, 0, 0]，input_mask是有效词标记：[1, 1, 1, 0, 0]
-        attention_mask = create_attention_mask_from_input_mask(
-            input_ids, input_mask)
+        # shape为[batch_size, 1, 1, seq_length]的bias，只计算一次，每一层共用
+        # 例如input_ids是经过padding的word_ids：[25, 120, 34, 0, 0]，input_mask是有效词标记：[1, 1, 1, 0, 0]
+        attention_bias = create_attention_bias_from_input_mask(input_mask)
+
+        encoder_input = tf.cast(self.embedding_output, compute_dtype)
+        if embedding_size != config.hidden_size:
+          # 因式分解的embedding：查的是embedding_size维的向量，再投影到hidden_size
+          encoder_input = tf.layers.dense(
+              encoder_input,
+              config.hidden_size,
+              name="embedding_hidden_mapping_in",
+              kernel_initializer=create_initializer(config.initializer_range))
 
         # Run the stacked transformer.
         # `sequence_output` shape = [batch_size, seq_length, hidden_size].
         # 多个Transformer模型stack起来。
   		  # all_encoder_layers是一个list，长度为num_hidden_layers（默认12），每一层对应一个值。
 	  	  # 每一个值都是一个shape为[batch_size, seq_length, hidden_size]的tensor。
-        self.all_encoder_layers = transformer_model(
-            input_tensor=self.embedding_output,
-            attention_mask=attention_mask,
+        encoder_outputs = transformer_model(
+            input_tensor=encoder_input,
             hidden_size=config.hidden_size,
             num_hidden_layers=config.num_hidden_layers,
             num_attention_heads=config.num_attention_heads,
@@ -220,29 +332,53 @@ class BertModel(object):
             hidden_dropout_prob=config.hidden_dropout_prob,
             attention_probs_dropout_prob=config.attention_probs_dropout_prob,
             initializer_range=config.initializer_range,
-            do_return_all_layers=True)
+            do_return_all_layers=early_exit_fn is None,
+            recompute_grad_layers=config.recompute_grad_layers,
+            input_mask=input_mask if config.unpadded_encoder else None,
+            num_attention_heads_per_layer=config.num_attention_heads_per_layer,
+            head_mask=head_mask,
+            early_exit_fn=early_exit_fn,
+            cls_only_last_layer=cls_only_last_layer,
+            attention_window=config.attention_window,
+            num_global_tokens=config.num_global_tokens,
+            attention_bias=attention_bias,
+            share_layer_weights=config.share_layer_weights,
+            # The weights do not change during inference, so the fused Q/K/V
+            # weights are concatenated once. Only on CPU and GPU.
+            cache_fused_qkv=not is_training and not is_xla_compiled())
+        self.remaining_indices = None
+        if early_exit_fn is not None:
+          (encoder_outputs, self.remaining_indices) = encoder_outputs
+          encoder_outputs = [encoder_outputs]
+        # The task heads and the pooler always see float32.
+        self.all_encoder_layers = [
+            tf.cast(layer, tf.float32) for layer in encoder_outputs
+        ]
 
       # `sequence_output` 是最后一层的输出，shape是[batch_size, seq_length, hidden_size]
       self.sequence_output = self.all_encoder_layers[-1]
-      # The "pooler" converts the encoded sequence tensor of shape
-      # [batch_size, seq_length, hidden_size] to a tensor of shape
-      # [batch_size, hidden_size]. This is necessary for segment-level
-      # (or segment-pair-level) classification tasks where we need a fixed
-      # dimensional representation of the segment.
-      with tf.variable_scope("pooler"):
-        # We "pool" the model by simply taking the hidden state corresponding
-        # to the first token. We assume that this has been pre-trained
-        # 取最后一层的第一个时刻[CLS]对应的tensor
+      self.pooled_output = None
+      if use_pooler:
+        # The "pooler" converts the encoded sequence tensor of shape
+        # [batch_size, seq_length, hidden_size] to a tensor of shape
+        # [batch_size, hidden_size]. This is necessary for segment-level
+        # (or segment-pair-level) classification tasks where we need a fixed
+        # dimensional representation of the segment.
+        with tf.variable_scope("pooler"):
+          # We "pool" the model by simply taking the hidden state corresponding
+          # to the first token. We assume that this has been pre-trained
+          # 取最后一层的第一个时刻[CLS]对应的tensor
 		    # 从[batch_size, seq_length, hidden_size]变成[batch_size, hidden_size]
 		    # sequence_output[:, 0:1, :]得到的是[batch_size, 1, hidden_size]
 		    # 我们需要用squeeze把第二维去掉。
-        first_token_tensor = tf.squeeze(self.sequence_output[:, 0:1, :], axis=1)
-        # 然后再加一个全连接层，输出仍然是[batch_size, hidden_size]
-        self.pooled_output = tf.layers.dense(
-            first_token_tensor,
-            config.hidden_size,
-            activation=tf.tanh,
-            kernel_initializer=create_initializer(config.initializer_range))
+          first_token_tensor = tf.squeeze(
+              self.sequence_output[:, 0:1, :], axis=1)
+          # 然后再加一个全连接层，输出仍然是[batch_size, hidden_size]
+          self.pooled_output = tf.layers.dense(
+              first_token_tensor,
+              config.hidden_size,
+              activation=tf.tanh,
+              kernel_initializer=create_initializer(config.initializer_range))
 
   def get_pooled_output(self):
     return self.pooled_output
@@ -259,6 +395,15 @@ class BertModel(object):
   def get_all_encoder_layers(self):
     return self.all_encoder_layers
 
+  def get_remaining_indices(self):
+    """Gets the batch positions of the examples that reached the last layer.
+
+    Returns:
+      int32 Tensor of shape [num_remaining] if the model was built with an
+      `early_exit_fn`, None otherwise.
+    """
+    return self.remaining_indices
+
   def get_embedding_output(self):
     """Gets output of the embedding lookup (i.e., input to the transformer).
 
@@ -267,6 +412,8 @@ class BertModel(object):
       to the output of the embedding layer, after summing the word
       embeddings with the positional embeddings and the token type embeddings,
       then performing layer normalization. This is the input to the transformer.
+      With a factorized embedding its last dimension is `embedding_size`, and
+      it is projected to `hidden_size` before the transformer.
     """
     return self.embedding_output
 
@@ -285,8 +432,10 @@ def gelu(x):
   Returns:
     `x` with the GELU activation applied.
   """
+  # `math.sqrt` keeps the constant a Python float, so that it takes the dtype
+  # of `x` in float16/bfloat16 graphs.
   cdf = 0.5 * (1.0 + tf.tanh(
-      (np.sqrt(2 / np.pi) * (x + 0.044715 * tf.pow(x, 3)))))
+      (math.sqrt(2 / math.pi) * (x + 0.044715 * tf.pow(x, 3)))))
   return x * cdf
 
 
@@ -327,6 +476,34 @@ def get_activation(activation_string):
     raise ValueError("Unsupported activation: %s" % act)
 
 
+def get_float32_variable_getter(compute_dtype):
+  """Returns a custom getter that keeps float32 weights for `compute_dtype`.
+
+  When a layer asks for a trainable variable of a lower precision dtype, the
+  variable is created (and checkpointed) in float32 under the same name, and a
+  cast of it to the requested dtype is returned instead.
+
+  Args:
+    compute_dtype: `tf.DType` the model computes in.
+
+  Returns:
+    A custom getter for `tf.variable_scope`, or None for float32.
+  """
+  if compute_dtype == tf.float32:
+    return None
+
+  def float32_variable_getter(getter, name, shape=None, dtype=None,
+                              trainable=True, *args, **kwargs):
+    storage_dtype = tf.float32 if trainable else dtype
+    variable = getter(name, shape, dtype=storage_dtype, trainable=trainable,
+                      *args, **kwargs)
+    if trainable and dtype is not None and dtype != tf.float32:
+      variable = tf.cast(variable, dtype)
+    return variable
+
+  return float32_variable_getter
+
+
 def get_assignment_map_from_checkpoint(tvars, init_checkpoint):
   """Compute the union of the current variables and checkpoint variables."""
   assignment_map = {}
@@ -340,7 +517,10 @@ def get_assignment_map_from_checkpoint(tvars, init_checkpoint):
       name = m.group(1)
     name_to_variable[name] = var
 
-  init_vars = tf.train.list_variables(init_checkpoint)
+  if mmap_checkpoint.is_mmap_checkpoint(init_checkpoint):
+    init_vars = mmap_checkpoint.list_variables(init_checkpoint)
+  else:
+    init_vars = tf.train.list_variables(init_checkpoint)
 
   assignment_map = collections.OrderedDict()
   for x in init_vars:
@@ -354,13 +534,56 @@ def get_assignment_map_from_checkpoint(tvars, init_checkpoint):
   return (assignment_map, initialized_variable_names)
 
 
-def dropout(input_tensor, dropout_prob):
+def init_from_checkpoint(init_checkpoint, assignment_map):
+  """Like `tf.train.init_from_checkpoint`, but also reads memory-mapped files.
+
+  `init_checkpoint` may be a TensorFlow checkpoint or a weights file written by
+  `convert_checkpoint_to_mmap.py`, which is mapped into memory instead of being
+  restored through the TF saver. Memory-mapped files are fed through
+  `tf.py_func`, so they are not supported on TPU.
+
+  Args:
+    init_checkpoint: Path of the checkpoint or of the weights file.
+    assignment_map: dict from checkpoint variable names to current variable
+      names, as returned by `get_assignment_map_from_checkpoint`.
+  """
+  if not mmap_checkpoint.is_mmap_checkpoint(init_checkpoint):
+    tf.train.init_from_checkpoint(init_checkpoint, assignment_map)
+    return
+
+  weights = mmap_checkpoint.load_weights(init_checkpoint)
+
+  name_to_variable = {}
+  for var in tf.global_variables():
+    name_to_variable[var.op.name] = var
+
+  # Same as `tf.train.init_from_checkpoint`: replace the initializers, so that
+  # `tf.global_variables_initializer()` assigns the memory-mapped buffers.
+  # 只把内存映射的buffer传给TF，不在graph里保存常量，也不经过saver的restore
+  for (checkpoint_name, variable_name) in assignment_map.items():
+    var = name_to_variable[variable_name]
+    value = weights[checkpoint_name]
+    with tf.device("/cpu:0"):
+      initial_value = tf.py_func(
+          lambda value=value: value, [],
+          tf.as_dtype(value.dtype),
+          stateful=False,
+          name="mmap_init")
+    initial_value.set_shape(value.shape)
+    # pylint: disable=protected-access
+    var._initializer_op = tf.assign(var, initial_value)
+    var._initial_value = initial_value
+    # pylint: enable=protected-access
+
+
+def dropout(input_tensor, dropout_prob, seed=None):
   """Perform dropout.
 
   Args:
     input_tensor: float Tensor.
     dropout_prob: Python float. The probability of dropping out a value (NOT of
       *keeping* a dimension as in `tf.nn.dropout`).
+    seed: (optional) Python int. Op-level random seed of the dropout mask.
 
   Returns:
     A version of `input_tensor` with dropout applied.
@@ -368,14 +591,22 @@ def dropout(input_tensor, dropout_prob):
   if dropout_prob is None or dropout_prob == 0.0:
     return input_tensor
 
-  output = tf.nn.dropout(input_tensor, 1.0 - dropout_prob)
+  output = tf.nn.dropout(input_tensor, 1.0 - dropout_prob, seed=seed)
   return output
 
 
 def layer_norm(input_tensor, name=None):
-  """Run layer normalization on the last dimension of the tensor."""
-  return tf.contrib.layers.layer_norm(
-      inputs=input_tensor, begin_norm_axis=-1, begin_params_axis=-1, scope=name)
+  """Run layer normalization on the last dimension of the tensor.
+
+  Lower precision inputs are normalized in float32 and cast back.
+  """
+  input_dtype = input_tensor.dtype.base_dtype
+  output_tensor = tf.contrib.layers.layer_norm(
+      inputs=tf.cast(input_tensor, tf.float32),
+      begin_norm_axis=-1,
+      begin_params_axis=-1,
+      scope=name)
+  return tf.cast(output_tensor, input_dtype)
 
 
 def layer_norm_and_dropout(input_tensor, dropout_prob, name=None):
@@ -390,12 +621,28 @@ def create_initializer(initializer_range=0.02):
   return tf.truncated_normal_initializer(stddev=initializer_range)
 
 
+def is_xla_compiled():
+  """Returns whether the ops being built are compiled by XLA, e.g. on TPU.
+
+  `TPUEstimator` builds the `model_fn` of a TPU job inside an XLA context, so
+  this is True on TPU and False on CPU and GPU.
+  """
+  # pylint: disable=protected-access
+  context = tf.get_default_graph()._get_control_flow_context()
+  # pylint: enable=protected-access
+  while context is not None:
+    if context.IsXLAContext():
+      return True
+    context = context.outer_context
+  return False
+
+
 def embedding_lookup(input_ids,
                      vocab_size,
                      embedding_size=128,
                      initializer_range=0.02,
                      word_embedding_name="word_embeddings",
-                     use_one_hot_embeddings=False):
+                     use_one_hot_embeddings=None):
   """Looks up words embeddings for id tensor.
 
   Args:
@@ -407,6 +654,7 @@ def embedding_lookup(input_ids,
     word_embedding_name: string. Name of the embedding table. 名字，默认是"word_embeddings"
     use_one_hot_embeddings: bool. If True, use one-hot method for word 如果True，使用one-hot方法实现embedding；
       embeddings. If False, use `tf.gather()`. 否则，TPU适合用One hot方法。
+      If None, use the one-hot method only if `is_xla_compiled()`.
 
   Returns:
     float Tensor of shape [batch_size, seq_length, embedding_size].
@@ -432,6 +680,9 @@ def embedding_lookup(input_ids,
       shape=[vocab_size, embedding_size],
       initializer=create_initializer(initializer_range))
 
+  if use_one_hot_embeddings is None:
+    use_one_hot_embeddings = is_xla_compiled()
+
   flat_input_ids = tf.reshape(input_ids, [-1])
   if use_one_hot_embeddings:
     one_hot_input_ids = tf.one_hot(flat_input_ids, depth=vocab_size)
@@ -456,7 +707,8 @@ def embedding_postprocessor(input_tensor,
                             position_embedding_name="position_embeddings",
                             initializer_range=0.02,
                             max_position_embeddings=512,
-                            dropout_prob=0.1):
+                            dropout_prob=0.1,
+                            use_one_hot_embeddings=None):
   """Performs various post-processing on a word embedding tensor. 对word embedding之后的tensor进行后处理
 
   Args:
@@ -477,6 +729,10 @@ def embedding_postprocessor(input_tensor,
       used with this model. This can be longer than the sequence length of
       input_tensor, but cannot be shorter. 位置编码的最大长度，可以比最大序列长度大，但是不能比它小。
     dropout_prob: float. Dropout probability applied to the final output tensor. Dropout 概率
+    use_one_hot_embeddings: (optional) bool. Whether to look up the token type
+      embeddings with a one-hot matmul, which is faster on TPU, or with
+      `tf.gather()`, which is faster on CPU and GPU. If None, use the one-hot
+      method only if `is_xla_compiled()`.
 
   Returns:
     float tensor with same shape as `input_tensor`.
@@ -500,14 +756,24 @@ def embedding_postprocessor(input_tensor,
         name=token_type_embedding_name,
         shape=[token_type_vocab_size, width],
         initializer=create_initializer(initializer_range))
-    # This vocab will be small so we always do one-hot here, since it is always
-    # faster for a small vocabulary.
-    # 因为Token Type通常很小(2)，所以直接用矩阵乘法(one-hot)更快
-    flat_token_type_ids = tf.reshape(token_type_ids, [-1])
-    one_hot_ids = tf.one_hot(flat_token_type_ids, depth=token_type_vocab_size)
-    token_type_embeddings = tf.matmul(one_hot_ids, token_type_table)
-    token_type_embeddings = tf.reshape(token_type_embeddings,
-                                       [batch_size, seq_length, width])
+    if use_one_hot_embeddings is None:
+      use_one_hot_embeddings = is_xla_compiled()
+    if use_one_hot_embeddings:
+      # This vocab will be small so one-hot is fast on TPU, where gathers
+      # are slow.
+      # 在TPU上Token Type很小(2)，直接用矩阵乘法(one-hot)更快
+      flat_token_type_ids = tf.reshape(token_type_ids, [-1])
+      one_hot_ids = tf.one_hot(flat_token_type_ids,
+                               depth=token_type_vocab_size)
+      token_type_embeddings = tf.matmul(one_hot_ids, token_type_table)
+      token_type_embeddings = tf.reshape(token_type_embeddings,
+                                         [batch_size, seq_length, width])
+    else:
+      # On CPU and GPU a gather reads one row per token instead of
+      # materializing the [batch_size * seq_length, token_type_vocab_size]
+      # one-hot matrix and multiplying it.
+      # CPU和GPU上直接gather，不需要one-hot矩阵和矩阵乘法
+      token_type_embeddings = tf.gather(token_type_table, token_type_ids)
     output += token_type_embeddings
 
   if use_position_embeddings:
@@ -597,6 +863,318 @@ def create_attention_mask_from_input_mask(from_tensor, to_mask):
   return mask
 
 
+def create_attention_bias(attention_mask):
+  """Converts an attention mask to the bias added to the attention scores.
+
+  Args:
+    attention_mask: Tensor of shape [batch_size, from_seq_length,
+      to_seq_length], or [batch_size, 1, to_seq_length] if every query uses
+      the same mask, with 1 for the positions that can be attended to and 0
+      for the others.
+
+  Returns:
+    float32 Tensor of shape [batch_size, 1, from_seq_length, to_seq_length]
+    (resp. [batch_size, 1, 1, to_seq_length]), which broadcasts against the
+    attention scores of shape [batch_size, num_attention_heads,
+    from_seq_length, to_seq_length].
+  """
+  # `attention_mask` = [B, 1, F, T]
+  attention_mask = tf.expand_dims(attention_mask, axis=[1])
+
+  # Since attention_mask is 1.0 for positions we want to attend and 0.0 for
+  # masked positions, this operation will create a tensor which is 0.0 for
+  # positions we want to attend and -10000.0 for masked positions.
+  # 如果mask是1，那么(1-1)*-10000=0，bias就是0；如果mask是0，那么(1-0)*-10000=-10000。
+  return (1.0 - tf.cast(attention_mask, tf.float32)) * -10000.0
+
+
+def create_attention_bias_from_input_mask(input_mask):
+  """Creates the attention bias of a batch once for all the layers.
+
+  Unlike `create_attention_mask_from_input_mask`, no [batch_size, seq_length,
+  seq_length] tensor is materialized: every query of a sequence gets the
+  same bias, which is broadcast against the attention scores.
+  只构造[batch_size, 1, 1, seq_length]的bias，所有层共用
+
+  Args:
+    input_mask: int32 Tensor of shape [batch_size, seq_length].
+
+  Returns:
+    float32 Tensor of shape [batch_size, 1, 1, seq_length], 0 for the real
+    tokens and -10000 for the padding.
+  """
+  input_shape = get_shape_list(input_mask, expected_rank=2)
+  return create_attention_bias(
+      tf.reshape(input_mask, [input_shape[0], 1, input_shape[1]]))
+
+
+def fused_qkv_projection(input_tensor_2d, num_attention_heads, size_per_head,
+                         batch_size, seq_length, initializer_range=0.02,
+                         cache_fused_weights=False, token_indices=None):
+  """Computes the self-attention query, key and value with one matmul.
+
+  Creates the same `query`, `key` and `value` kernel and bias variables as
+  three `tf.layers.dense` calls would, and concatenates them into a single
+  [width, 3 * num_attention_heads * size_per_head] projection.
+
+  The concatenation is a copy of the kernels on every step. For inference,
+  `cache_fused_weights` makes it run once instead: the fused kernel and bias
+  are then local variables under "fused_qkv", initialized from the `query`,
+  `key` and `value` variables by `tf.local_variables_initializer()`, which
+  must run after the weights are initialized or restored, as `tf.train.Scaffold`
+  does. They are not checkpointed and get no gradient.
+
+  Args:
+    input_tensor_2d: float Tensor of shape [batch_size * seq_length, width].
+    num_attention_heads: int. Number of attention heads.
+    size_per_head: int. Size of each attention head.
+    batch_size: int. Batch size of the 3D version of `input_tensor_2d`.
+    seq_length: int. Sequence length of the 3D version of `input_tensor_2d`.
+    initializer_range: float. Range of the weight initializer.
+    cache_fused_weights: (optional) bool. Whether to concatenate the weights
+      once into local variables, see above. Only for inference.
+    token_indices: (optional) int64 Tensor of shape [num_tokens, 1]. If given,
+      `input_tensor_2d` only holds the rows at these indices of the
+      [batch_size * seq_length, width] input. The projection runs on those
+      rows and its output is scattered back, with zeros for the other rows.
+
+  Returns:
+    A tuple of the query, key and value Tensors, each of shape
+    [batch_size, num_attention_heads, seq_length, size_per_head].
+  """
+  width = get_shape_list(input_tensor_2d, expected_rank=2)[1]
+  dtype = input_tensor_2d.dtype.base_dtype
+  units = num_attention_heads * size_per_head
+
+  kernels = []
+  biases = []
+  for name in ["query", "key", "value"]:
+    with tf.variable_scope(name):
+      kernels.append(
+          tf.get_variable(
+              "kernel",
+              shape=[width, units],
+              dtype=dtype,
+              initializer=create_initializer(initializer_range)))
+      biases.append(
+          tf.get_variable(
+              "bias",
+              shape=[units],
+              dtype=dtype,
+              initializer=tf.zeros_initializer()))
+
+  fused_kernel = tf.concat(kernels, axis=1)
+  fused_bias = tf.concat(biases, axis=0)
+  if cache_fused_weights:
+    # 推理时权重不变，拼接好的kernel存在local variable里，只拼接一次
+    # AUTO_REUSE: layers that share their weights also share the cache.
+    with tf.variable_scope("fused_qkv", reuse=tf.AUTO_REUSE):
+      fused_kernel = tf.get_variable(
+          "kernel",
+          initializer=fused_kernel,
+          trainable=False,
+          collections=[tf.GraphKeys.LOCAL_VARIABLES])
+      fused_bias = tf.get_variable(
+          "bias",
+          initializer=fused_bias,
+          trainable=False,
+          collections=[tf.GraphKeys.LOCAL_VARIABLES])
+
+  # `qkv_layer` = [B*S, 3*N*H]
+  qkv_layer = tf.matmul(input_tensor_2d, fused_kernel)
+  qkv_layer = tf.nn.bias_add(qkv_layer, fused_bias)
+  if token_indices is not None:
+    # 只有这里需要[B*S]的布局，padding的行是0
+    qkv_layer = tf.scatter_nd(
+        token_indices, qkv_layer,
+        tf.to_int64([batch_size * seq_length, 3 * units]))
+
+  # `qkv_layer` = [3, B, N, S, H]
+  qkv_layer = tf.reshape(
+      qkv_layer,
+      [batch_size, seq_length, 3, num_attention_heads, size_per_head])
+  qkv_layer = tf.transpose(qkv_layer, [2, 0, 3, 1, 4])
+
+  (query_layer, key_layer, value_layer) = tf.unstack(qkv_layer, num=3, axis=0)
+  return (query_layer, key_layer, value_layer)
+
+
+def sliding_window_attention(query_layer,
+                             key_layer,
+                             value_layer,
+                             attention_bias,
+                             attention_window,
+                             num_global_tokens=0,
+                             attention_probs_dropout_prob=0.0,
+                             dropout_seed=None):
+  """Self-attention restricted to a band around the diagonal plus global tokens.
+
+  Every token attends to the tokens at most `attention_window` positions away
+  and to the first `num_global_tokens` tokens, e.g. [CLS]. The global tokens
+  attend to every token. The sequence is split into blocks of
+  `attention_window` tokens and the queries of a block are only scored
+  against the keys of the block and of its two neighbouring blocks, so the
+  memory and compute are linear in the sequence length instead of quadratic.
+  把序列切成大小为`attention_window`的块，每个块的query只和自己及前后两个块的key计算score
+
+  Args:
+    query_layer: float Tensor of shape [batch_size, num_attention_heads,
+      seq_length, size_per_head].
+    key_layer: float Tensor of the same shape as `query_layer`.
+    value_layer: float Tensor of the same shape as `query_layer`.
+    attention_bias: float Tensor of shape [batch_size, 1, 1, seq_length]
+      added to the attention scores of every query, e.g. from
+      `create_attention_bias_from_input_mask`.
+    attention_window: int. The maximum distance between a token and the
+      tokens it attends to.
+    num_global_tokens: (optional) int. The number of global tokens at the
+      start of the sequence.
+    attention_probs_dropout_prob: (optional) float. Dropout probability of
+      the attention probabilities.
+    dropout_seed: (optional) int. Op-level seed of the dropout.
+
+  Returns:
+    float Tensor of shape [batch_size, num_attention_heads, seq_length,
+    size_per_head], the context layer.
+
+  Raises:
+    ValueError: There are more global tokens than tokens, for a static
+      sequence length.
+  """
+  (batch_size, num_heads, seq_length, size_per_head) = get_shape_list(
+      query_layer, expected_rank=4)
+  # The sequence length is only known when the graph is built for a fixed one.
+  if (isinstance(seq_length, six.integer_types) and
+      num_global_tokens > seq_length):
+    raise ValueError(
+        "`num_global_tokens` (%d) is larger than the sequence length (%d)" %
+        (num_global_tokens, seq_length))
+  compute_dtype = query_layer.dtype.base_dtype
+  scale = 1.0 / math.sqrt(float(size_per_head))
+  # `to_bias` = [B, S]
+  to_bias = tf.reshape(tf.cast(attention_bias, tf.float32),
+                       [batch_size, seq_length])
+
+  # Scalar dimensions referenced here:
+  #   K = number of blocks
+  #   W = `attention_window`
+  #   G = `num_global_tokens`
+  num_blocks = (seq_length + attention_window - 1) // attention_window
+  pad_length = num_blocks * attention_window - seq_length
+
+  def to_blocks(tensor):
+    """[B, N, S, H] -> [B, N, K, W, H], padded to a whole number of blocks."""
+    tensor = tf.pad(tensor, [[0, 0], [0, 0], [0, pad_length], [0, 0]])
+    return tf.reshape(
+        tensor,
+        [batch_size, num_heads, num_blocks, attention_window, size_per_head])
+
+  def with_neighbours(blocks, block_axis):
+    """Concatenates every block with its previous and next block.
+
+    The blocks before the first and after the last one are zeros.
+    """
+    rank = len(blocks.shape)
+    paddings = [[0, 0]] * rank
+    paddings[block_axis] = [1, 1]
+    blocks = tf.pad(blocks, paddings)
+    neighbours = []
+    for offset in range(3):
+      begin = [0] * rank
+      begin[block_axis] = offset
+      size = [-1] * rank
+      size[block_axis] = num_blocks
+      neighbours.append(tf.slice(blocks, begin, size))
+    return tf.concat(neighbours, axis=block_axis + 1)
+
+  # `local_bias` = [B, K, W, 3W]
+  # The keys of block `k` are the tokens from (k - 1) * W to (k + 2) * W.
+  bias_blocks = tf.reshape(
+      tf.pad(to_bias, [[0, 0], [0, pad_length]]),
+      [batch_size, num_blocks, attention_window])
+  query_offsets = tf.range(attention_window)
+  key_offsets = tf.range(3 * attention_window) - attention_window
+  # 只保留距离不超过`attention_window`的key，全局token的key在后面单独计算
+  in_band = tf.less_equal(
+      tf.abs(tf.expand_dims(key_offsets, 0) - tf.expand_dims(query_offsets, 1)),
+      attention_window)
+  key_positions = (
+      tf.expand_dims(tf.range(num_blocks) * attention_window, 1) +
+      tf.expand_dims(key_offsets, 0))
+  is_local_key = tf.logical_and(
+      tf.greater_equal(key_positions, num_global_tokens),
+      tf.less(key_positions, seq_length))
+  is_attended = tf.logical_and(
+      tf.expand_dims(in_band, 0), tf.expand_dims(is_local_key, 1))
+  local_bias = tf.expand_dims(with_neighbours(bias_blocks, 1), 2) + (
+      1.0 - tf.cast(is_attended, tf.float32)) * -10000.0
+
+  query_blocks = to_blocks(query_layer)
+  # `local_scores` = [B, N, K, W, 3W]
+  local_scores = tf.matmul(
+      query_blocks, with_neighbours(to_blocks(key_layer), 2), transpose_b=True)
+  local_scores = tf.cast(local_scores * scale, tf.float32)
+  local_scores += tf.expand_dims(local_bias, 1)
+  attention_scores = [local_scores]
+
+  if num_global_tokens:
+    global_keys = key_layer[:, :, :num_global_tokens, :]
+    global_values = value_layer[:, :, :num_global_tokens, :]
+    # `global_scores` = [B, N, K, W, G]
+    global_scores = tf.matmul(
+        tf.reshape(query_blocks, [
+            batch_size, num_heads, num_blocks * attention_window,
+            size_per_head
+        ]),
+        global_keys,
+        transpose_b=True)
+    global_scores = tf.reshape(
+        tf.cast(global_scores * scale, tf.float32),
+        [batch_size, num_heads, num_blocks, attention_window,
+         num_global_tokens])
+    global_scores += tf.reshape(to_bias[:, :num_global_tokens],
+                                [batch_size, 1, 1, 1, num_global_tokens])
+    attention_scores.append(global_scores)
+
+  # `attention_probs` = [B, N, K, W, 3W + G]
+  attention_probs = tf.nn.softmax(tf.concat(attention_scores, axis=-1))
+  attention_probs = tf.cast(attention_probs, compute_dtype)
+  attention_probs = dropout(attention_probs, attention_probs_dropout_prob,
+                            seed=dropout_seed)
+
+  # `context_layer` = [B, N, K * W, H]
+  context_layer = tf.matmul(attention_probs[:, :, :, :, :3 * attention_window],
+                            with_neighbours(to_blocks(value_layer), 2))
+  context_layer = tf.reshape(
+      context_layer,
+      [batch_size, num_heads, num_blocks * attention_window, size_per_head])
+  if num_global_tokens:
+    global_probs = tf.reshape(
+        attention_probs[:, :, :, :, 3 * attention_window:],
+        [batch_size, num_heads, num_blocks * attention_window,
+         num_global_tokens])
+    context_layer += tf.matmul(global_probs, global_values)
+  context_layer = context_layer[:, :, :seq_length, :]
+
+  if num_global_tokens:
+    # 全局token的query和所有key计算score，[B, N, G, S]
+    global_query_scores = tf.matmul(
+        query_layer[:, :, :num_global_tokens, :], key_layer, transpose_b=True)
+    global_query_scores = tf.cast(global_query_scores * scale, tf.float32)
+    global_query_scores += tf.reshape(to_bias, [batch_size, 1, 1, seq_length])
+    global_query_probs = tf.cast(
+        tf.nn.softmax(global_query_scores), compute_dtype)
+    global_query_probs = dropout(global_query_probs,
+                                 attention_probs_dropout_prob,
+                                 seed=dropout_seed)
+    context_layer = tf.concat([
+        tf.matmul(global_query_probs, value_layer),
+        context_layer[:, :, num_global_tokens:, :]
+    ], axis=2)
+
+  return context_layer
+
+
 def attention_layer(from_tensor,
                     to_tensor,
                     attention_mask=None,
@@ -610,7 +1188,14 @@ def attention_layer(from_tensor,
                     do_return_2d_tensor=False,
                     batch_size=None,
                     from_seq_length=None,
-                    to_seq_length=None):
+                    to_seq_length=None,
+                    dropout_seed=None,
+                    head_mask=None,
+                    attention_window=None,
+                    num_global_tokens=0,
+                    attention_bias=None,
+                    cache_fused_qkv=False,
+                    token_indices=None):
   """Performs multi-headed attention from `from_tensor` to `to_tensor`. 用`from_tensor`(作为Query)去attend to `to_tensor`(提供Key和Value)
 
   This is an implementation of multi-headed attention based on "Attention
@@ -655,7 +1240,8 @@ def attention_layer(from_tensor,
       from_width].
     to_tensor: float Tensor of shape [batch_size, to_seq_length, to_width].
     attention_mask: (optional) int32 Tensor of shape [batch_size,
-      from_seq_length, to_seq_length]. The values should be 1 or 0. The
+      from_seq_length, to_seq_length], or [batch_size, 1, to_seq_length] if
+      every query uses the same mask. The values should be 1 or 0. The
       attention scores will effectively be set to -infinity for any positions in
       the mask that are 0, and will be unchanged for positions that are 1. 
       值可以是0或者1，在计算attention score的时候，
@@ -681,6 +1267,31 @@ def attention_layer(from_tensor,
       of the 3D version of the `from_tensor`. 同上，需要告诉函数from_seq_length
     to_seq_length: (Optional) If the input is 2D, this might be the seq length
       of the 3D version of the `to_tensor`.
+    dropout_seed: (Optional) int. Op-level seed of the attention probabilities
+      dropout.
+    head_mask: (Optional) float Tensor of shape [num_attention_heads]. The
+      output of each head is multiplied by its entry, so 0 removes the head.
+    attention_window: (Optional) int. If given, self-attention is computed
+      by `sliding_window_attention` with this window, and `attention_mask`
+      must be of shape [batch_size, 1, to_seq_length] (resp.
+      `attention_bias` of shape [batch_size, 1, 1, to_seq_length]).
+    num_global_tokens: (Optional) int. The number of global tokens of the
+      sliding window attention.
+    attention_bias: (Optional) float32 Tensor added to the attention scores,
+      of a shape that broadcasts against [batch_size, num_attention_heads,
+      from_seq_length, to_seq_length], e.g. the [batch_size, 1, 1,
+      to_seq_length] output of `create_attention_bias_from_input_mask`.
+      Computing it once and passing it to every layer saves converting
+      `attention_mask` in each of them. Cannot be used with `attention_mask`.
+    cache_fused_qkv: (Optional) bool. For inference only, whether the fused
+      self-attention projection concatenates its weights once, see
+      `fused_qkv_projection`.
+    token_indices: (Optional) int64 Tensor of shape [num_tokens, 1]. If
+      given, `from_tensor` and `to_tensor` must be the same rank 2 Tensor,
+      the packed rows at these indices of the [batch_size * from_seq_length,
+      width] input, e.g. the real tokens without the padding. The query, key
+      and value are projected from the packed rows and then scattered back,
+      with zeros for the other rows.
 
   Returns:
     float Tensor of shape [batch_size, from_seq_length,
@@ -731,102 +1342,156 @@ def attention_layer(from_tensor,
   # 把from和to压缩成2D的。
 	# [8*128, 768]
   from_tensor_2d = reshape_to_matrix(from_tensor)
-  # [8*128, 768]
-  to_tensor_2d = reshape_to_matrix(to_tensor)
-
-  # `query_layer` = [B*F, N*H]
-  # 计算Query `query_layer` = [B*F, N*H] =[8*128, 12*64]
-	# batch_size=8，共128个时刻，12和head，每个head的query向量是64
-	# 因此最终得到[8*128, 12*64]
-  query_layer = tf.layers.dense(
-      from_tensor_2d,
-      num_attention_heads * size_per_head,
-      activation=query_act,
-      name="query",
-      kernel_initializer=create_initializer(initializer_range))
-
-  # `key_layer` = [B*T, N*H]
-  # 和query类似，`key_layer` = [B*T, N*H]
-  key_layer = tf.layers.dense(
-      to_tensor_2d,
-      num_attention_heads * size_per_head,
-      activation=key_act,
-      name="key",
-      kernel_initializer=create_initializer(initializer_range))
-
-  # `value_layer` = [B*T, N*H]
-  # 同上，`value_layer` = [B*T, N*H]
-  value_layer = tf.layers.dense(
-      to_tensor_2d,
-      num_attention_heads * size_per_head,
-      activation=value_act,
-      name="value",
-      kernel_initializer=create_initializer(initializer_range))
-
-  # `query_layer` = [B, N, F, H]
-  # 把query从[B*F, N*H] =[8*128, 12*64]变成[B, N, F, H]=[8, 12, 128, 64]
-  query_layer = transpose_for_scores(query_layer, batch_size,
-                                     num_attention_heads, from_seq_length,
-                                     size_per_head)
-
-  # `key_layer` = [B, N, T, H]
-  # 同上，key也变成[8, 12, 128, 64]
-  key_layer = transpose_for_scores(key_layer, batch_size, num_attention_heads,
-                                   to_seq_length, size_per_head)
-
-  # Take the dot product between "query" and "key" to get the raw
-  # attention scores.
-  # `attention_scores` = [B, N, F, T]
-  # 计算query和key的内积，得到attention scores.
-	# [8, 12, 128, 64]*[8, 12, 64, 128]=[8, 12, 128, 128]
-	# 最后两维[128, 128]表示from的128个时刻attend to到to的128个score。
-	# `attention_scores` = [B, N, F, T]
-  attention_scores = tf.matmul(query_layer, key_layer, transpose_b=True)
-  attention_scores = tf.multiply(attention_scores,
-                                 1.0 / math.sqrt(float(size_per_head)))
+
+  is_fused = (from_tensor is to_tensor and query_act is None and
+              key_act is None and value_act is None)
+  if token_indices is not None and (not is_fused or len(from_shape) != 2):
+    raise ValueError(
+        "`token_indices` needs self-attention on a rank 2 `from_tensor`, "
+        "without `query_act`, `key_act` and `value_act`.")
+
+  if is_fused:
+    # Self-attention: project with a single [width, 3*N*H] matmul and split the
+    # result with one reshape and one transpose, instead of three dense layers
+    # each followed by its own reshape/transpose. The kernels and biases are
+    # still the `query`, `key` and `value` variables, so checkpoints are
+    # unchanged; they are concatenated into the fused kernel in the graph, or
+    # once into a local variable with `cache_fused_qkv`.
+    # 自注意力时把Q、K、V三个矩阵乘法合并成一个
+    (query_layer, key_layer, value_layer) = fused_qkv_projection(
+        from_tensor_2d, num_attention_heads, size_per_head, batch_size,
+        from_seq_length, initializer_range,
+        cache_fused_weights=cache_fused_qkv,
+        token_indices=token_indices)
+  else:
+    # [8*128, 768]
+    to_tensor_2d = reshape_to_matrix(to_tensor)
+
+    # `query_layer` = [B*F, N*H]
+    # 计算Query `query_layer` = [B*F, N*H] =[8*128, 12*64]
+    # batch_size=8，共128个时刻，12和head，每个head的query向量是64
+    # 因此最终得到[8*128, 12*64]
+    query_layer = tf.layers.dense(
+        from_tensor_2d,
+        num_attention_heads * size_per_head,
+        activation=query_act,
+        name="query",
+        kernel_initializer=create_initializer(initializer_range))
+
+    # `key_layer` = [B*T, N*H]
+    # 和query类似，`key_layer` = [B*T, N*H]
+    key_layer = tf.layers.dense(
+        to_tensor_2d,
+        num_attention_heads * size_per_head,
+        activation=key_act,
+        name="key",
+        kernel_initializer=create_initializer(initializer_range))
+
+    # `value_layer` = [B*T, N*H]
+    # 同上，`value_layer` = [B*T, N*H]
+    value_layer = tf.layers.dense(
+        to_tensor_2d,
+        num_attention_heads * size_per_head,
+        activation=value_act,
+        name="value",
+        kernel_initializer=create_initializer(initializer_range))
+
+    # `query_layer` = [B, N, F, H]
+    # 把query从[B*F, N*H] =[8*128, 12*64]变成[B, N, F, H]=[8, 12, 128, 64]
+    query_layer = transpose_for_scores(query_layer, batch_size,
+                                       num_attention_heads, from_seq_length,
+                                       size_per_head)
+
+    # `key_layer` = [B, N, T, H]
+    # 同上，key也变成[8, 12, 128, 64]
+    key_layer = transpose_for_scores(key_layer, batch_size, num_attention_heads,
+                                     to_seq_length, size_per_head)
+
+    # 把`value_layer` reshape成[B, T, N, H]=[8, 128, 12, 64]
+    # `value_layer` = [B, T, N, H]
+    value_layer = tf.reshape(
+        value_layer,
+        [batch_size, to_seq_length, num_attention_heads, size_per_head])
+
+    # `value_layer`变成[B, N, T, H]=[8, 12, 128, 64]
+    # `value_layer` = [B, N, T, H]
+    value_layer = tf.transpose(value_layer, [0, 2, 1, 3])
 
   if attention_mask is not None:
-    # 从[8, 128, 128]变成[8, 1, 128, 128]
-    # `attention_mask` = [B, 1, F, T]
-    attention_mask = tf.expand_dims(attention_mask, axis=[1])
-
-    # Since attention_mask is 1.0 for positions we want to attend and 0.0 for
-    # masked positions, this operation will create a tensor which is 0.0 for
-    # positions we want to attend and -10000.0 for masked positions.
-    # 这个小技巧前面也用到过，如果mask是1，那么(1-1)*-10000=0，adder就是0,
-		# 如果mask是0，那么(1-0)*-10000=-10000。
-    adder = (1.0 - tf.cast(attention_mask, tf.float32)) * -10000.0
-
-    # Since we are adding it to the raw scores before the softmax, this is
-    # effectively the same as removing these entirely.
-    # 我们把adder加到attention_score里，mask是1就相当于加0，mask是0就相当于加-10000。
-		# 通常attention_score都不会很大，因此mask为0就相当于把attention_score设置为负无穷
-		# 后面softmax的时候就趋近于0，因此相当于不能attend to Mask为0的地方。
-    attention_scores += adder
-
-  # softmax
-  # Normalize the attention scores to probabilities.
-  # `attention_probs` = [B, N, F, T]
-  attention_probs = tf.nn.softmax(attention_scores)
-
-  # This is actually dropping out entire tokens to attend to, which might
-  # seem a bit unusual, but is taken from the original Transformer paper.
-  # 对attention_probs进行dropout，这虽然有点奇怪，但是Transformer的原始论文就是这么干的。
-  attention_probs = dropout(attention_probs, attention_probs_dropout_prob)
-
-  # 把`value_layer` reshape成[B, T, N, H]=[8, 128, 12, 64]
-  # `value_layer` = [B, T, N, H]
-  value_layer = tf.reshape(
-      value_layer,
-      [batch_size, to_seq_length, num_attention_heads, size_per_head])
-
-  # `value_layer`变成[B, N, T, H]=[8, 12, 128, 64]
-  # `value_layer` = [B, N, T, H]
-  value_layer = tf.transpose(value_layer, [0, 2, 1, 3])
-
-  # 计算`context_layer` = [8, 12, 128, 128]*[8, 12, 128, 64]=[8, 12, 128, 64]=[B, N, F, H]
-  # `context_layer` = [B, N, F, H]
-  context_layer = tf.matmul(attention_probs, value_layer)
+    if attention_bias is not None:
+      raise ValueError(
+          "Only one of `attention_mask` and `attention_bias` can be given.")
+    attention_bias = create_attention_bias(attention_mask)
+
+  if attention_window is not None:
+    # 局部attention，只计算窗口内和全局token的score
+    if (isinstance(from_seq_length, six.integer_types) and
+        isinstance(to_seq_length, six.integer_types) and
+        from_seq_length != to_seq_length):
+      raise ValueError(
+          "`attention_window` needs `from_tensor` and `to_tensor` of the "
+          "same sequence length.")
+    if attention_bias is None:
+      attention_bias = tf.zeros([batch_size, 1, 1, to_seq_length])
+    elif get_shape_list(attention_bias, expected_rank=4)[2] != 1:
+      raise ValueError(
+          "With `attention_window`, every query must use the same mask, of "
+          "shape [batch_size, 1, to_seq_length].")
+    context_layer = sliding_window_attention(
+        query_layer,
+        key_layer,
+        value_layer,
+        attention_bias,
+        attention_window,
+        num_global_tokens=num_global_tokens,
+        attention_probs_dropout_prob=attention_probs_dropout_prob,
+        dropout_seed=dropout_seed)
+  else:
+    # Take the dot product between "query" and "key" to get the raw
+    # attention scores.
+    # `attention_scores` = [B, N, F, T]
+    # 计算query和key的内积，得到attention scores.
+  	# [8, 12, 128, 64]*[8, 12, 64, 128]=[8, 12, 128, 128]
+  	# 最后两维[128, 128]表示from的128个时刻attend to到to的128个score。
+  	# `attention_scores` = [B, N, F, T]
+    attention_scores = tf.matmul(query_layer, key_layer, transpose_b=True)
+    attention_scores = tf.multiply(attention_scores,
+                                   1.0 / math.sqrt(float(size_per_head)))
+
+    # The masking and the softmax always run in float32 for numerical stability,
+    # even when the matmuls run in a lower precision.
+    compute_dtype = attention_scores.dtype.base_dtype
+    attention_scores = tf.cast(attention_scores, tf.float32)
+
+    if attention_bias is not None:
+      # Since we are adding it to the raw scores before the softmax, this is
+      # effectively the same as removing these entirely.
+      # 我们把bias加到attention_score里，mask是1就相当于加0，mask是0就相当于加-10000。
+  		# 通常attention_score都不会很大，因此mask为0就相当于把attention_score设置为负无穷
+  		# 后面softmax的时候就趋近于0，因此相当于不能attend to Mask为0的地方。
+      attention_scores += attention_bias
+
+    # softmax
+    # Normalize the attention scores to probabilities.
+    # `attention_probs` = [B, N, F, T]
+    attention_probs = tf.nn.softmax(attention_scores)
+    attention_probs = tf.cast(attention_probs, compute_dtype)
+
+    # This is actually dropping out entire tokens to attend to, which might
+    # seem a bit unusual, but is taken from the original Transformer paper.
+    # 对attention_probs进行dropout，这虽然有点奇怪，但是Transformer的原始论文就是这么干的。
+    attention_probs = dropout(attention_probs, attention_probs_dropout_prob,
+                              seed=dropout_seed)
+
+    # 计算`context_layer` = [8, 12, 128, 128]*[8, 12, 128, 64]=[8, 12, 128, 64]=[B, N, F, H]
+    # `context_layer` = [B, N, F, H]
+    context_layer = tf.matmul(attention_probs, value_layer)
+
+  if head_mask is not None:
+    # 每个head的输出乘以对应的mask
+    context_layer *= tf.reshape(
+        tf.cast(head_mask, context_layer.dtype),
+        [1, num_attention_heads, 1, 1])
 
   # `context_layer` 变换成 [B, F, N, H]=[8, 128, 12, 64]
   # `context_layer` = [B, F, N, H]
@@ -856,7 +1521,18 @@ def transformer_model(input_tensor,
                       hidden_dropout_prob=0.1,
                       attention_probs_dropout_prob=0.1,
                       initializer_range=0.02,
-                      do_return_all_layers=False):
+                      do_return_all_layers=False,
+                      recompute_grad_layers=0,
+                      input_mask=None,
+                      num_attention_heads_per_layer=None,
+                      head_mask=None,
+                      early_exit_fn=None,
+                      cls_only_last_layer=False,
+                      attention_window=None,
+                      num_global_tokens=0,
+                      attention_bias=None,
+                      share_layer_weights=False,
+                      cache_fused_qkv=False):
   """Multi-headed, multi-layer Transformer from "Attention is All You Need".
 
   This is almost an exact implementation of the original Transformer encoder.
@@ -872,6 +1548,8 @@ def transformer_model(input_tensor,
     attention_mask: (optional) int32 Tensor of shape [batch_size, seq_length,
       seq_length], with 1 for positions that can be attended to and 0 in
       positions that should not be. 1表示可以attend to，0表示不能
+      It may also be of shape [batch_size, 1, seq_length] if every position
+      uses the same mask, which is required with `attention_window`.
     hidden_size: int. Hidden size of the Transformer. ransformer隐单元个数
     num_hidden_layers: int. Number of layers (blocks) in the Transformer. 有多少个SubLayer 
     num_attention_heads: int. Number of attention heads in the Transformer.  Transformer Attention Head个数
@@ -886,10 +1564,66 @@ def transformer_model(input_tensor,
       normal). 初始化范围(truncated normal的标准差)
     do_return_all_layers: Whether to also return all layers or just the final
       layer. 返回所有层的输出还是最后一层的输出。
+    recompute_grad_layers: int. If > 0, every group of this many consecutive
+      layers is wrapped in `tf.contrib.layers.recompute_grad`, so that only the
+      group outputs are kept for backprop and the intermediate activations
+      (Q/K/V, attention probabilities, FFN intermediate) are recomputed in the
+      backward pass. The dropout ops then get fixed op-level seeds so the
+      recomputed forward pass samples the same masks as the original one, and
+      the layer variables are created as resource variables, which
+      `recompute_grad` needs to compute their gradients.
+      每多少层做一次重计算，以计算换显存。
+    input_mask: (optional) int32 Tensor of shape [batch_size, seq_length]. If
+      given, only the rows of the real tokens are kept between the layers, so
+      the dense layers, activations and layer normalization skip the padding.
+      This includes the fused Q/K/V projection, whose output is the only
+      thing scattered back to [batch_size * seq_length], for the attention
+      scores. The outputs at the padding positions are then zeros.
+      只对真实的token做逐位置的计算，padding的位置输出为0。
+    num_attention_heads_per_layer: (optional) list of `num_hidden_layers` ints,
+      the number of heads of each layer, each of size `hidden_size /
+      num_attention_heads`. Layers with fewer heads have physically smaller
+      attention kernels, e.g. after pruning. 每一层的head数，剪枝后可以少于num_attention_heads
+    head_mask: (optional) float Tensor of shape [num_hidden_layers,
+      num_attention_heads] that multiplies the output of every head. Layer
+      `i` uses the first `num_attention_heads_per_layer[i]` entries of row
+      `i`.
+    early_exit_fn: (optional) function called after every layer but the last
+      with the layer index, the layer output of the remaining examples of
+      shape [num_remaining, seq_length, hidden_size] and their int32 batch
+      positions of shape [num_remaining]. It returns a bool Tensor of shape
+      [num_remaining] of the examples that exit. These are gathered out of the
+      batch, so the later layers only run on the examples that did not exit.
+      For inference only. 每一层之后可以让一部分样本提前退出，后面的层只计算剩下的样本
+    cls_only_last_layer: bool. If True, the last layer only computes the
+      output at the first ([CLS]) position: its queries, attention output
+      projection and feed forward layer run on one row per example, while the
+      keys and values still cover the whole sequence. The last layer output is
+      then of shape [batch_size, 1, hidden_size]. This is enough for the
+      pooled output. 最后一层只计算[CLS]位置的输出
+    attention_window: (optional) int. If given, the self-attention of every
+      layer is `sliding_window_attention` with this window, so its memory and
+      compute are linear in `seq_length`.
+    num_global_tokens: (optional) int. The number of global tokens of the
+      sliding window attention.
+    attention_bias: (optional) float32 Tensor of shape [batch_size, 1, 1,
+      seq_length], the output of `create_attention_bias_from_input_mask`,
+      added to the attention scores of every layer. Use instead of
+      `attention_mask` to avoid the [batch_size, seq_length, seq_length]
+      mask.
+    share_layer_weights: (optional) bool. If True, every layer reuses the
+      variables of the "layer_shared" scope instead of creating its own
+      "layer_%d" ones. 所有层共用一套参数
+    cache_fused_qkv: (optional) bool. For inference only, whether the fused
+      Q/K/V weights are concatenated once, see `fused_qkv_projection`.
 
   Returns:
     float Tensor of shape [batch_size, seq_length, hidden_size], the final
-    hidden layer of the Transformer.
+    hidden layer of the Transformer. If `early_exit_fn` is given, a tuple of
+    the final hidden layer of the remaining examples, of shape
+    [num_remaining, seq_length, hidden_size], and of their batch positions.
+    With `cls_only_last_layer` the final hidden layer only holds the first
+    position, so its seq_length is 1.
     如果do_return_all_layers True，返回最后一层的输出，是一个Tensor，
                 shape为[batch_size, seq_length, hidden_size]；
     否则返回所有层的输出，是一个长度为num_hidden_layers的list，
@@ -906,6 +1640,31 @@ def transformer_model(input_tensor,
   # 因为最终要输出hidden_size，总共有num_attention_heads个Head，因此每个Head输出
   # 为hidden_size / num_attention_heads
   attention_head_size = int(hidden_size / num_attention_heads)
+  if num_attention_heads_per_layer is None:
+    num_attention_heads_per_layer = [num_attention_heads] * num_hidden_layers
+  if len(num_attention_heads_per_layer) != num_hidden_layers:
+    raise ValueError(
+        "`num_attention_heads_per_layer` has %d entries but there are %d "
+        "layers" % (len(num_attention_heads_per_layer), num_hidden_layers))
+  if min(num_attention_heads_per_layer) < 1:
+    raise ValueError("Every layer needs at least one attention head: %s" %
+                     num_attention_heads_per_layer)
+  if share_layer_weights and len(set(num_attention_heads_per_layer)) > 1:
+    raise ValueError("Layers that share their weights need the same number "
+                     "of attention heads: %s" % num_attention_heads_per_layer)
+  if early_exit_fn is not None and (recompute_grad_layers or
+                                    input_mask is not None):
+    raise ValueError("`early_exit_fn` does not support "
+                     "`recompute_grad_layers` or `input_mask`.")
+  if cache_fused_qkv and recompute_grad_layers:
+    raise ValueError("`cache_fused_qkv` is for inference only and cannot be "
+                     "combined with `recompute_grad_layers`.")
+  if attention_mask is not None:
+    if attention_bias is not None:
+      raise ValueError(
+          "Only one of `attention_mask` and `attention_bias` can be given.")
+    # 把mask转换成bias，只计算一次，每一层共用
+    attention_bias = create_attention_bias(attention_mask)
   input_shape = get_shape_list(input_tensor, expected_rank=3)
   batch_size = input_shape[0]
   seq_length = input_shape[1]
@@ -927,28 +1686,118 @@ def transformer_model(input_tensor,
   # input_tensor是[8, 128, 768], prev_output是[8*128, 768]=[1024, 768]
   prev_output = reshape_to_matrix(input_tensor)
 
-  all_layer_outputs = []
-  for layer_idx in range(num_hidden_layers):
-    # 每一层都有自己的variable scope
-    with tf.variable_scope("layer_%d" % layer_idx):
-      layer_input = prev_output
+  # `token_indices` = [num_tokens, 1], the rows of `prev_output` that hold
+  # real tokens. Between the layers the representation is then the packed
+  # [num_tokens, hidden_size] matrix of those rows.
+  # 把真实token的行取出来拼成[num_tokens, hidden_size]
+  token_indices = None
+  if input_mask is not None:
+    token_indices = tf.where(tf.reshape(input_mask, [-1]) > 0)
+    prev_output = tf.gather_nd(prev_output, token_indices)
+
+  def pad_tokens(packed_tensor):
+    """Scatters packed rows back to [batch_size * seq_length, hidden_size]."""
+    if token_indices is None:
+      return packed_tensor
+    return tf.scatter_nd(token_indices, packed_tensor,
+                         tf.to_int64([batch_size * seq_length, hidden_size]))
+
+  def unpad_tokens(padded_tensor):
+    """Keeps the rows of `padded_tensor` that hold real tokens."""
+    if token_indices is None:
+      return padded_tensor
+    return tf.gather_nd(padded_tensor, token_indices)
+
+  # `recompute_grad` is built on `tf.custom_gradient`, which only sees the
+  # variables read in the wrapped function when they are resource variables.
+  use_resource = True if recompute_grad_layers else None
+
+  # Dropout ops get fixed seeds only when their layer may be recomputed.
+  def _seed(layer_idx, dropout_idx):
+    if not recompute_grad_layers:
+      return None
+    return 3 * layer_idx + dropout_idx + 1
+
+  def is_cls_only_layer(layer_idx):
+    return cls_only_last_layer and layer_idx == num_hidden_layers - 1
+
+  def to_3d(layer_idx, layer_output):
+    """Reshapes the 2D output of the `layer_idx`-th layer to 3D."""
+    if is_cls_only_layer(layer_idx):
+      return tf.reshape(layer_output, [batch_size, 1, hidden_size])
+    return tf.reshape(pad_tokens(layer_output),
+                      [batch_size, seq_length, hidden_size])
+
+  def transformer_layer(layer_idx, layer_input):
+    """Builds the `layer_idx`-th layer on the 2D `layer_input`."""
+    layer_num_heads = num_attention_heads_per_layer[layer_idx]
+    layer_head_mask = None
+    if head_mask is not None:
+      layer_head_mask = head_mask[layer_idx, :layer_num_heads]
+    # 每一层都有自己的variable scope，共享参数时都用"layer_shared"
+    if share_layer_weights:
+      layer_scope = tf.variable_scope(
+          "layer_shared", reuse=tf.AUTO_REUSE, use_resource=use_resource)
+    else:
+      layer_scope = tf.variable_scope(
+          "layer_%d" % layer_idx, use_resource=use_resource)
+    with layer_scope:
       # attention层
       with tf.variable_scope("attention"):
         attention_heads = []
         # self attention
         with tf.variable_scope("self"):
+          # The fused Q/K/V projection runs on the packed rows, and only its
+          # output is scattered to the [batch_size, seq_length] layout the
+          # attention needs.
+          # Q/K/V的投影在去掉padding的矩阵上计算，之后才scatter回[B*S]
+          from_tensor = layer_input
+          to_tensor = layer_input
+          from_seq_length = seq_length
+          layer_token_indices = token_indices
+          layer_attention_bias = attention_bias
+          if is_cls_only_layer(layer_idx):
+            padded_input = pad_tokens(layer_input)
+            to_tensor = padded_input
+            layer_token_indices = None
+            # 最后一层只用[CLS]位置做query，key和value仍然是整个序列
+            from_tensor = tf.reshape(
+                padded_input, [batch_size, seq_length, hidden_size])[:, 0, :]
+            from_seq_length = 1
+            if attention_bias is not None:
+              layer_attention_bias = attention_bias[:, :, 0:1, :]
+            if attention_window is not None and not num_global_tokens:
+              # 第一个位置不是全局token时也只能看到窗口内的key
+              window_bias = -10000.0 * tf.cast(
+                  tf.range(seq_length) > attention_window, tf.float32)
+              window_bias = tf.reshape(window_bias, [1, 1, 1, seq_length])
+              if layer_attention_bias is None:
+                layer_attention_bias = window_bias
+              else:
+                layer_attention_bias += window_bias
+            # The residual and everything after the attention are per row.
+            layer_input = from_tensor
           attention_head = attention_layer(
-              from_tensor=layer_input,
-              to_tensor=layer_input,
-              attention_mask=attention_mask,
-              num_attention_heads=num_attention_heads,
+              from_tensor=from_tensor,
+              to_tensor=to_tensor,
+              attention_bias=layer_attention_bias,
+              num_attention_heads=layer_num_heads,
               size_per_head=attention_head_size,
               attention_probs_dropout_prob=attention_probs_dropout_prob,
               initializer_range=initializer_range,
               do_return_2d_tensor=True,
               batch_size=batch_size,
-              from_seq_length=seq_length,
-              to_seq_length=seq_length)
+              from_seq_length=from_seq_length,
+              to_seq_length=seq_length,
+              dropout_seed=_seed(layer_idx, 0),
+              head_mask=layer_head_mask,
+              attention_window=(None if is_cls_only_layer(layer_idx) else
+                                attention_window),
+              num_global_tokens=num_global_tokens,
+              cache_fused_qkv=cache_fused_qkv,
+              token_indices=layer_token_indices)
+          if not is_cls_only_layer(layer_idx):
+            attention_head = unpad_tokens(attention_head)
           attention_heads.append(attention_head)
 
         attention_output = None
@@ -968,7 +1817,8 @@ def transformer_model(input_tensor,
               attention_output,
               hidden_size,
               kernel_initializer=create_initializer(initializer_range))
-          attention_output = dropout(attention_output, hidden_dropout_prob)
+          attention_output = dropout(attention_output, hidden_dropout_prob,
+                                     seed=_seed(layer_idx, 1))
           # 残差连接再加上layer norm。
           attention_output = layer_norm(attention_output + layer_input)
 
@@ -988,19 +1838,69 @@ def transformer_model(input_tensor,
             intermediate_output,
             hidden_size,
             kernel_initializer=create_initializer(initializer_range))
-        layer_output = dropout(layer_output, hidden_dropout_prob)
+        layer_output = dropout(layer_output, hidden_dropout_prob,
+                               seed=_seed(layer_idx, 2))
         layer_output = layer_norm(layer_output + attention_output)
-        prev_output = layer_output
-        all_layer_outputs.append(layer_output)
+        return layer_output
+
+  if early_exit_fn is not None:
+    # `transformer_layer` reads `batch_size` and `attention_bias` when it is
+    # called, so the later layers are built for the shrunk batch.
+    remaining_indices = tf.range(batch_size)
+    for layer_idx in range(num_hidden_layers):
+      prev_output = transformer_layer(layer_idx, prev_output)
+      layer_output = to_3d(layer_idx, prev_output)
+      if layer_idx == num_hidden_layers - 1:
+        return (layer_output, remaining_indices)
+
+      exits = early_exit_fn(layer_idx, layer_output, remaining_indices)
+      keep = tf.reshape(tf.where(tf.logical_not(exits)), [-1])
+      prev_output = tf.reshape(
+          tf.gather(layer_output, keep), [-1, hidden_size])
+      if attention_bias is not None:
+        attention_bias = tf.gather(attention_bias, keep)
+      remaining_indices = tf.gather(remaining_indices, keep)
+      batch_size = tf.size(remaining_indices)
+
+  all_layer_outputs = []
+  if not recompute_grad_layers:
+    for layer_idx in range(num_hidden_layers):
+      prev_output = transformer_layer(layer_idx, prev_output)
+      all_layer_outputs.append(prev_output)
+  else:
+    for group_start in range(0, num_hidden_layers, recompute_grad_layers):
+      group_end = min(group_start + recompute_grad_layers, num_hidden_layers)
+
+      def group_fn(group_input, layer_indexes=range(group_start, group_end)):
+        group_outputs = []
+        group_output = group_input
+        for layer_idx in layer_indexes:
+          group_output = transformer_layer(layer_idx, group_output)
+          group_outputs.append(group_output)
+        return tuple(group_outputs)
+
+      group_outputs = tf.contrib.layers.recompute_grad(group_fn)(prev_output)
+      all_layer_outputs.extend(group_outputs)
+      prev_output = group_outputs[-1]
+
+    # Layers reused from an earlier build without recomputation keep their ref
+    # variables, and those would silently get no gradients.
+    scope_name = tf.get_variable_scope().name
+    layer_prefix = (scope_name + "/" if scope_name else "") + "layer_"
+    for var in tf.trainable_variables():
+      if var.op.name.startswith(layer_prefix) and var.op.type != "VarHandleOp":
+        raise ValueError(
+            "`recompute_grad_layers` needs the layer variables to be resource "
+            "variables, but `%s` was created as a ref variable." % var.op.name)
 
   if do_return_all_layers:
     final_outputs = []
-    for layer_output in all_layer_outputs:
-      final_output = reshape_from_matrix(layer_output, input_shape)
+    for (layer_idx, layer_output) in enumerate(all_layer_outputs):
+      final_output = to_3d(layer_idx, layer_output)
       final_outputs.append(final_output)
     return final_outputs
   else:
-    final_output = reshape_from_matrix(prev_output, input_shape)
+    final_output = to_3d(num_hidden_layers - 1, prev_output)
     return final_output
 
 
@@ -0,0 +1,444 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A NumPy implementation of the `BertModel` forward pass for CPU inference."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import math
+import mmap_checkpoint
+import numpy as np
+import six
+
+
+def gelu(x):
+  """Applies the same tanh approximation as `modeling.gelu`, in place."""
+  # x * 0.5 * (1 + tanh(sqrt(2/pi) * (x + 0.044715 * x^3)))
+  cdf = np.power(x, 3)
+  cdf *= 0.044715
+  cdf += x
+  cdf *= math.sqrt(2 / math.pi)
+  np.tanh(cdf, out=cdf)
+  cdf += 1.0
+  cdf *= 0.5
+  x *= cdf
+  return x
+
+
+def relu(x):
+  """Applies ReLU in place."""
+  return np.maximum(x, 0, out=x)
+
+
+def tanh(x):
+  """Applies tanh in place."""
+  return np.tanh(x, out=x)
+
+
+def get_activation(activation_string):
+  """Maps a string to an in-place NumPy activation, e.g., "gelu" => `gelu`.
+
+  Args:
+    activation_string: String name of the activation function.
+
+  Returns:
+    A Python function that applies the activation to an array in place. If
+    `activation_string` is None, empty, or "linear", this will return None.
+
+  Raises:
+    ValueError: The `activation_string` does not correspond to a known
+      activation.
+  """
+  if not isinstance(activation_string, six.string_types):
+    raise ValueError(
+        "Only activations given by name are supported: %s" % activation_string)
+
+  if not activation_string:
+    return None
+
+  act = activation_string.lower()
+  if act == "linear":
+    return None
+  elif act == "relu":
+    return relu
+  elif act == "gelu":
+    return gelu
+  elif act == "tanh":
+    return tanh
+  else:
+    raise ValueError("Unsupported activation: %s" % act)
+
+
+def layer_norm(x, gamma, beta, epsilon=1e-12):
+  """Normalizes the rows of the 2D array `x` in place.
+
+  Matches `tf.contrib.layers.layer_norm` over the last dimension, which is what
+  `modeling.layer_norm` uses.
+  """
+  width = x.shape[-1]
+  x -= np.mean(x, axis=-1, keepdims=True)
+  variance = np.einsum("ij,ij->i", x, x)
+  variance /= width
+  variance += epsilon
+  np.sqrt(variance, out=variance)
+  x /= variance[:, np.newaxis]
+  x *= gamma
+  x += beta
+  return x
+
+
+def softmax(x):
+  """Applies softmax over the last dimension of `x` in place."""
+  x -= np.max(x, axis=-1, keepdims=True)
+  np.exp(x, out=x)
+  x /= np.sum(x, axis=-1, keepdims=True)
+  return x
+
+
+def dense(x, kernel, bias, out):
+  """Computes `x * kernel + bias` into the preallocated `out`."""
+  np.matmul(x, kernel, out=out)
+  out += bias
+  return out
+
+
+def load_weights_from_checkpoint(init_checkpoint):
+  """Reads every variable of a checkpoint into NumPy arrays.
+
+  Weights files written by `convert_checkpoint_to_mmap.py` are memory-mapped
+  instead of read, so loading them is instant and copies nothing. Reading and
+  writing TensorFlow checkpoints are the only parts of this module that need
+  TensorFlow.
+
+  Args:
+    init_checkpoint: Path of the checkpoint, e.g. ".../bert_model.ckpt".
+
+  Returns:
+    A dict from variable name (e.g. "bert/pooler/dense/kernel") to array.
+  """
+  if mmap_checkpoint.is_mmap_checkpoint(init_checkpoint):
+    return mmap_checkpoint.load_weights(init_checkpoint)
+
+  import tensorflow as tf  # pylint: disable=g-import-not-at-top
+
+  reader = tf.train.load_checkpoint(init_checkpoint)
+  weights = {}
+  for name in reader.get_variable_to_shape_map():
+    weights[name] = reader.get_tensor(name)
+  return weights
+
+
+def save_weights_to_checkpoint(weights, output_checkpoint):
+  """Writes a dict from variable name to array as a TensorFlow checkpoint."""
+  import tensorflow as tf  # pylint: disable=g-import-not-at-top
+
+  with tf.Graph().as_default():
+    name_to_variable = {}
+    for (name, value) in weights.items():
+      name_to_variable[name] = tf.get_variable(
+          name,
+          shape=value.shape,
+          dtype=tf.as_dtype(value.dtype),
+          initializer=tf.zeros_initializer())
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      # `load` feeds the values, so they are not stored in the graph.
+      for (name, var) in name_to_variable.items():
+        var.load(weights[name], sess)
+      tf.train.Saver(list(name_to_variable.values())).save(
+          sess, output_checkpoint)
+
+
+class NumpyBertModel(object):
+  """Inference-only BERT forward pass in NumPy.
+
+  Computes the same `sequence_output` and `pooled_output` as
+  `modeling.BertModel` with `is_training=False`, from the weights of a BERT
+  checkpoint and with its variable names. The query, key and value kernels of
+  each layer are concatenated once at load time, and the intermediate results
+  are written into workspace buffers that are allocated once per input shape
+  and reused by every layer and every call. Layers may have fewer heads than
+  `num_attention_heads`, e.g. after `prune_heads.py`, and factorized
+  embeddings and shared layer weights are supported.
+
+  Example usage:
+
+  ```python
+  config = modeling.BertConfig.from_json_file("bert_config.json")
+  model = modeling_numpy.NumpyBertModel.from_checkpoint(
+      config, "bert_model.ckpt")
+  (sequence_output, pooled_output) = model.predict(
+      input_ids, input_mask, token_type_ids)
+  ```
+  """
+
+  def __init__(self, config, weights, scope="bert"):
+    """Constructor for NumpyBertModel.
+
+    Args:
+      config: `BertConfig` instance.
+      weights: dict from variable name to array, e.g. the output of
+        `load_weights_from_checkpoint`.
+      scope: (optional) The variable scope the `BertModel` was built in.
+
+    Raises:
+      ValueError: The config is invalid or a weight is missing.
+    """
+    if config.hidden_size % config.num_attention_heads != 0:
+      raise ValueError(
+          "The hidden size (%d) is not a multiple of the number of attention "
+          "heads (%d)" % (config.hidden_size, config.num_attention_heads))
+    if config.attention_window is not None:
+      raise ValueError("Sliding window attention is not supported.")
+
+    self.config = config
+    self.num_attention_heads = config.num_attention_heads
+    self.size_per_head = config.hidden_size // config.num_attention_heads
+    self.intermediate_act_fn = get_activation(config.hidden_act)
+
+    def get(name):
+      full_name = "%s/%s" % (scope, name)
+      if full_name not in weights:
+        raise ValueError("Weight `%s` not found." % full_name)
+      return np.ascontiguousarray(weights[full_name], dtype=np.float32)
+
+    self.word_embeddings = get("embeddings/word_embeddings")
+    self.token_type_embeddings = get("embeddings/token_type_embeddings")
+    self.position_embeddings = get("embeddings/position_embeddings")
+    self.embeddings_layer_norm = (get("embeddings/LayerNorm/gamma"),
+                                  get("embeddings/LayerNorm/beta"))
+
+    def get_dense(name, sub_names=None):
+      """Returns the (kernel, bias) of the dense layer(s) under `name`.
+
+      The kernels of `sub_names` are concatenated, for the fused Q/K/V.
+      """
+      if sub_names is None:
+        scopes = [name]
+      else:
+        scopes = ["%s/%s" % (name, x) for x in sub_names]
+      return (np.concatenate([get(x + "/kernel") for x in scopes], axis=1),
+              np.concatenate([get(x + "/bias") for x in scopes]))
+
+    # 因式分解的embedding需要先投影到hidden_size
+    self.embedding_hidden_mapping_in = None
+    if self.word_embeddings.shape[1] != config.hidden_size:
+      self.embedding_hidden_mapping_in = (
+          get("encoder/embedding_hidden_mapping_in/kernel"),
+          get("encoder/embedding_hidden_mapping_in/bias"))
+
+    self.layers = []
+    for layer_idx in range(config.num_hidden_layers):
+      if config.share_layer_weights:
+        # 共享参数的层用同一个dict，权重只加载一次
+        if self.layers:
+          self.layers.append(self.layers[0])
+          continue
+        prefix = "encoder/layer_shared/"
+      else:
+        prefix = "encoder/layer_%d/" % layer_idx
+      qkv = get_dense(prefix + "attention/self", ["query", "key", "value"])
+      self.layers.append({
+          # 剪枝后每层的head数可以不同，从kernel的宽度算出来
+          "num_heads": qkv[0].shape[1] // (3 * self.size_per_head),
+          # 把Q、K、V三个kernel拼成一个，一次矩阵乘法算出来
+          "qkv": qkv,
+          "attention_output": get_dense(prefix + "attention/output/dense"),
+          "attention_layer_norm":
+              (get(prefix + "attention/output/LayerNorm/gamma"),
+               get(prefix + "attention/output/LayerNorm/beta")),
+          "intermediate": get_dense(prefix + "intermediate/dense"),
+          "output": get_dense(prefix + "output/dense"),
+          "output_layer_norm": (get(prefix + "output/LayerNorm/gamma"),
+                                get(prefix + "output/LayerNorm/beta")),
+      })
+
+    self.pooler_kernel = get("pooler/dense/kernel")
+    self.pooler_bias = get("pooler/dense/bias")
+
+    self._workspace_shape = None
+    self._workspace = None
+
+  @classmethod
+  def from_checkpoint(cls, config, init_checkpoint, scope="bert"):
+    """Constructs a `NumpyBertModel` from a TensorFlow BERT checkpoint."""
+    return cls(config, load_weights_from_checkpoint(init_checkpoint), scope)
+
+  def _get_workspace(self, batch_size, seq_length):
+    """Returns the buffers for inputs of shape [batch_size, seq_length].
+
+    Only the buffers of the last input shape are kept. The buffers whose size
+    depends on the number of heads are flat and sized for the layer with the
+    most heads; `_view` takes the part a layer needs.
+    """
+    if self._workspace_shape != (batch_size, seq_length):
+      num_rows = batch_size * seq_length
+      hidden_size = self.config.hidden_size
+      max_heads = max([layer["num_heads"] for layer in self.layers] + [1])
+      self._workspace = {
+          "hidden": np.empty([num_rows, hidden_size], dtype=np.float32),
+          "attention_output":
+              np.empty([num_rows, hidden_size], dtype=np.float32),
+          "projection": np.empty([num_rows, hidden_size], dtype=np.float32),
+          "intermediate":
+              np.empty([num_rows, self.config.intermediate_size],
+                       dtype=np.float32),
+          "qkv":
+              np.empty([num_rows * 3 * max_heads * self.size_per_head],
+                       dtype=np.float32),
+          "scores":
+              np.empty([batch_size * max_heads * seq_length * seq_length],
+                       dtype=np.float32),
+          "context":
+              np.empty([num_rows * max_heads * self.size_per_head],
+                       dtype=np.float32),
+          "attention_context":
+              np.empty([num_rows * max_heads * self.size_per_head],
+                       dtype=np.float32),
+      }
+      if self.embedding_hidden_mapping_in is None:
+        self._workspace["embedding"] = self._workspace["hidden"]
+        self._workspace["token_type_embedding"] = (
+            self._workspace["projection"])
+      else:
+        embedding_size = self.word_embeddings.shape[1]
+        self._workspace["embedding"] = np.empty([num_rows, embedding_size],
+                                                dtype=np.float32)
+        self._workspace["token_type_embedding"] = np.empty(
+            [num_rows, embedding_size], dtype=np.float32)
+      self._workspace_shape = (batch_size, seq_length)
+    return self._workspace
+
+  def _view(self, workspace, name, shape):
+    """Returns the first elements of the flat buffer `name` as `shape`."""
+    size = int(np.prod(shape))
+    return workspace[name][:size].reshape(shape)
+
+  def predict(self, input_ids, input_mask=None, token_type_ids=None):
+    """Runs the forward pass.
+
+    Args:
+      input_ids: int array of shape [batch_size, seq_length].
+      input_mask: (optional) int array of shape [batch_size, seq_length].
+      token_type_ids: (optional) int array of shape [batch_size, seq_length].
+
+    Returns:
+      A tuple of the float32 `sequence_output` of shape
+      [batch_size, seq_length, hidden_size] and `pooled_output` of shape
+      [batch_size, hidden_size]. Both are new arrays that are not overwritten
+      by later calls.
+
+    Raises:
+      ValueError: `seq_length` is larger than `max_position_embeddings`.
+    """
+    input_ids = np.asarray(input_ids)
+    (batch_size, seq_length) = input_ids.shape
+    if seq_length > self.config.max_position_embeddings:
+      raise ValueError(
+          "Sequence length (%d) is larger than max_position_embeddings (%d)" %
+          (seq_length, self.config.max_position_embeddings))
+    if input_mask is None:
+      input_mask = np.ones([batch_size, seq_length], dtype=np.int32)
+    if token_type_ids is None:
+      token_type_ids = np.zeros([batch_size, seq_length], dtype=np.int32)
+
+    workspace = self._get_workspace(batch_size, seq_length)
+    hidden = workspace["hidden"]
+
+    # Embeddings: word + token type + position, then layer norm.
+    embedding = workspace["embedding"]
+    np.take(
+        self.word_embeddings, input_ids.reshape([-1]), axis=0, out=embedding)
+    token_type_embedding = workspace["token_type_embedding"]
+    np.take(
+        self.token_type_embeddings,
+        np.asarray(token_type_ids).reshape([-1]),
+        axis=0,
+        out=token_type_embedding)
+    embedding += token_type_embedding
+    embedding_3d = embedding.reshape([batch_size, seq_length, -1])
+    embedding_3d += self.position_embeddings[:seq_length]
+    layer_norm(embedding, *self.embeddings_layer_norm)
+    if self.embedding_hidden_mapping_in is not None:
+      dense(embedding, *self.embedding_hidden_mapping_in, out=hidden)
+
+    # `attention_bias` = [B, 1, 1, T], the same -10000 additive mask as
+    # `attention_layer`, broadcast over the heads and the query positions.
+    attention_bias = (1.0 - np.asarray(input_mask, dtype=np.float32)) * -10000.0
+    attention_bias = attention_bias[:, np.newaxis, np.newaxis, :]
+
+    for layer in self.layers:
+      self._transformer_layer(layer, workspace, batch_size, seq_length,
+                              attention_bias)
+
+    sequence_output = hidden.reshape([batch_size, seq_length, -1]).copy()
+
+    pooled_output = np.matmul(sequence_output[:, 0], self.pooler_kernel)
+    pooled_output += self.pooler_bias
+    np.tanh(pooled_output, out=pooled_output)
+
+    return (sequence_output, pooled_output)
+
+  def _transformer_layer(self, layer, workspace, batch_size, seq_length,
+                         attention_bias):
+    """Runs one layer, updating `workspace["hidden"]` in place."""
+    num_heads = layer["num_heads"]
+    size_per_head = self.size_per_head
+    num_rows = batch_size * seq_length
+    hidden = workspace["hidden"]
+    attention_output = workspace["attention_output"]
+    projection = workspace["projection"]
+    scores = self._view(workspace, "scores",
+                        [batch_size, num_heads, seq_length, seq_length])
+    context = self._view(workspace, "context",
+                         [batch_size, num_heads, seq_length, size_per_head])
+    attention_context = self._view(workspace, "attention_context",
+                                   [num_rows, num_heads * size_per_head])
+
+    # `qkv` = [B*S, 3*N*H], viewed as query, key and value of [B, N, S, H].
+    qkv = self._view(workspace, "qkv",
+                     [num_rows, 3 * num_heads * size_per_head])
+    qkv = dense(hidden, *layer["qkv"], out=qkv)
+    qkv = qkv.reshape(
+        [batch_size, seq_length, 3, num_heads, size_per_head]).transpose(
+            [2, 0, 3, 1, 4])
+    (query, key, value) = (qkv[0], qkv[1], qkv[2])
+
+    # `scores` = [B, N, F, T]
+    np.matmul(query, key.transpose([0, 1, 3, 2]), out=scores)
+    scores *= 1.0 / math.sqrt(float(size_per_head))
+    scores += attention_bias
+    softmax(scores)
+
+    # `context` = [B, N, F, H], copied to [B*F, N*H].
+    np.matmul(scores, value, out=context)
+    np.copyto(
+        attention_context.reshape(
+            [batch_size, seq_length, num_heads, size_per_head]),
+        context.transpose([0, 2, 1, 3]))
+
+    dense(attention_context, *layer["attention_output"], out=projection)
+    np.add(projection, hidden, out=attention_output)
+    layer_norm(attention_output, *layer["attention_layer_norm"])
+
+    intermediate = dense(attention_output, *layer["intermediate"],
+                         out=workspace["intermediate"])
+    if self.intermediate_act_fn is not None:
+      self.intermediate_act_fn(intermediate)
+
+    dense(intermediate, *layer["output"], out=projection)
+    np.add(projection, attention_output, out=hidden)
+    layer_norm(hidden, *layer["output_layer_norm"])
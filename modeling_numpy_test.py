@@ -0,0 +1,111 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import modeling
+import modeling_numpy
+import numpy as np
+import tensorflow as tf
+
+
+class NumpyBertModelTest(tf.test.TestCase):
+
+  def create_config(self, hidden_act="gelu"):
+    return modeling.BertConfig(
+        vocab_size=99,
+        hidden_size=32,
+        num_hidden_layers=3,
+        num_attention_heads=4,
+        intermediate_size=37,
+        hidden_act=hidden_act,
+        max_position_embeddings=64,
+        type_vocab_size=2)
+
+  def create_inputs(self, batch_size, seq_length):
+    rng = np.random.RandomState(12345)
+    input_ids = rng.randint(0, 99, size=[batch_size, seq_length])
+    input_mask = np.ones([batch_size, seq_length], dtype=np.int32)
+    input_mask[0, seq_length // 2:] = 0
+    token_type_ids = rng.randint(0, 2, size=[batch_size, seq_length])
+    return (input_ids.astype(np.int32), input_mask,
+            token_type_ids.astype(np.int32))
+
+  def run_tf_model(self, config, inputs, init_checkpoint):
+    """Returns the TF outputs and saves the random weights to a checkpoint."""
+    (input_ids, input_mask, token_type_ids) = inputs
+    with tf.Graph().as_default():
+      model = modeling.BertModel(
+          config=config,
+          is_training=False,
+          input_ids=tf.constant(input_ids),
+          input_mask=tf.constant(input_mask),
+          token_type_ids=tf.constant(token_type_ids))
+      with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(tf.local_variables_initializer())
+        tf.train.Saver().save(sess, init_checkpoint)
+        return sess.run(
+            [model.get_sequence_output(), model.get_pooled_output()])
+
+  def check_parity(self, config, name):
+    init_checkpoint = os.path.join(self.get_temp_dir(), "bert_%s.ckpt" % name)
+    inputs = self.create_inputs(batch_size=3, seq_length=11)
+    (expected_sequence_output, expected_pooled_output) = self.run_tf_model(
+        config, inputs, init_checkpoint)
+
+    model = modeling_numpy.NumpyBertModel.from_checkpoint(
+        config, init_checkpoint)
+    (sequence_output, pooled_output) = model.predict(*inputs)
+
+    self.assertAllClose(expected_sequence_output, sequence_output,
+                        rtol=1e-4, atol=1e-4)
+    self.assertAllClose(expected_pooled_output, pooled_output,
+                        rtol=1e-4, atol=1e-4)
+
+  def test_parity(self):
+    self.check_parity(self.create_config("gelu"), "gelu")
+
+  def test_parity_relu(self):
+    self.check_parity(self.create_config("relu"), "relu")
+
+  def test_parity_factorized_shared(self):
+    config = self.create_config()
+    config.embedding_size = 16
+    config.share_layer_weights = True
+    self.check_parity(config, "factorized_shared")
+
+  def test_workspace_reuse(self):
+    config = self.create_config()
+    init_checkpoint = os.path.join(self.get_temp_dir(), "bert_reuse.ckpt")
+    long_inputs = self.create_inputs(batch_size=2, seq_length=9)
+    short_inputs = self.create_inputs(batch_size=2, seq_length=5)
+    self.run_tf_model(config, long_inputs, init_checkpoint)
+
+    model = modeling_numpy.NumpyBertModel.from_checkpoint(
+        config, init_checkpoint)
+    (first_output, _) = model.predict(*long_inputs)
+    model.predict(*short_inputs)
+    (second_output, _) = model.predict(*long_inputs)
+
+    # Calls with another shape reallocate the workspace in between.
+    self.assertAllClose(first_output, second_output)
+
+
+if __name__ == "__main__":
+  tf.test.main()
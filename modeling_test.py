@@ -22,6 +22,7 @@ import random
 import re
 
 import modeling
+import numpy as np
 import six
 import tensorflow as tf
 
@@ -48,6 +49,7 @@ class BertModelTest(tf.test.TestCase):
                  max_position_embeddings=512,
                  type_vocab_size=16,
                  initializer_range=0.02,
+                 compute_dtype="float32",
                  scope=None):
       self.parent = parent
       self.batch_size = batch_size
@@ -66,6 +68,7 @@ class BertModelTest(tf.test.TestCase):
       self.max_position_embeddings = max_position_embeddings
       self.type_vocab_size = type_vocab_size
       self.initializer_range = initializer_range
+      self.compute_dtype = compute_dtype
       self.scope = scope
 
     def create_model(self):
@@ -93,7 +96,8 @@ class BertModelTest(tf.test.TestCase):
           attention_probs_dropout_prob=self.attention_probs_dropout_prob,
           max_position_embeddings=self.max_position_embeddings,
           type_vocab_size=self.type_vocab_size,
-          initializer_range=self.initializer_range)
+          initializer_range=self.initializer_range,
+          compute_dtype=self.compute_dtype)
 
       model = modeling.BertModel(
           config=config,
@@ -126,12 +130,394 @@ class BertModelTest(tf.test.TestCase):
   def test_default(self):
     self.run_tester(BertModelTest.BertModelTester(self))
 
+  def test_float16(self):
+    self.run_tester(
+        BertModelTest.BertModelTester(self, compute_dtype="float16"))
+
   def test_config_to_json_string(self):
     config = modeling.BertConfig(vocab_size=99, hidden_size=37)
     obj = json.loads(config.to_json_string())
     self.assertEqual(obj["vocab_size"], 99)
     self.assertEqual(obj["hidden_size"], 37)
 
+  def test_recompute_grad(self):
+    with self.test_session() as sess:
+      input_tensor = tf.random_normal([2, 5, 16], seed=1)
+      outputs = []
+      grads = []
+      # The recomputed encoder is built first so that it creates the resource
+      # variables that `recompute_grad` needs; the plain one reuses them.
+      for (reuse, recompute_grad_layers) in [(False, 2), (True, 0)]:
+        with tf.variable_scope("encoder", reuse=reuse):
+          output = modeling.transformer_model(
+              input_tensor=input_tensor,
+              hidden_size=16,
+              num_hidden_layers=3,
+              num_attention_heads=2,
+              intermediate_size=32,
+              hidden_dropout_prob=0.0,
+              attention_probs_dropout_prob=0.0,
+              recompute_grad_layers=recompute_grad_layers)
+        loss = tf.reduce_sum(tf.square(output))
+        outputs.append(output)
+        grads.append(tf.gradients(loss, [input_tensor] +
+                                  tf.trainable_variables()))
+        self.assertNotIn(None, grads[-1])
+
+      sess.run(tf.global_variables_initializer())
+      (outputs_np, grads_np) = sess.run([outputs, grads])
+      self.assertAllClose(outputs_np[0], outputs_np[1])
+      for (recomputed_grad, grad) in zip(grads_np[0], grads_np[1]):
+        self.assertAllClose(grad, recomputed_grad, rtol=1e-4, atol=1e-4)
+
+  def test_fused_qkv(self):
+    with self.test_session() as sess:
+      from_tensor = tf.random_normal([2, 5, 16], seed=1)
+      outputs = []
+      # `tf.identity` makes `to_tensor` a different tensor, which disables the
+      # fused projection but reads the same values and the same variables.
+      for (reuse, to_tensor) in [(False, from_tensor),
+                                 (True, tf.identity(from_tensor))]:
+        with tf.variable_scope("attention", reuse=reuse):
+          outputs.append(
+              modeling.attention_layer(
+                  from_tensor=from_tensor,
+                  to_tensor=to_tensor,
+                  num_attention_heads=2,
+                  size_per_head=8))
+      self.assertEqual(len(tf.trainable_variables()), 6)
+
+      sess.run(tf.global_variables_initializer())
+      (fused_np, unfused_np) = sess.run(outputs)
+      self.assertAllClose(fused_np, unfused_np, rtol=1e-5, atol=1e-5)
+
+  def test_cache_fused_qkv(self):
+    with self.test_session() as sess:
+      input_tensor = tf.random_normal([2, 5, 16], seed=1)
+      outputs = []
+      for (reuse, cache_fused_qkv) in [(False, False), (True, True)]:
+        with tf.variable_scope("encoder", reuse=reuse):
+          outputs.append(
+              modeling.transformer_model(
+                  input_tensor=input_tensor,
+                  hidden_size=16,
+                  num_hidden_layers=2,
+                  num_attention_heads=2,
+                  intermediate_size=32,
+                  hidden_dropout_prob=0.0,
+                  attention_probs_dropout_prob=0.0,
+                  cache_fused_qkv=cache_fused_qkv))
+      # One fused kernel and bias per layer, which are not checkpointed.
+      self.assertEqual(
+          sorted(var.op.name for var in tf.local_variables()), [
+              "encoder/layer_%d/attention/self/fused_qkv/%s" % (i, name)
+              for i in range(2)
+              for name in ["bias", "kernel"]
+          ])
+
+      sess.run(tf.global_variables_initializer())
+      sess.run(tf.local_variables_initializer())
+      (expected_np, cached_np) = sess.run(outputs)
+      self.assertAllClose(expected_np, cached_np)
+
+  def test_sliding_window_attention(self):
+    with self.test_session() as sess:
+      seq_length = 11
+      attention_window = 3
+      num_global_tokens = 1
+      from_tensor = tf.random_normal([2, seq_length, 16], seed=1)
+      input_mask = np.ones([2, seq_length], dtype=np.int32)
+      input_mask[1, 8:] = 0
+
+      # The same attention as a dense [batch_size, seq_length, seq_length]
+      # mask.
+      positions = np.arange(seq_length)
+      allowed = ((np.abs(positions[:, None] - positions[None, :]) <=
+                  attention_window) | (positions[:, None] < num_global_tokens) |
+                 (positions[None, :] < num_global_tokens))
+      dense_mask = allowed[None, :, :] * input_mask[:, None, :]
+
+      outputs = []
+      for (reuse, attention_mask, window) in [
+          (False, dense_mask, None),
+          (True, input_mask[:, None, :], attention_window)
+      ]:
+        with tf.variable_scope("attention", reuse=reuse):
+          outputs.append(
+              modeling.attention_layer(
+                  from_tensor=from_tensor,
+                  to_tensor=from_tensor,
+                  attention_mask=tf.constant(attention_mask, tf.float32),
+                  num_attention_heads=2,
+                  size_per_head=8,
+                  attention_window=window,
+                  num_global_tokens=num_global_tokens))
+
+      sess.run(tf.global_variables_initializer())
+      (dense_np, sparse_np) = sess.run(outputs)
+      self.assertAllClose(dense_np, sparse_np, rtol=1e-5, atol=1e-5)
+
+  def test_sliding_window_attention_dynamic_length(self):
+    with self.test_session() as sess:
+      from_np = np.random.RandomState(1).randn(2, 7, 16).astype(np.float32)
+      mask_np = np.ones([2, 1, 7], dtype=np.float32)
+      mask_np[1, :, 5:] = 0
+      outputs = []
+      feed_dict = {}
+      # The second tensor has an unknown sequence length, as with
+      # `dynamic_seq_length` or the serving placeholders.
+      for (reuse, shape) in [(False, [2, 7, 16]), (True, [None, None, 16])]:
+        from_tensor = tf.placeholder(tf.float32, shape)
+        attention_mask = tf.placeholder(tf.float32, shape[:1] + [1, None])
+        feed_dict[from_tensor] = from_np
+        feed_dict[attention_mask] = mask_np
+        with tf.variable_scope("attention", reuse=reuse):
+          outputs.append(
+              modeling.attention_layer(
+                  from_tensor=from_tensor,
+                  to_tensor=from_tensor,
+                  attention_mask=attention_mask,
+                  num_attention_heads=2,
+                  size_per_head=8,
+                  attention_window=3,
+                  num_global_tokens=1))
+
+      sess.run(tf.global_variables_initializer())
+      (static_np, dynamic_np) = sess.run(outputs, feed_dict=feed_dict)
+      self.assertAllClose(static_np, dynamic_np, rtol=1e-5, atol=1e-5)
+
+  def test_one_hot_embeddings(self):
+    with self.test_session() as sess:
+      config = modeling.BertConfig(
+          vocab_size=99,
+          hidden_size=32,
+          num_hidden_layers=1,
+          num_attention_heads=4,
+          intermediate_size=37,
+          type_vocab_size=3)
+      input_ids = BertModelTest.ids_tensor([2, 7], config.vocab_size)
+      token_type_ids = BertModelTest.ids_tensor([2, 7], config.type_vocab_size)
+      self.assertFalse(modeling.is_xla_compiled())
+
+      outputs = []
+      for (reuse, use_one_hot_embeddings) in [(False, True), (True, False)]:
+        with tf.variable_scope(tf.get_variable_scope(), reuse=reuse):
+          model = modeling.BertModel(
+              config=config,
+              is_training=False,
+              input_ids=input_ids,
+              token_type_ids=token_type_ids,
+              scope="bert",
+              use_one_hot_embeddings=use_one_hot_embeddings)
+          outputs.append(model.get_embedding_output())
+
+      sess.run(tf.global_variables_initializer())
+      (one_hot_np, gather_np) = sess.run(outputs)
+      self.assertAllClose(one_hot_np, gather_np)
+
+  def test_attention_bias(self):
+    with self.test_session() as sess:
+      input_tensor = tf.random_normal([2, 5, 16], seed=1)
+      input_mask = tf.constant([[1, 1, 1, 0, 0], [1, 1, 1, 1, 1]])
+      attention_bias = modeling.create_attention_bias_from_input_mask(
+          input_mask)
+      self.assertEqual(attention_bias.shape.as_list(), [2, 1, 1, 5])
+
+      outputs = []
+      for (reuse, kwargs) in [
+          (False, {
+              "attention_mask":
+                  modeling.create_attention_mask_from_input_mask(
+                      input_tensor, input_mask)
+          }),
+          (True, {
+              "attention_bias": attention_bias
+          }),
+      ]:
+        with tf.variable_scope("encoder", reuse=reuse):
+          outputs.append(
+              modeling.transformer_model(
+                  input_tensor=input_tensor,
+                  hidden_size=16,
+                  num_hidden_layers=2,
+                  num_attention_heads=2,
+                  intermediate_size=32,
+                  hidden_dropout_prob=0.0,
+                  attention_probs_dropout_prob=0.0,
+                  **kwargs))
+
+      sess.run(tf.global_variables_initializer())
+      (mask_np, bias_np) = sess.run(outputs)
+      self.assertAllClose(mask_np, bias_np)
+
+  def test_unpadded_encoder(self):
+    with self.test_session() as sess:
+      input_tensor = tf.random_normal([2, 5, 16], seed=1)
+      input_mask = tf.constant([[1, 1, 1, 0, 0], [1, 1, 1, 1, 1]])
+      attention_mask = modeling.create_attention_mask_from_input_mask(
+          input_tensor, input_mask)
+      outputs = []
+      for (reuse, unpadded_mask) in [(False, None), (True, input_mask)]:
+        with tf.variable_scope("encoder", reuse=reuse):
+          outputs.append(
+              modeling.transformer_model(
+                  input_tensor=input_tensor,
+                  attention_mask=attention_mask,
+                  hidden_size=16,
+                  num_hidden_layers=2,
+                  num_attention_heads=2,
+                  intermediate_size=32,
+                  hidden_dropout_prob=0.0,
+                  attention_probs_dropout_prob=0.0,
+                  input_mask=unpadded_mask))
+
+      sess.run(tf.global_variables_initializer())
+      (padded_np, unpadded_np, mask_np) = sess.run(outputs + [input_mask])
+      real_tokens = mask_np.astype(bool)
+      self.assertAllClose(padded_np[real_tokens], unpadded_np[real_tokens],
+                          rtol=1e-5, atol=1e-5)
+      self.assertAllEqual(unpadded_np[~real_tokens],
+                          np.zeros_like(unpadded_np[~real_tokens]))
+
+  def test_factorized_embedding_and_shared_layers(self):
+    config = modeling.BertConfig(
+        vocab_size=99,
+        hidden_size=32,
+        num_hidden_layers=3,
+        num_attention_heads=4,
+        intermediate_size=37,
+        embedding_size=16,
+        share_layer_weights=True)
+    input_ids = BertModelTest.ids_tensor([2, 7], config.vocab_size)
+    model = modeling.BertModel(
+        config=config, is_training=True, input_ids=input_ids)
+
+    self.assertEqual(model.get_embedding_table().shape.as_list(), [99, 16])
+    self.assertEqual(model.get_sequence_output().shape.as_list(), [2, 7, 32])
+    self.assertEqual(len(model.get_all_encoder_layers()), 3)
+
+    variable_names = [var.op.name for var in tf.trainable_variables()]
+    self.assertIn("bert/encoder/embedding_hidden_mapping_in/kernel",
+                  variable_names)
+    layer_names = set(
+        re.match(r"bert/encoder/(layer_\w+?)/", name).group(1)
+        for name in variable_names
+        if re.match(r"bert/encoder/layer_", name))
+    self.assertEqual(layer_names, set(["layer_shared"]))
+
+  def test_max_layer_depth(self):
+    with self.test_session() as sess:
+      config = modeling.BertConfig(
+          vocab_size=99,
+          hidden_size=32,
+          num_hidden_layers=4,
+          num_attention_heads=4,
+          intermediate_size=37)
+      input_ids = BertModelTest.ids_tensor([2, 7], config.vocab_size)
+      full_model = modeling.BertModel(
+          config=config, is_training=False, input_ids=input_ids)
+      with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+        shallow_model = modeling.BertModel(
+            config=config,
+            is_training=False,
+            input_ids=input_ids,
+            scope="bert",
+            max_layer_depth=2,
+            use_pooler=False)
+
+      self.assertEqual(len(shallow_model.get_all_encoder_layers()), 2)
+      self.assertIsNone(shallow_model.get_pooled_output())
+
+      sess.run(tf.global_variables_initializer())
+      sess.run(tf.local_variables_initializer())
+      (expected, actual) = sess.run([
+          full_model.get_all_encoder_layers()[1],
+          shallow_model.get_sequence_output()
+      ])
+      self.assertAllClose(expected, actual)
+
+  def test_cls_only_last_layer(self):
+    with self.test_session() as sess:
+      config = modeling.BertConfig(
+          vocab_size=99,
+          hidden_size=32,
+          num_hidden_layers=3,
+          num_attention_heads=4,
+          intermediate_size=37)
+      input_ids = BertModelTest.ids_tensor([2, 7], config.vocab_size)
+      input_mask = tf.constant([[1, 1, 1, 1, 1, 1, 1], [1, 1, 1, 0, 0, 0, 0]])
+      full_model = modeling.BertModel(
+          config=config,
+          is_training=False,
+          input_ids=input_ids,
+          input_mask=input_mask)
+      with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+        cls_model = modeling.BertModel(
+            config=config,
+            is_training=False,
+            input_ids=input_ids,
+            input_mask=input_mask,
+            scope="bert",
+            cls_only_last_layer=True)
+
+      self.assertEqual(cls_model.get_sequence_output().shape.as_list(),
+                       [2, 1, 32])
+
+      sess.run(tf.global_variables_initializer())
+      sess.run(tf.local_variables_initializer())
+      (expected_pooled, expected_cls, actual_pooled, actual_cls) = sess.run([
+          full_model.get_pooled_output(),
+          full_model.get_sequence_output()[:, 0:1, :],
+          cls_model.get_pooled_output(),
+          cls_model.get_sequence_output()
+      ])
+      self.assertAllClose(expected_pooled, actual_pooled)
+      self.assertAllClose(expected_cls, actual_cls)
+
+  def test_early_exit(self):
+    with self.test_session() as sess:
+      input_tensor = tf.random_normal([4, 5, 16], seed=1)
+      attention_mask = modeling.create_attention_mask_from_input_mask(
+          input_tensor, tf.constant([[1, 1, 1, 0, 0]] * 4))
+      exit_layers = {0: [1], 1: [0, 3]}
+
+      def early_exit_fn(layer_idx, layer_output, remaining_indices):
+        self.assertEqual(layer_output.shape[-1].value, 16)
+        exits = tf.zeros_like(remaining_indices, dtype=tf.bool)
+        for example_idx in exit_layers[layer_idx]:
+          exits = tf.logical_or(exits, tf.equal(remaining_indices,
+                                                example_idx))
+        return exits
+
+      with tf.variable_scope("encoder"):
+        full_output = modeling.transformer_model(
+            input_tensor=input_tensor,
+            attention_mask=attention_mask,
+            hidden_size=16,
+            num_hidden_layers=3,
+            num_attention_heads=2,
+            intermediate_size=32,
+            hidden_dropout_prob=0.0,
+            attention_probs_dropout_prob=0.0)
+      with tf.variable_scope("encoder", reuse=True):
+        (early_exit_output, remaining_indices) = modeling.transformer_model(
+            input_tensor=input_tensor,
+            attention_mask=attention_mask,
+            hidden_size=16,
+            num_hidden_layers=3,
+            num_attention_heads=2,
+            intermediate_size=32,
+            hidden_dropout_prob=0.0,
+            attention_probs_dropout_prob=0.0,
+            early_exit_fn=early_exit_fn)
+
+      sess.run(tf.global_variables_initializer())
+      (full_np, early_exit_np, remaining_np) = sess.run(
+          [full_output, early_exit_output, remaining_indices])
+      self.assertAllEqual(remaining_np, [2])
+      self.assertAllClose(full_np[remaining_np], early_exit_np,
+                          rtol=1e-5, atol=1e-5)
+
   def run_tester(self, tester):
     with self.test_session() as sess:
       ops = tester.create_model()
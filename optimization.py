@@ -22,8 +22,24 @@ import re
 import tensorflow as tf
 
 
-def create_optimizer(loss, init_lr, num_train_steps, num_warmup_steps, use_tpu):
-  """Creates an optimizer training op."""
+def create_optimizer(loss, init_lr, num_train_steps, num_warmup_steps, use_tpu,
+                     gradient_accumulation_steps=1,
+                     use_dynamic_loss_scaling=False):
+  """Creates an optimizer training op.
+
+  If `gradient_accumulation_steps` > 1, the gradients of that many consecutive
+  calls (micro-batches) are summed into non-trainable buffers and the weights
+  are only updated on every `gradient_accumulation_steps`-th call, with the
+  averaged gradient. `global_step`, and therefore the learning rate schedule,
+  `num_train_steps` and `num_warmup_steps`, count weight updates, not calls.
+
+  `use_dynamic_loss_scaling` should be set when the model computes in float16
+  (see `BertConfig.compute_dtype`). The loss is then multiplied by a loss scale
+  before differentiation so that small gradients do not underflow, and the
+  gradients are unscaled before clipping. Calls whose gradients overflow are
+  skipped and halve the loss scale, which doubles again after a long enough
+  run of finite gradients.
+  """
   global_step = tf.train.get_or_create_global_step()
 
   learning_rate = tf.constant(value=init_lr, shape=[], dtype=tf.float32)
@@ -68,22 +84,196 @@ def create_optimizer(loss, init_lr, num_train_steps, num_warmup_steps, use_tpu):
     optimizer = tf.contrib.tpu.CrossShardOptimizer(optimizer)
 
   tvars = tf.trainable_variables()
-  grads = tf.gradients(loss, tvars)
+  grads_are_finite = None
+  if use_dynamic_loss_scaling:
+    (grads, grads_are_finite,
+     update_loss_scale_fn) = _compute_loss_scaled_gradients(loss, tvars)
+  else:
+    grads = tf.gradients(loss, tvars)
+
+  if gradient_accumulation_steps > 1:
+    train_op = _create_accumulation_train_op(optimizer, grads, tvars,
+                                             global_step,
+                                             gradient_accumulation_steps,
+                                             grads_are_finite)
+  else:
+
+    def _apply_gradients():
+      """Clips and applies `grads` and increments `global_step`."""
+      # This is how the model was pre-trained.
+      (clipped_grads, _) = tf.clip_by_global_norm(grads, clip_norm=1.0)
 
-  # This is how the model was pre-trained.
-  (grads, _) = tf.clip_by_global_norm(grads, clip_norm=1.0)
+      train_op = optimizer.apply_gradients(
+          zip(clipped_grads, tvars), global_step=global_step)
 
-  train_op = optimizer.apply_gradients(
-      zip(grads, tvars), global_step=global_step)
+      # Normally the global step update is done inside of `apply_gradients`.
+      # However, `AdamWeightDecayOptimizer` doesn't do this. But if you use
+      # a different optimizer, you should probably take this line out.
+      new_global_step = global_step + 1
+      return tf.group(train_op, [global_step.assign(new_global_step)])
 
-  # Normally the global step update is done inside of `apply_gradients`.
-  # However, `AdamWeightDecayOptimizer` doesn't do this. But if you use
-  # a different optimizer, you should probably take this line out.
-  new_global_step = global_step + 1
-  train_op = tf.group(train_op, [global_step.assign(new_global_step)])
+    if grads_are_finite is None:
+      train_op = _apply_gradients()
+    else:
+      # Overflowed steps are skipped and do not count as training steps.
+      train_op = tf.cond(grads_are_finite, _apply_gradients, tf.no_op)
+
+  if use_dynamic_loss_scaling:
+    with tf.control_dependencies([train_op]):
+      train_op = update_loss_scale_fn()
   return train_op
 
 
+def _compute_loss_scaled_gradients(loss, tvars, init_loss_scale=2.0**15,
+                                   loss_scale_increase_steps=2000):
+  """Computes the gradients of `loss` with dynamic loss scaling.
+
+  Args:
+    loss: float32 scalar Tensor.
+    tvars: List of variables to differentiate with respect to.
+    init_loss_scale: float. Initial value of the loss scale.
+    loss_scale_increase_steps: int. The loss scale is doubled after this many
+      consecutive calls with finite gradients.
+
+  Returns:
+    A tuple of the unscaled gradients, a bool scalar Tensor telling whether
+    they are all finite, and a function building the op that updates the loss
+    scale. The update op must run after the gradients have been consumed.
+  """
+  with tf.variable_scope("loss_scale"):
+    loss_scale = tf.get_variable(
+        name="loss_scale",
+        shape=[],
+        dtype=tf.float32,
+        trainable=False,
+        initializer=tf.constant_initializer(init_loss_scale))
+    good_steps = tf.get_variable(
+        name="good_steps",
+        shape=[],
+        dtype=tf.int32,
+        trainable=False,
+        initializer=tf.zeros_initializer())
+
+  scaled_grads = tf.gradients(loss * loss_scale, tvars)
+  grads = []
+  for grad in scaled_grads:
+    if grad is None:
+      grads.append(None)
+      continue
+    if isinstance(grad, tf.IndexedSlices):
+      grad = tf.convert_to_tensor(grad)
+    grads.append(grad / loss_scale)
+
+  grads_are_finite = tf.reduce_all(
+      [tf.reduce_all(tf.is_finite(g)) for g in grads if g is not None])
+
+  def update_loss_scale_fn():
+    """Halves the loss scale on overflow, doubles it after enough good steps."""
+    next_good_steps = good_steps + 1
+    do_increase = tf.logical_and(
+        grads_are_finite, next_good_steps >= loss_scale_increase_steps)
+    new_loss_scale = tf.where(
+        grads_are_finite,
+        tf.where(do_increase, loss_scale * 2.0, loss_scale),
+        tf.maximum(loss_scale * 0.5, 1.0))
+    new_good_steps = tf.where(
+        tf.logical_and(grads_are_finite, tf.logical_not(do_increase)),
+        next_good_steps, tf.zeros_like(next_good_steps))
+    return tf.group(
+        loss_scale.assign(new_loss_scale), good_steps.assign(new_good_steps))
+
+  return (grads, grads_are_finite, update_loss_scale_fn)
+
+
+def _create_accumulation_train_op(optimizer, grads, tvars, global_step,
+                                  gradient_accumulation_steps,
+                                  grads_are_finite=None):
+  """Accumulates `grads` and applies them every N calls of the train op.
+
+  If `grads_are_finite` is given, micro-batches whose gradients overflowed are
+  not added to the buffers, and the buffers are averaged over the finite
+  micro-batches only. If all of them overflowed, the update is skipped.
+  """
+  with tf.variable_scope("gradient_accumulation"):
+    accum_step = tf.get_variable(
+        name="accum_step",
+        shape=[],
+        dtype=tf.int32,
+        trainable=False,
+        initializer=tf.zeros_initializer())
+    # The number of micro-batches summed into the buffers.
+    num_accum_grads = tf.get_variable(
+        name="num_accum_grads",
+        shape=[],
+        dtype=tf.float32,
+        trainable=False,
+        initializer=tf.zeros_initializer())
+
+    accum_vars = []
+    for (grad, param) in zip(grads, tvars):
+      if grad is None:
+        accum_vars.append(None)
+        continue
+      param_name = re.match("^(.*):\\d+$", param.name).group(1)
+      accum_vars.append(
+          tf.get_variable(
+              name=param_name + "/accum_grad",
+              shape=param.shape.as_list(),
+              dtype=tf.float32,
+              trainable=False,
+              initializer=tf.zeros_initializer()))
+
+  def _accumulate_gradients():
+    accum_ops = []
+    for (grad, accum_var) in zip(grads, accum_vars):
+      if grad is None:
+        continue
+      if isinstance(grad, tf.IndexedSlices):
+        grad = tf.convert_to_tensor(grad)
+      accum_ops.append(accum_var.assign_add(grad))
+    accum_ops.append(num_accum_grads.assign_add(1.0))
+    return tf.group(*accum_ops)
+
+  if grads_are_finite is None:
+    accum_op = _accumulate_gradients()
+  else:
+    accum_op = tf.cond(grads_are_finite, _accumulate_gradients, tf.no_op)
+
+  next_accum_step = accum_step + 1
+  is_update_step = tf.equal(next_accum_step % gradient_accumulation_steps, 0)
+
+  def _apply_accumulated_gradients():
+    """Applies the averaged, clipped gradients and clears the buffers."""
+    accum_grads = [
+        None if v is None else v / num_accum_grads for v in accum_vars
+    ]
+
+    # This is how the model was pre-trained. Here the norm is that of the
+    # gradient of the whole effective batch, not of a single micro-batch.
+    (accum_grads, _) = tf.clip_by_global_norm(accum_grads, clip_norm=1.0)
+
+    apply_op = optimizer.apply_gradients(
+        zip(accum_grads, tvars), global_step=global_step)
+
+    with tf.control_dependencies([apply_op]):
+      reset_ops = [
+          v.assign(tf.zeros_like(v)) for v in accum_vars if v is not None
+      ]
+      reset_ops.append(num_accum_grads.assign(0.0))
+      return tf.group(global_step.assign(global_step + 1), *reset_ops)
+
+  with tf.control_dependencies([accum_op]):
+    # Reads `num_accum_grads` after this micro-batch was counted.
+    # 所有micro-batch都溢出时不更新权重
+    do_update = tf.logical_and(is_update_step,
+                               num_accum_grads.read_value() > 0.0)
+    update_op = tf.cond(do_update, _apply_accumulated_gradients, tf.no_op)
+
+  with tf.control_dependencies([update_op]):
+    train_op = accum_step.assign(next_accum_step)
+  return tf.group(train_op)
+
+
 class AdamWeightDecayOptimizer(tf.train.Optimizer):
   """A basic Adam optimizer that includes "correct" L2 weight decay."""
 
@@ -43,6 +43,111 @@ class OptimizationTest(tf.test.TestCase):
       w_np = sess.run(w)
       self.assertAllClose(w_np.flat, [0.4, 0.2, -0.5], rtol=1e-2, atol=1e-2)
 
+  def test_gradient_accumulation(self):
+    with self.test_session() as sess:
+      w = tf.get_variable(
+          "w",
+          shape=[3],
+          initializer=tf.constant_initializer([0.1, -0.2, -0.1]))
+      x = tf.placeholder(tf.float32, shape=[3])
+      loss = tf.reduce_mean(tf.square(x - w))
+      train_op = optimization.create_optimizer(
+          loss,
+          init_lr=0.2,
+          num_train_steps=10,
+          num_warmup_steps=0,
+          use_tpu=False,
+          gradient_accumulation_steps=2)
+      global_step = tf.train.get_or_create_global_step()
+      init_op = tf.group(tf.global_variables_initializer(),
+                         tf.local_variables_initializer())
+      sess.run(init_op)
+      w_init = sess.run(w)
+
+      # The first micro-batch only accumulates its gradient.
+      sess.run(train_op, feed_dict={x: [0.4, 0.2, -0.5]})
+      self.assertAllClose(sess.run(w), w_init)
+      self.assertEqual(sess.run(global_step), 0)
+
+      # The second one applies the update and counts a single step.
+      sess.run(train_op, feed_dict={x: [0.2, 0.0, -0.3]})
+      self.assertNotAllClose(sess.run(w), w_init)
+      self.assertEqual(sess.run(global_step), 1)
+
+  def test_dynamic_loss_scaling(self):
+    with self.test_session() as sess:
+      w = tf.get_variable(
+          "w",
+          shape=[3],
+          initializer=tf.constant_initializer([0.1, -0.2, -0.1]))
+      x = tf.placeholder(tf.float32, shape=[3])
+      loss = tf.reduce_sum(x * w)
+      train_op = optimization.create_optimizer(
+          loss,
+          init_lr=0.2,
+          num_train_steps=10,
+          num_warmup_steps=0,
+          use_tpu=False,
+          use_dynamic_loss_scaling=True)
+      global_step = tf.train.get_or_create_global_step()
+      with tf.variable_scope("loss_scale", reuse=True):
+        loss_scale = tf.get_variable("loss_scale")
+      init_op = tf.group(tf.global_variables_initializer(),
+                         tf.local_variables_initializer())
+      sess.run(init_op)
+      w_init = sess.run(w)
+      init_loss_scale = sess.run(loss_scale)
+
+      # An overflowing step is skipped and halves the loss scale.
+      sess.run(train_op, feed_dict={x: [float("inf"), 1.0, 1.0]})
+      self.assertAllClose(sess.run(w), w_init)
+      self.assertEqual(sess.run(global_step), 0)
+      self.assertEqual(sess.run(loss_scale), init_loss_scale / 2.0)
+
+      sess.run(train_op, feed_dict={x: [1.0, 1.0, 1.0]})
+      self.assertNotAllClose(sess.run(w), w_init)
+      self.assertEqual(sess.run(global_step), 1)
+
+  def test_gradient_accumulation_with_overflow(self):
+    with self.test_session() as sess:
+      w = tf.get_variable(
+          "w",
+          shape=[3],
+          initializer=tf.constant_initializer([0.1, -0.2, -0.1]))
+      x = tf.placeholder(tf.float32, shape=[3])
+      loss = tf.reduce_sum(x * w)
+      train_op = optimization.create_optimizer(
+          loss,
+          init_lr=0.2,
+          num_train_steps=10,
+          num_warmup_steps=0,
+          use_tpu=False,
+          gradient_accumulation_steps=2,
+          use_dynamic_loss_scaling=True)
+      global_step = tf.train.get_or_create_global_step()
+      with tf.variable_scope("gradient_accumulation", reuse=True):
+        num_accum_grads = tf.get_variable("num_accum_grads")
+        accum_grad = tf.get_variable("w/accum_grad")
+      init_op = tf.group(tf.global_variables_initializer(),
+                         tf.local_variables_initializer())
+      sess.run(init_op)
+      w_init = sess.run(w)
+
+      # When all the micro-batches overflow, there is no update.
+      for _ in range(2):
+        sess.run(train_op, feed_dict={x: [float("inf"), 1.0, 1.0]})
+      self.assertAllClose(sess.run(w), w_init)
+      self.assertEqual(sess.run(global_step), 0)
+
+      # Only the finite micro-batches are counted in the average.
+      sess.run(train_op, feed_dict={x: [float("inf"), 1.0, 1.0]})
+      self.assertEqual(sess.run(num_accum_grads), 0.0)
+      sess.run(train_op, feed_dict={x: [1.0, 2.0, 3.0]})
+      self.assertNotAllClose(sess.run(w), w_init)
+      self.assertEqual(sess.run(global_step), 1)
+      self.assertEqual(sess.run(num_accum_grads), 0.0)
+      self.assertAllClose(sess.run(accum_grad), [0.0, 0.0, 0.0])
+
 
 if __name__ == "__main__":
   tf.test.main()
@@ -0,0 +1,117 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""In-process classifier predictor that keeps its session open.
+
+Unlike `run_classifier.py --do_predict`, which builds the graph, restores the
+checkpoint and writes a TFRecord file on every run, `BertPredictor` builds the
+graph and restores the checkpoint once and converts the texts in memory:
+
+  predictor = BertPredictor(bert_config, init_checkpoint, label_list,
+                            tokenizer, max_seq_length=128)
+  probabilities = predictor.predict(["a sentence", ("a pair", "of texts")])
+  predictor.close()
+
+`predict` can be called from several threads at once. A single thread runs the
+session, on micro-batches of the examples of all the pending calls, see
+`serving.BatchingPredictor`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+import run_classifier
+import serving
+import tensorflow as tf
+
+
+class BertPredictor(serving.BatchingPredictor):
+  """Classifies texts with a fine-tuned `run_classifier.py` checkpoint."""
+
+  def __init__(self,
+               bert_config,
+               init_checkpoint,
+               label_list,
+               tokenizer,
+               max_seq_length,
+               max_batch_size=8,
+               max_wait_secs=0.005):
+    """Builds the graph and restores the checkpoint.
+
+    Args:
+      bert_config: `BertConfig` of the fine-tuned model.
+      init_checkpoint: The fine-tuned checkpoint.
+      label_list: The labels of the task, see `DataProcessor.get_labels`.
+      tokenizer: `FullTokenizer` of the model.
+      max_seq_length: int. The texts are truncated to this many tokens.
+      max_batch_size: (optional) int. The maximum number of examples run at
+        once.
+      max_wait_secs: (optional) float. How long the oldest pending example
+        waits for others to fill its batch.
+    """
+    self._label_list = label_list
+    self._tokenizer = tokenizer
+    self._max_seq_length = max_seq_length
+    self._num_examples_converted = 0
+    self._lock = threading.Lock()
+
+    def create_outputs(input_ids, input_mask, segment_ids):
+      (_, _, _, probabilities) = run_classifier.create_model(
+          bert_config, False, input_ids, input_mask, segment_ids,
+          tf.zeros_like(input_ids[:, 0]), len(label_list),
+          use_one_hot_embeddings=None)
+      return [probabilities]
+
+    super(BertPredictor, self).__init__(
+        create_outputs,
+        init_checkpoint,
+        max_batch_size=max_batch_size,
+        max_wait_secs=max_wait_secs)
+
+  def predict(self, texts):
+    """Classifies texts.
+
+    Args:
+      texts: List of strings, or of (text_a, text_b) pairs for sentence pair
+        tasks.
+
+    Returns:
+      List of float32 arrays of shape [num_labels], the class probabilities of
+      every text.
+    """
+    features = [self._convert_text(text) for text in texts]
+    return [
+        probabilities
+        for (probabilities,) in self.predict_features(features)
+    ]
+
+  def _convert_text(self, text):
+    if isinstance(text, (tuple, list)):
+      (text_a, text_b) = text
+    else:
+      (text_a, text_b) = (text, None)
+
+    with self._lock:
+      ex_index = self._num_examples_converted
+      self._num_examples_converted += 1
+    example = run_classifier.InputExample(
+        guid="predict-%d" % ex_index,
+        text_a=text_a,
+        text_b=text_b,
+        label=self._label_list[0])
+    return run_classifier.convert_single_example(
+        ex_index, example, self._label_list, self._max_seq_length,
+        self._tokenizer, pad_to_max_seq_length=False)
@@ -0,0 +1,117 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import threading
+
+import modeling
+import predictor
+import run_classifier
+import tensorflow as tf
+import tokenization
+
+
+class BertPredictorTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(BertPredictorTest, self).setUp()
+    vocab_tokens = [
+        "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa", "un", "runn",
+        "##ing", ","
+    ]
+    vocab_file = os.path.join(self.get_temp_dir(), "vocab.txt")
+    with tf.gfile.GFile(vocab_file, "w") as writer:
+      writer.write("".join([x + "\n" for x in vocab_tokens]))
+    self.tokenizer = tokenization.FullTokenizer(vocab_file)
+    self.label_list = ["0", "1"]
+    self.max_seq_length = 16
+    self.bert_config = modeling.BertConfig(
+        vocab_size=len(vocab_tokens),
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        intermediate_size=37,
+        max_position_embeddings=64,
+        type_vocab_size=2)
+    self.init_checkpoint = os.path.join(self.get_temp_dir(), "model.ckpt")
+    self.texts = [
+        "unwanted running", ("want", "unwanted, running"), "wa", "runn ##ing"
+    ]
+
+  def run_estimator_path(self, texts):
+    """Runs the model on features padded to `max_seq_length`."""
+    features = []
+    for (i, text) in enumerate(texts):
+      (text_a, text_b) = text if isinstance(text, tuple) else (text, None)
+      example = run_classifier.InputExample(
+          guid=str(i), text_a=text_a, text_b=text_b, label="0")
+      features.append(
+          run_classifier.convert_single_example(i, example, self.label_list,
+                                                self.max_seq_length,
+                                                self.tokenizer))
+
+    with tf.Graph().as_default():
+      (_, _, _, probabilities) = run_classifier.create_model(
+          self.bert_config, False,
+          tf.constant([f.input_ids for f in features]),
+          tf.constant([f.input_mask for f in features]),
+          tf.constant([f.segment_ids for f in features]),
+          tf.zeros([len(features)], dtype=tf.int32), len(self.label_list),
+          use_one_hot_embeddings=None)
+      with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(tf.local_variables_initializer())
+        tf.train.Saver().save(sess, self.init_checkpoint)
+        return sess.run(probabilities)
+
+  def test_predict(self):
+    expected = self.run_estimator_path(self.texts)
+    bert_predictor = predictor.BertPredictor(
+        self.bert_config, self.init_checkpoint, self.label_list,
+        self.tokenizer, self.max_seq_length, max_batch_size=3)
+    actual = bert_predictor.predict(self.texts)
+    bert_predictor.close()
+    self.assertAllClose(expected, actual, rtol=1e-5, atol=1e-5)
+
+  def test_concurrent_predict(self):
+    expected = self.run_estimator_path(self.texts)
+    bert_predictor = predictor.BertPredictor(
+        self.bert_config, self.init_checkpoint, self.label_list,
+        self.tokenizer, self.max_seq_length, max_batch_size=4,
+        max_wait_secs=0.05)
+
+    results = [None] * 8
+
+    def predict(i):
+      results[i] = bert_predictor.predict(self.texts[i % 4:] +
+                                          self.texts[:i % 4])
+
+    threads = [threading.Thread(target=predict, args=(i,)) for i in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    bert_predictor.close()
+
+    for (i, result) in enumerate(results):
+      rotated = list(expected[i % 4:]) + list(expected[:i % 4])
+      self.assertAllClose(rotated, result, rtol=1e-5, atol=1e-5)
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -0,0 +1,307 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Scores the attention heads of a fine-tuned classifier and prunes them.
+
+The importance of a head is the mean absolute gradient of the dev set loss
+with respect to a mask multiplied into the output of the head (Michel et al.,
+"Are Sixteen Heads Really Better than One?"), normalized per layer. The
+`num_heads_to_prune` least important heads are then removed from the
+checkpoint: their columns of the query, key and value kernels and their rows
+of the attention output kernel are dropped. The pruned checkpoint and its
+`bert_config.json` (with `num_attention_heads_per_layer`) can be used with
+`run_classifier.py` and `benchmark_model.py` as they are, e.g.:
+
+  python prune_heads.py --task_name=MRPC --data_dir=$GLUE_DIR/MRPC \
+    --vocab_file=$BERT_BASE_DIR/vocab.txt \
+    --bert_config_file=$BERT_BASE_DIR/bert_config.json \
+    --init_checkpoint=/tmp/mrpc_output/model.ckpt-343 \
+    --max_seq_length=128 --num_heads_to_prune=48 --output_dir=/tmp/mrpc_output
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import copy
+import json
+import os
+import modeling
+import modeling_numpy
+import numpy as np
+import run_classifier
+import tokenization
+import tensorflow as tf
+
+flags = tf.flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer(
+    "num_heads_to_prune", 0,
+    "Number of attention heads with the lowest importance to remove from the "
+    "whole model. Every layer keeps at least one head. If 0, the heads are "
+    "only scored.")
+
+flags.DEFINE_string(
+    "pruned_output_dir", None,
+    "Where to write the pruned checkpoint and its bert_config.json. Defaults "
+    "to `output_dir`/pruned.")
+
+
+def get_num_heads_per_layer(bert_config):
+  """Returns the number of attention heads of each layer of `bert_config`."""
+  if bert_config.num_attention_heads_per_layer is None:
+    return [bert_config.num_attention_heads] * bert_config.num_hidden_layers
+  return list(bert_config.num_attention_heads_per_layer)
+
+
+def compute_head_importance(bert_config, num_labels, init_checkpoint,
+                            features, batch_size):
+  """Scores every attention head by the gradient of the loss on `features`.
+
+  Args:
+    bert_config: `BertConfig` of the fine-tuned model.
+    num_labels: int. Number of classes of the task.
+    init_checkpoint: Path of the fine-tuned checkpoint.
+    features: list of `run_classifier.InputFeatures`, e.g. the dev set.
+    batch_size: int. Number of examples per gradient computation.
+
+  Returns:
+    A list with one float array per layer, holding the importance of each of
+    its heads. The importances of a layer have unit L2 norm.
+  """
+  num_heads_per_layer = get_num_heads_per_layer(bert_config)
+  seq_length = len(features[0].input_ids)
+
+  with tf.Graph().as_default():
+    input_ids = tf.placeholder(tf.int32, [None, seq_length], "input_ids")
+    input_mask = tf.placeholder(tf.int32, [None, seq_length], "input_mask")
+    segment_ids = tf.placeholder(tf.int32, [None, seq_length], "segment_ids")
+    label_ids = tf.placeholder(tf.int32, [None], "label_ids")
+    head_mask = tf.placeholder_with_default(
+        tf.ones([bert_config.num_hidden_layers,
+                 bert_config.num_attention_heads]),
+        shape=[bert_config.num_hidden_layers,
+               bert_config.num_attention_heads])
+
+    (_, per_example_loss, _, _) = run_classifier.create_model(
+        bert_config, False, input_ids, input_mask, segment_ids, label_ids,
+        num_labels, False, head_mask=head_mask)
+    # 损失对每个head的mask求导，梯度的绝对值越大说明这个head越重要
+    head_gradient = tf.gradients(
+        tf.reduce_sum(per_example_loss), head_mask)[0]
+
+    tvars = tf.trainable_variables()
+    (assignment_map, _) = modeling.get_assignment_map_from_checkpoint(
+        tvars, init_checkpoint)
+    modeling.init_from_checkpoint(init_checkpoint, assignment_map)
+
+    head_importance = np.zeros(
+        [bert_config.num_hidden_layers, bert_config.num_attention_heads],
+        dtype=np.float64)
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      sess.run(tf.local_variables_initializer())
+      for start in range(0, len(features), batch_size):
+        batch = features[start:start + batch_size]
+        feed_dict = {
+            input_ids: [f.input_ids for f in batch],
+            input_mask: [f.input_mask for f in batch],
+            segment_ids: [f.segment_ids for f in batch],
+            label_ids: [f.label_id for f in batch],
+        }
+        head_importance += np.abs(sess.run(head_gradient, feed_dict))
+
+  head_importance /= len(features)
+  result = []
+  for (layer_idx, num_heads) in enumerate(num_heads_per_layer):
+    layer_importance = head_importance[layer_idx, :num_heads]
+    norm = np.linalg.norm(layer_importance)
+    result.append(layer_importance / max(norm, 1e-20))
+  return result
+
+
+def select_heads_to_prune(head_importance, num_heads_to_prune):
+  """Picks the least important heads of the whole model.
+
+  Args:
+    head_importance: list of per-layer importance arrays, as returned by
+      `compute_head_importance`.
+    num_heads_to_prune: int. Number of heads to remove.
+
+  Returns:
+    A dict from layer index to the sorted list of the head indexes to remove
+    from that layer. Every layer keeps at least its most important head, so
+    fewer heads may be returned.
+  """
+  candidates = []
+  for (layer_idx, layer_importance) in enumerate(head_importance):
+    most_important = int(np.argmax(layer_importance))
+    for (head_idx, importance) in enumerate(layer_importance):
+      if head_idx != most_important:
+        candidates.append((float(importance), layer_idx, head_idx))
+  candidates.sort()
+
+  heads_to_prune = {}
+  for (_, layer_idx, head_idx) in candidates[:num_heads_to_prune]:
+    heads_to_prune.setdefault(layer_idx, []).append(head_idx)
+  for layer_idx in heads_to_prune:
+    heads_to_prune[layer_idx].sort()
+  return heads_to_prune
+
+
+def prune_weights(bert_config, weights, heads_to_prune, scope="bert"):
+  """Removes attention heads from the weights of a `BertModel`.
+
+  Args:
+    bert_config: `BertConfig` the weights were trained with.
+    weights: dict from variable name to array.
+    heads_to_prune: dict from layer index to the list of head indexes to
+      remove, as returned by `select_heads_to_prune`.
+    scope: (optional) The variable scope the `BertModel` was built in.
+
+  Returns:
+    A tuple of the pruned weights and of the `BertConfig` to use with them.
+
+  Raises:
+    ValueError: A layer would lose all of its heads, or the layers share
+      their weights.
+  """
+  if bert_config.share_layer_weights:
+    raise ValueError("Cannot prune the heads of layers that share weights.")
+  size_per_head = bert_config.hidden_size // bert_config.num_attention_heads
+  num_heads_per_layer = get_num_heads_per_layer(bert_config)
+
+  pruned_weights = dict(weights)
+  for (layer_idx, head_indexes) in heads_to_prune.items():
+    num_heads = num_heads_per_layer[layer_idx]
+    kept_heads = sorted(set(range(num_heads)) - set(head_indexes))
+    if not kept_heads:
+      raise ValueError("Cannot prune all the heads of layer %d." % layer_idx)
+
+    # 每个head占kernel里连续的`size_per_head`列
+    columns = np.concatenate([
+        np.arange(x * size_per_head, (x + 1) * size_per_head)
+        for x in kept_heads
+    ])
+    prefix = "%s/encoder/layer_%d/attention/" % (scope, layer_idx)
+    for name in ["query", "key", "value"]:
+      kernel_name = prefix + "self/%s/kernel" % name
+      bias_name = prefix + "self/%s/bias" % name
+      pruned_weights[kernel_name] = np.asarray(weights[kernel_name])[:, columns]
+      pruned_weights[bias_name] = np.asarray(weights[bias_name])[columns]
+    output_kernel_name = prefix + "output/dense/kernel"
+    pruned_weights[output_kernel_name] = np.asarray(
+        weights[output_kernel_name])[columns, :]
+    num_heads_per_layer[layer_idx] = len(kept_heads)
+
+  pruned_config = copy.deepcopy(bert_config)
+  pruned_config.num_attention_heads_per_layer = num_heads_per_layer
+  return (pruned_weights, pruned_config)
+
+
+def prune_checkpoint(bert_config, init_checkpoint, heads_to_prune,
+                     output_dir):
+  """Writes a pruned copy of `init_checkpoint` and its config to `output_dir`.
+
+  The optimizer slots and the global step are not copied.
+
+  Returns:
+    The `BertConfig` of the pruned model.
+  """
+  weights = {}
+  for (name, value) in modeling_numpy.load_weights_from_checkpoint(
+      init_checkpoint).items():
+    if name == "global_step" or name.endswith("/adam_m") or name.endswith(
+        "/adam_v"):
+      continue
+    weights[name] = np.asarray(value)
+
+  (pruned_weights, pruned_config) = prune_weights(bert_config, weights,
+                                                  heads_to_prune)
+
+  tf.gfile.MakeDirs(output_dir)
+  modeling_numpy.save_weights_to_checkpoint(
+      pruned_weights, os.path.join(output_dir, "bert_model.ckpt"))
+  with tf.gfile.GFile(os.path.join(output_dir, "bert_config.json"),
+                      "w") as writer:
+    writer.write(pruned_config.to_json_string())
+  return pruned_config
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  tf.gfile.MakeDirs(FLAGS.output_dir)
+
+  task_name = FLAGS.task_name.lower()
+  if task_name not in run_classifier.PROCESSORS:
+    raise ValueError("Task not found: %s" % (task_name))
+
+  processor = run_classifier.PROCESSORS[task_name]()
+  label_list = processor.get_labels()
+
+  tokenizer = tokenization.FullTokenizer(
+      vocab_file=FLAGS.vocab_file, do_lower_case=FLAGS.do_lower_case)
+  bert_config = modeling.BertConfig.from_json_file(FLAGS.bert_config_file)
+
+  eval_examples = processor.get_dev_examples(FLAGS.data_dir)
+  eval_features = run_classifier.convert_examples_to_features(
+      eval_examples, label_list, FLAGS.max_seq_length, tokenizer)
+
+  tf.logging.info("***** Scoring attention heads *****")
+  tf.logging.info("  Num examples = %d", len(eval_examples))
+  tf.logging.info("  Batch size = %d", FLAGS.eval_batch_size)
+  head_importance = compute_head_importance(
+      bert_config, len(label_list), FLAGS.init_checkpoint, eval_features,
+      FLAGS.eval_batch_size)
+  heads_to_prune = select_heads_to_prune(head_importance,
+                                         FLAGS.num_heads_to_prune)
+
+  output_importance_file = os.path.join(FLAGS.output_dir,
+                                        "head_importance.json")
+  with tf.gfile.GFile(output_importance_file, "w") as writer:
+    writer.write(
+        json.dumps(
+            {
+                "head_importance": [x.tolist() for x in head_importance],
+                "heads_to_prune":
+                    {str(k): v for (k, v) in heads_to_prune.items()},
+            },
+            indent=2) + "\n")
+  for (layer_idx, layer_importance) in enumerate(head_importance):
+    tf.logging.info("  layer %d = %s", layer_idx,
+                    " ".join("%.3f" % x for x in layer_importance))
+
+  if not heads_to_prune:
+    return
+
+  pruned_output_dir = FLAGS.pruned_output_dir or os.path.join(
+      FLAGS.output_dir, "pruned")
+  pruned_config = prune_checkpoint(bert_config, FLAGS.init_checkpoint,
+                                   heads_to_prune, pruned_output_dir)
+  tf.logging.info("Wrote the pruned checkpoint to %s", pruned_output_dir)
+  tf.logging.info("  Heads per layer = %s",
+                  pruned_config.num_attention_heads_per_layer)
+
+
+if __name__ == "__main__":
+  flags.mark_flag_as_required("data_dir")
+  flags.mark_flag_as_required("task_name")
+  flags.mark_flag_as_required("vocab_file")
+  flags.mark_flag_as_required("bert_config_file")
+  flags.mark_flag_as_required("init_checkpoint")
+  flags.mark_flag_as_required("output_dir")
+  tf.app.run()
@@ -0,0 +1,113 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import modeling
+import modeling_numpy
+import numpy as np
+import prune_heads
+import tensorflow as tf
+
+
+class PruneHeadsTest(tf.test.TestCase):
+
+  def create_config(self):
+    return modeling.BertConfig(
+        vocab_size=99,
+        hidden_size=32,
+        num_hidden_layers=3,
+        num_attention_heads=4,
+        intermediate_size=37,
+        max_position_embeddings=64,
+        type_vocab_size=2)
+
+  def create_inputs(self, batch_size=2, seq_length=7):
+    rng = np.random.RandomState(12345)
+    input_ids = rng.randint(0, 99, size=[batch_size, seq_length])
+    input_mask = np.ones([batch_size, seq_length], dtype=np.int32)
+    input_mask[0, seq_length // 2:] = 0
+    token_type_ids = rng.randint(0, 2, size=[batch_size, seq_length])
+    return (input_ids.astype(np.int32), input_mask,
+            token_type_ids.astype(np.int32))
+
+  def run_model(self, config, inputs, init_checkpoint=None,
+                save_checkpoint=None, head_mask=None):
+    (input_ids, input_mask, token_type_ids) = inputs
+    with tf.Graph().as_default():
+      model = modeling.BertModel(
+          config=config,
+          is_training=False,
+          input_ids=tf.constant(input_ids),
+          input_mask=tf.constant(input_mask),
+          token_type_ids=tf.constant(token_type_ids),
+          head_mask=None if head_mask is None else tf.constant(head_mask))
+      if init_checkpoint:
+        (assignment_map, _) = modeling.get_assignment_map_from_checkpoint(
+            tf.trainable_variables(), init_checkpoint)
+        modeling.init_from_checkpoint(init_checkpoint, assignment_map)
+      with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(tf.local_variables_initializer())
+        if save_checkpoint:
+          tf.train.Saver().save(sess, save_checkpoint)
+        return sess.run(model.get_sequence_output())
+
+  def test_select_heads_to_prune(self):
+    head_importance = [
+        np.array([0.1, 0.9, 0.2, 0.3]),
+        np.array([0.05, 0.01, 0.02, 0.04]),
+    ]
+    heads_to_prune = prune_heads.select_heads_to_prune(head_importance, 6)
+    # The most important head of every layer is kept.
+    self.assertEqual(heads_to_prune, {0: [0, 2, 3], 1: [1, 2, 3]})
+
+  def test_prune_checkpoint(self):
+    config = self.create_config()
+    inputs = self.create_inputs()
+    init_checkpoint = os.path.join(self.get_temp_dir(), "full.ckpt")
+    pruned_dir = os.path.join(self.get_temp_dir(), "pruned")
+    heads_to_prune = {0: [1], 2: [0, 3]}
+
+    head_mask = np.ones([3, 4], dtype=np.float32)
+    for (layer_idx, head_indexes) in heads_to_prune.items():
+      head_mask[layer_idx, head_indexes] = 0.0
+    expected = self.run_model(config, inputs, save_checkpoint=init_checkpoint,
+                              head_mask=head_mask)
+
+    pruned_config = prune_heads.prune_checkpoint(config, init_checkpoint,
+                                                 heads_to_prune, pruned_dir)
+    self.assertEqual(pruned_config.num_attention_heads_per_layer, [3, 4, 2])
+
+    pruned_checkpoint = os.path.join(pruned_dir, "bert_model.ckpt")
+    self.assertEqual(
+        dict(tf.train.list_variables(pruned_checkpoint))[
+            "bert/encoder/layer_2/attention/self/query/kernel"], [32, 16])
+    actual = self.run_model(pruned_config, inputs,
+                            init_checkpoint=pruned_checkpoint)
+    self.assertAllClose(expected, actual, rtol=1e-4, atol=1e-4)
+
+    # The NumPy engine runs the pruned checkpoint as well.
+    numpy_model = modeling_numpy.NumpyBertModel.from_checkpoint(
+        pruned_config, pruned_checkpoint)
+    (numpy_output, _) = numpy_model.predict(*inputs)
+    self.assertAllClose(expected, numpy_output, rtol=1e-4, atol=1e-4)
+
+
+if __name__ == "__main__":
+  tf.test.main()
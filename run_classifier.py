@@ -20,7 +20,12 @@ from __future__ import print_function
 
 import collections
 import csv
+import itertools
+import multiprocessing
 import os
+import time
+import inference_graph
+import input_pipeline
 import modeling
 import optimization
 import tokenization
@@ -67,6 +72,38 @@ flags.DEFINE_integer(
     "Sequences longer than this will be truncated, and sequences shorter "
     "than this will be padded.")
 
+flags.DEFINE_bool(
+    "dynamic_seq_length", False,
+    "Whether to store the examples unpadded and pad each batch only to its "
+    "longest example instead of to `max_seq_length`. Not supported on TPU.")
+
+flags.DEFINE_list(
+    "length_bucket_boundaries", None,
+    "Only used if `dynamic_seq_length` is True. Comma separated sequence "
+    "lengths at which the training examples are split into buckets, so that "
+    "each training batch holds examples of a similar length, e.g. "
+    "\"32,64,96\".")
+
+flags.DEFINE_enum(
+    "compression_type", "", ["", "GZIP", "ZLIB"],
+    "Compression of the intermediate TFRecord files written to `output_dir`.")
+
+flags.DEFINE_bool(
+    "streaming_examples", False,
+    "Whether to read the examples lazily while they are written to the "
+    "TFRecord files, counting them from the number of lines of the data "
+    "files, instead of reading them into memory first. For data sets that do "
+    "not fit in memory.")
+
+flags.DEFINE_integer(
+    "num_conversion_workers", 1,
+    "If > 1, the examples are converted to TFRecord shards by this many "
+    "processes, each of them converting a contiguous chunk of the examples. "
+    "With `streaming_examples`, every process reads the data file from its "
+    "start and skips the examples before its chunk, so the files are parsed "
+    "about num_conversion_workers / 2 times in total. Only the chunk is "
+    "tokenized, though, which is most of the work.")
+
 flags.DEFINE_bool("do_train", False, "Whether to run training.")
 
 flags.DEFINE_bool("do_eval", False, "Whether to run eval on the dev set.")
@@ -75,8 +112,63 @@ flags.DEFINE_bool(
     "do_predict", False,
     "Whether to run the model in inference mode on the test set.")
 
+flags.DEFINE_bool(
+    "do_export", False,
+    "Whether to export the model as a frozen, optimized inference graph and "
+    "SavedModel to `export_dir`.")
+
+flags.DEFINE_string(
+    "export_dir", None,
+    "Only used if `do_export` is True. Where to export the inference graph. "
+    "Defaults to `output_dir`/export.")
+
+flags.DEFINE_integer(
+    "num_export_benchmark_requests", 0,
+    "Only used if `do_export` is True. If > 0, the cold start and the "
+    "per-request latency of the exported graph and of `estimator.predict` "
+    "are measured on this many single dev set examples.")
+
 flags.DEFINE_integer("train_batch_size", 32, "Total batch size for training.")
 
+flags.DEFINE_integer(
+    "gradient_accumulation_steps", 1,
+    "Number of micro-batches of `train_batch_size` whose gradients are "
+    "accumulated before each weight update. The effective batch size is "
+    "`train_batch_size * gradient_accumulation_steps`.")
+
+flags.DEFINE_integer(
+    "recompute_grad_layers", 0,
+    "If > 0, recompute the activations of every group of this many encoder "
+    "layers in the backward pass instead of keeping them in memory.")
+
+flags.DEFINE_enum(
+    "compute_dtype", "float32", ["float32", "float16", "bfloat16"],
+    "The dtype the encoder computes in. Weights are kept in float32. float16 "
+    "training uses dynamic loss scaling.")
+
+flags.DEFINE_bool(
+    "unpadded_encoder", False,
+    "Whether the encoder's dense layers and layer normalization skip the "
+    "padding tokens. Not supported on TPU.")
+
+flags.DEFINE_bool(
+    "train_early_exits", False,
+    "Whether to also train a classifier on every encoder layer but the last, "
+    "so that `do_predict` can use `early_exit_entropy`.")
+
+flags.DEFINE_bool(
+    "early_exit_post_hoc", False,
+    "Only used if `train_early_exits` is True. Whether to train only the "
+    "early exit classifiers, on top of the frozen fine-tuned model of "
+    "`init_checkpoint`, instead of jointly with the model.")
+
+flags.DEFINE_float(
+    "early_exit_entropy", 0.0,
+    "If > 0, `do_predict` stops computing the layers of an example after the "
+    "first early exit classifier whose prediction entropy is below this "
+    "value. Needs a model trained with `train_early_exits`. Not supported on "
+    "TPU.")
+
 flags.DEFINE_integer("eval_batch_size", 8, "Total batch size for eval.")
 
 flags.DEFINE_integer("predict_batch_size", 8, "Total batch size for predict.")
@@ -174,6 +266,39 @@ class InputFeatures(object):
     self.is_real_example = is_real_example
 
 
+def count_lines(input_file):
+  """Counts the lines of a file, caching the count in a sidecar file.
+
+  The count is written to `input_file`.count, if possible, and read from it as
+  long as it is not older than `input_file`.
+  """
+  count_file = input_file + ".count"
+  if (tf.gfile.Exists(count_file) and tf.gfile.Stat(count_file).mtime_nsec >=
+      tf.gfile.Stat(input_file).mtime_nsec):
+    with tf.gfile.GFile(count_file, "r") as reader:
+      return int(reader.read())
+
+  # 按块读取并统计换行符，不解析每一行
+  num_lines = 0
+  last_chunk = b""
+  with tf.gfile.GFile(input_file, "rb") as reader:
+    while True:
+      chunk = reader.read(1 << 20)
+      if not chunk:
+        break
+      num_lines += chunk.count(b"\n")
+      last_chunk = chunk
+  if last_chunk and not last_chunk.endswith(b"\n"):
+    num_lines += 1
+
+  try:
+    with tf.gfile.GFile(count_file, "w") as writer:
+      writer.write("%d\n" % num_lines)
+  except tf.errors.OpError as e:
+    tf.logging.warning("Could not write %s: %s", count_file, e)
+  return num_lines
+
+
 class DataProcessor(object):
   """Base class for data converters for sequence classification data sets."""
 
@@ -193,15 +318,79 @@ class DataProcessor(object):
     """Gets the list of labels for this data set."""
     raise NotImplementedError()
 
+  def iter_examples(self, data_dir, set_type):
+    """Yields the `InputExample`s of a set one at a time.
+
+    The processors of large data sets override this to read their files
+    lazily, instead of into a list like the `get_*_examples` methods.
+
+    Args:
+      data_dir: The data directory.
+      set_type: "train", "dev" or "test".
+    """
+    return iter(getattr(self, "get_%s_examples" % set_type)(data_dir))
+
+  def count_examples(self, data_dir, set_type):
+    """Counts the `InputExample`s of a set without keeping them in memory."""
+    return sum(1 for _ in self.iter_examples(data_dir, set_type))
+
   @classmethod
   def _read_tsv(cls, input_file, quotechar=None):
     """Reads a tab separated value file."""
+    return list(cls._iter_tsv(input_file, quotechar))
+
+  @classmethod
+  def _iter_tsv(cls, input_file, quotechar=None):
+    """Yields the lines of a tab separated value file one at a time."""
     with tf.gfile.Open(input_file, "r") as f:
       reader = csv.reader(f, delimiter="\t", quotechar=quotechar)
-      lines = []
       for line in reader:
-        lines.append(line)
-      return lines
+        yield line
+
+
+class TsvDataProcessor(DataProcessor):
+  """Base class for data sets with one TSV file per set.
+
+  Every line of the files but the header is an example, so the examples are
+  read lazily and counted from the number of lines, see `count_lines`.
+  Subclasses define `_get_tsv_file` and `_iter_examples`.
+  """
+
+  def get_train_examples(self, data_dir):
+    """See base class."""
+    return list(self.iter_examples(data_dir, "train"))
+
+  def get_dev_examples(self, data_dir):
+    """See base class."""
+    return list(self.iter_examples(data_dir, "dev"))
+
+  def get_test_examples(self, data_dir):
+    """See base class."""
+    return list(self.iter_examples(data_dir, "test"))
+
+  def iter_examples(self, data_dir, set_type):
+    """See base class."""
+    (file_name, name) = self._get_tsv_file(set_type)
+    return self._iter_examples(
+        self._iter_tsv(os.path.join(data_dir, file_name)), name)
+
+  def count_examples(self, data_dir, set_type):
+    """See base class."""
+    (file_name, name) = self._get_tsv_file(set_type)
+    return (count_lines(os.path.join(data_dir, file_name)) -
+            self._num_header_lines(name))
+
+  def _get_tsv_file(self, set_type):
+    """Returns the file name of a set and the name `_iter_examples` takes."""
+    raise NotImplementedError()
+
+  def _iter_examples(self, lines, set_type):
+    """Yields the examples of the lines of a set."""
+    raise NotImplementedError()
+
+  def _num_header_lines(self, set_type):  # pylint: disable=unused-argument
+    """Returns the number of lines `_iter_examples` skips."""
+    return 1
 
 
 class XnliProcessor(DataProcessor):
@@ -252,32 +441,23 @@ class XnliProcessor(DataProcessor):
     return ["contradiction", "entailment", "neutral"]
 
 
-class MnliProcessor(DataProcessor):
+class MnliProcessor(TsvDataProcessor):
   """Processor for the MultiNLI data set (GLUE version)."""
 
-  def get_train_examples(self, data_dir):
-    """See base class."""
-    return self._create_examples(
-        self._read_tsv(os.path.join(data_dir, "train.tsv")), "train")
-
-  def get_dev_examples(self, data_dir):
-    """See base class."""
-    return self._create_examples(
-        self._read_tsv(os.path.join(data_dir, "dev_matched.tsv")),
-        "dev_matched")
-
-  def get_test_examples(self, data_dir):
-    """See base class."""
-    return self._create_examples(
-        self._read_tsv(os.path.join(data_dir, "test_matched.tsv")), "test")
-
   def get_labels(self):
     """See base class."""
     return ["contradiction", "entailment", "neutral"]
 
-  def _create_examples(self, lines, set_type):
+  def _get_tsv_file(self, set_type):
+    """See base class."""
+    return {
+        "train": ("train.tsv", "train"),
+        "dev": ("dev_matched.tsv", "dev_matched"),
+        "test": ("test_matched.tsv", "test"),
+    }[set_type]
+
+  def _iter_examples(self, lines, set_type):
     """Creates examples for the training and dev sets."""
-    examples = []
     for (i, line) in enumerate(lines):
       if i == 0:
         continue
@@ -288,36 +468,22 @@ class MnliProcessor(DataProcessor):
         label = "contradiction"
       else:
         label = tokenization.convert_to_unicode(line[-1])
-      examples.append(
-          InputExample(guid=guid, text_a=text_a, text_b=text_b, label=label))
-    return examples
+      yield InputExample(guid=guid, text_a=text_a, text_b=text_b, label=label)
 
 
-class MrpcProcessor(DataProcessor):
+class MrpcProcessor(TsvDataProcessor):
   """Processor for the MRPC data set (GLUE version)."""
 
-  def get_train_examples(self, data_dir):
-    """See base class."""
-    return self._create_examples(
-        self._read_tsv(os.path.join(data_dir, "train.tsv")), "train")
-
-  def get_dev_examples(self, data_dir):
-    """See base class."""
-    return self._create_examples(
-        self._read_tsv(os.path.join(data_dir, "dev.tsv")), "dev")
-
-  def get_test_examples(self, data_dir):
-    """See base class."""
-    return self._create_examples(
-        self._read_tsv(os.path.join(data_dir, "test.tsv")), "test")
-
   def get_labels(self):
     """See base class."""
     return ["0", "1"]
 
-  def _create_examples(self, lines, set_type):
+  def _get_tsv_file(self, set_type):
+    """See base class."""
+    return ("%s.tsv" % set_type, set_type)
+
+  def _iter_examples(self, lines, set_type):
     """Creates examples for the training and dev sets."""
-    examples = []
     for (i, line) in enumerate(lines):
       if i == 0:
         continue
@@ -328,36 +494,22 @@ class MrpcProcessor(DataProcessor):
         label = "0"
       else:
         label = tokenization.convert_to_unicode(line[0])
-      examples.append(
-          InputExample(guid=guid, text_a=text_a, text_b=text_b, label=label))
-    return examples
+      yield InputExample(guid=guid, text_a=text_a, text_b=text_b, label=label)
 
 
-class ColaProcessor(DataProcessor):
+class ColaProcessor(TsvDataProcessor):
   """Processor for the CoLA data set (GLUE version)."""
 
-  def get_train_examples(self, data_dir):
-    """See base class."""
-    return self._create_examples(
-        self._read_tsv(os.path.join(data_dir, "train.tsv")), "train")
-
-  def get_dev_examples(self, data_dir):
-    """See base class."""
-    return self._create_examples(
-        self._read_tsv(os.path.join(data_dir, "dev.tsv")), "dev")
-
-  def get_test_examples(self, data_dir):
-    """See base class."""
-    return self._create_examples(
-        self._read_tsv(os.path.join(data_dir, "test.tsv")), "test")
-
   def get_labels(self):
     """See base class."""
     return ["0", "1"]
 
-  def _create_examples(self, lines, set_type):
+  def _get_tsv_file(self, set_type):
+    """See base class."""
+    return ("%s.tsv" % set_type, set_type)
+
+  def _iter_examples(self, lines, set_type):
     """Creates examples for the training and dev sets."""
-    examples = []
     for (i, line) in enumerate(lines):
       # Only the test set has a header
       if set_type == "test" and i == 0:
@@ -369,14 +521,31 @@ class ColaProcessor(DataProcessor):
       else:
         text_a = tokenization.convert_to_unicode(line[3])
         label = tokenization.convert_to_unicode(line[1])
-      examples.append(
-          InputExample(guid=guid, text_a=text_a, text_b=None, label=label))
-    return examples
+      yield InputExample(guid=guid, text_a=text_a, text_b=None, label=label)
+
+  def _num_header_lines(self, set_type):
+    """See base class."""
+    return 1 if set_type == "test" else 0
+
+
+def create_label_map(label_list):
+  """Returns the dict from the labels to their ids."""
+  label_map = {}
+  for (i, label) in enumerate(label_list):
+    label_map[label] = i
+  return label_map
 
 
 def convert_single_example(ex_index, example, label_list, max_seq_length,
-                           tokenizer):
-  """Converts a single `InputExample` into a single `InputFeatures`."""
+                           tokenizer, pad_to_max_seq_length=True,
+                           label_map=None):
+  """Converts a single `InputExample` into a single `InputFeatures`.
+
+  If `pad_to_max_seq_length` is False, the features are only truncated to
+  `max_seq_length` and are left unpadded. The callers converting many
+  examples pass the `label_map` of `create_label_map(label_list)` so that it
+  is not rebuilt for every example.
+  """
 
   if isinstance(example, PaddingInputExample):
     return InputFeatures(
@@ -386,9 +555,8 @@ def convert_single_example(ex_index, example, label_list, max_seq_length,
         label_id=0,
         is_real_example=False)
 
-  label_map = {}
-  for (i, label) in enumerate(label_list):
-    label_map[label] = i
+  if label_map is None:
+    label_map = create_label_map(label_list)
 
   tokens_a = tokenizer.tokenize(example.text_a)
   tokens_b = None
@@ -447,14 +615,15 @@ def convert_single_example(ex_index, example, label_list, max_seq_length,
   input_mask = [1] * len(input_ids)
 
   # Zero-pad up to the sequence length.
-  while len(input_ids) < max_seq_length:
-    input_ids.append(0)
-    input_mask.append(0)
-    segment_ids.append(0)
+  if pad_to_max_seq_length:
+    while len(input_ids) < max_seq_length:
+      input_ids.append(0)
+      input_mask.append(0)
+      segment_ids.append(0)
 
-  assert len(input_ids) == max_seq_length
-  assert len(input_mask) == max_seq_length
-  assert len(segment_ids) == max_seq_length
+    assert len(input_ids) == max_seq_length
+    assert len(input_mask) == max_seq_length
+    assert len(segment_ids) == max_seq_length
 
   label_id = label_map[example.label]
   if ex_index < 5:
@@ -477,17 +646,38 @@ def convert_single_example(ex_index, example, label_list, max_seq_length,
 
 
 def file_based_convert_examples_to_features(
-    examples, label_list, max_seq_length, tokenizer, output_file):
-  """Convert a set of `InputExample`s to a TFRecord file."""
-
-  writer = tf.python_io.TFRecordWriter(output_file)
-
-  for (ex_index, example) in enumerate(examples):
+    examples, label_list, max_seq_length, tokenizer, output_file,
+    compression_type=None, pad_to_max_seq_length=True, num_examples=None,
+    first_ex_index=0):
+  """Convert a set of `InputExample`s to a TFRecord file.
+
+  `examples` can be an iterator, e.g. of `DataProcessor.iter_examples`, whose
+  examples are then converted and written one at a time. `num_examples` is
+  only used to log the progress and defaults to `len(examples)`.
+  `first_ex_index` is the index of the first example in its set, for a shard
+  of `parallel_convert_examples_to_features`.
+
+  Returns:
+    The number of examples written.
+  """
+  if num_examples is None:
+    num_examples = len(examples)
+  label_map = create_label_map(label_list)
+
+  options = None
+  if compression_type:
+    options = tf.python_io.TFRecordOptions(
+        getattr(tf.python_io.TFRecordCompressionType, compression_type))
+  writer = tf.python_io.TFRecordWriter(output_file, options=options)
+
+  num_written = 0
+  for (ex_index, example) in enumerate(examples, first_ex_index):
     if ex_index % 10000 == 0:
-      tf.logging.info("Writing example %d of %d" % (ex_index, len(examples)))
+      tf.logging.info("Writing example %d of %d" % (ex_index, num_examples))
 
     feature = convert_single_example(ex_index, example, label_list,
-                                     max_seq_length, tokenizer)
+                                     max_seq_length, tokenizer,
+                                     pad_to_max_seq_length, label_map)
 
     def create_int_feature(values):
       f = tf.train.Feature(int64_list=tf.train.Int64List(value=list(values)))
@@ -503,17 +693,134 @@ def file_based_convert_examples_to_features(
 
     tf_example = tf.train.Example(features=tf.train.Features(feature=features))
     writer.write(tf_example.SerializeToString())
+    num_written += 1
   writer.close()
+  return num_written
+
+
+# The tokenizer of a conversion worker process, built once by
+# `_init_conversion_worker`.
+_worker_tokenizer = None
+
+
+def _init_conversion_worker(vocab_file, do_lower_case):
+  global _worker_tokenizer
+  _worker_tokenizer = tokenization.FullTokenizer(
+      vocab_file=vocab_file, do_lower_case=do_lower_case)
+
+
+def _convert_shard(args):
+  """Converts a contiguous chunk of examples in a worker process."""
+  (examples, start, stop, first_ex_index, num_examples, label_list,
+   max_seq_length, shard_file, compression_type, pad_to_max_seq_length) = args
+  return file_based_convert_examples_to_features(
+      itertools.islice(examples, start, stop), label_list, max_seq_length,
+      _worker_tokenizer, shard_file, compression_type, pad_to_max_seq_length,
+      num_examples=num_examples, first_ex_index=first_ex_index)
+
+
+def parallel_convert_examples_to_features(
+    examples, label_list, max_seq_length, vocab_file, do_lower_case,
+    output_file, num_workers, compression_type=None,
+    pad_to_max_seq_length=True, num_examples=None):
+  """Converts a set of `InputExample`s to TFRecord shards with processes.
+
+  Every worker process builds its tokenizer once and converts a contiguous
+  chunk of the examples to its own shard, `output_file`-<i>-of-<n>. Read in
+  order, the shards hold the same records as the file of
+  `file_based_convert_examples_to_features`.
+
+  `StreamedExamples` are read by every worker from the start of the set, and
+  the examples before its chunk are parsed but not tokenized.
+
+  Args:
+    examples: List of `InputExample`s, or `StreamedExamples`, which every
+      worker then reads itself.
+    label_list: The labels of the task.
+    max_seq_length: int. See `convert_single_example`.
+    vocab_file: The vocabulary file of the tokenizer.
+    do_lower_case: bool. Whether the tokenizer lower cases the text.
+    output_file: The prefix of the shards.
+    num_workers: int. The number of worker processes and of shards.
+    compression_type: (optional) The compression of the shards.
+    pad_to_max_seq_length: (optional) See `convert_single_example`.
+    num_examples: (optional) int. The number of examples, `len(examples)` by
+      default.
+
+  Returns:
+    A tuple of the list of the shards, in the order of the examples, and of
+    the number of examples written.
+  """
+  if num_examples is None:
+    num_examples = len(examples)
+  num_shards = max(1, min(num_workers, num_examples))
+
+  tasks = []
+  shard_files = []
+  for shard_index in range(num_shards):
+    start = shard_index * num_examples // num_shards
+    stop = (shard_index + 1) * num_examples // num_shards
+    shard_file = "%s-%05d-of-%05d" % (output_file, shard_index, num_shards)
+    shard_files.append(shard_file)
+    # 列表只把对应的一段发给worker，流式读取时由worker自己跳到这一段
+    if isinstance(examples, list):
+      task_examples = examples[start:stop]
+      (task_start, task_stop) = (0, stop - start)
+    else:
+      task_examples = examples
+      (task_start, task_stop) = (start, stop)
+    tasks.append((task_examples, task_start, task_stop, start, num_examples,
+                  label_list, max_seq_length, shard_file, compression_type,
+                  pad_to_max_seq_length))
+
+  # Forking after TensorFlow started its threads, e.g. after `estimator.train`,
+  # can deadlock the workers, so they are spawned where possible.
+  if hasattr(multiprocessing, "get_context"):
+    context = multiprocessing.get_context("spawn")
+  else:
+    context = multiprocessing
+  pool = context.Pool(
+      num_shards,
+      initializer=_init_conversion_worker,
+      initargs=(vocab_file, do_lower_case))
+  try:
+    num_written = pool.map(_convert_shard, tasks)
+  finally:
+    pool.close()
+    pool.join()
+  return (shard_files, sum(num_written))
 
 
 def file_based_input_fn_builder(input_file, seq_length, is_training,
-                                drop_remainder):
-  """Creates an `input_fn` closure to be passed to TPUEstimator."""
+                                drop_remainder, compression_type=None,
+                                dynamic_seq_length=False,
+                                length_bucket_boundaries=None,
+                                num_cpu_threads=4):
+  """Creates an `input_fn` closure to be passed to TPUEstimator.
+
+  `input_file` is a file or a list of shards, e.g. of
+  `parallel_convert_examples_to_features`. If `dynamic_seq_length` is True,
+  it must hold unpadded examples and every batch is padded only to its
+  longest example. The training batches are then also grouped by
+  `length_bucket_boundaries`, if given.
+  """
+  if isinstance(input_file, (list, tuple)):
+    input_files = list(input_file)
+  else:
+    input_files = [input_file]
+
+  def _read_tfrecord(filename):
+    return tf.data.TFRecordDataset(filename, compression_type=compression_type)
+
+  if dynamic_seq_length:
+    seq_feature = tf.VarLenFeature(tf.int64)
+  else:
+    seq_feature = tf.FixedLenFeature([seq_length], tf.int64)
 
   name_to_features = {
-      "input_ids": tf.FixedLenFeature([seq_length], tf.int64),
-      "input_mask": tf.FixedLenFeature([seq_length], tf.int64),
-      "segment_ids": tf.FixedLenFeature([seq_length], tf.int64),
+      "input_ids": seq_feature,
+      "input_mask": seq_feature,
+      "segment_ids": seq_feature,
       "label_ids": tf.FixedLenFeature([], tf.int64),
       "is_real_example": tf.FixedLenFeature([], tf.int64),
   }
@@ -526,6 +833,8 @@ def file_based_input_fn_builder(input_file, seq_length, is_training,
     # So cast all int64 to int32.
     for name in list(example.keys()):
       t = example[name]
+      if isinstance(t, tf.SparseTensor):
+        t = tf.sparse_tensor_to_dense(t)
       if t.dtype == tf.int64:
         t = tf.to_int32(t)
       example[name] = t
@@ -538,10 +847,39 @@ def file_based_input_fn_builder(input_file, seq_length, is_training,
 
     # For training, we want a lot of parallel reading and shuffling.
     # For eval, we want no shuffling and parallel reading doesn't matter.
-    d = tf.data.TFRecordDataset(input_file)
-    if is_training:
+    if is_training and len(input_files) > 1:
+      d = tf.data.Dataset.from_tensor_slices(tf.constant(input_files))
       d = d.repeat()
+      d = d.shuffle(buffer_size=len(input_files))
+
+      # `cycle_length` is the number of parallel files that get read.
+      cycle_length = min(num_cpu_threads, len(input_files))
+
+      # `sloppy` mode means that the interleaving is not exact. This adds
+      # even more randomness to the training pipeline.
+      d = d.apply(
+          tf.contrib.data.parallel_interleave(
+              _read_tfrecord,
+              sloppy=is_training,
+              cycle_length=cycle_length))
       d = d.shuffle(buffer_size=100)
+    else:
+      # The eval and predict shards are read one after another, so that the
+      # predictions stay in the order of the examples.
+      d = _read_tfrecord(input_files)
+      if is_training:
+        d = d.repeat()
+        d = d.shuffle(buffer_size=100)
+
+    if dynamic_seq_length:
+      d = d.map(lambda record: _decode_record(record, name_to_features))
+      d = input_pipeline.padded_batch_by_length(
+          d,
+          batch_size=batch_size,
+          drop_remainder=drop_remainder,
+          length_bucket_boundaries=(
+              length_bucket_boundaries if is_training else None))
+      return d
 
     d = d.apply(
         tf.contrib.data.map_and_batch(
@@ -572,23 +910,61 @@ def _truncate_seq_pair(tokens_a, tokens_b, max_length):
 
 
 def create_model(bert_config, is_training, input_ids, input_mask, segment_ids,
-                 labels, num_labels, use_one_hot_embeddings):
-  """Creates a classification model."""
+                 labels, num_labels, use_one_hot_embeddings, head_mask=None,
+                 train_early_exits=False, early_exit_post_hoc=False):
+  """Creates a classification model.
+
+  If `train_early_exits` is True, an early exit classifier on every encoder
+  layer but the last is trained with the same loss, jointly with the model or,
+  if `early_exit_post_hoc` is True, alone on top of the frozen model.
+  """
   model = modeling.BertModel(
       config=bert_config,
       is_training=is_training,
       input_ids=input_ids,
       input_mask=input_mask,
       token_type_ids=segment_ids,
-      use_one_hot_embeddings=use_one_hot_embeddings)
+      use_one_hot_embeddings=use_one_hot_embeddings,
+      head_mask=head_mask,
+      cls_only_last_layer=True)
 
   # In the demo, we are doing a simple classification task on the entire
   # segment.
   #
   # If you want to use the token-level output, use model.get_sequence_output()
-  # instead.
+  # instead, and build the model without `cls_only_last_layer`.
   output_layer = model.get_pooled_output()
 
+  (loss, per_example_loss, logits,
+   probabilities) = create_classification_layer(output_layer, is_training,
+                                                labels, num_labels)
+  if not train_early_exits:
+    return (loss, per_example_loss, logits, probabilities)
+
+  one_hot_labels = tf.one_hot(labels, depth=num_labels, dtype=tf.float32)
+  all_encoder_layers = model.get_all_encoder_layers()
+  early_exit_losses = []
+  for layer_idx in range(len(all_encoder_layers) - 1):
+    layer_output = all_encoder_layers[layer_idx]
+    if early_exit_post_hoc:
+      # 事后训练时只训练提前退出的分类器，模型本身不更新
+      layer_output = tf.stop_gradient(layer_output)
+    early_exit_logits = create_early_exit_layer(layer_output, layer_idx,
+                                                num_labels, is_training)
+    log_probs = tf.nn.log_softmax(early_exit_logits, axis=-1)
+    early_exit_losses.append(
+        tf.reduce_mean(-tf.reduce_sum(one_hot_labels * log_probs, axis=-1)))
+
+  if early_exit_post_hoc:
+    loss = tf.add_n(early_exit_losses)
+  else:
+    loss += tf.add_n(early_exit_losses)
+  return (loss, per_example_loss, logits, probabilities)
+
+
+def create_classification_layer(output_layer, is_training, labels,
+                                num_labels):
+  """Adds the classification layer and loss on top of the pooled output."""
   hidden_size = output_layer.shape[-1].value
 
   output_weights = tf.get_variable(
@@ -616,9 +992,99 @@ def create_model(bert_config, is_training, input_ids, input_mask, segment_ids,
     return (loss, per_example_loss, logits, probabilities)
 
 
+def create_early_exit_layer(layer_output, layer_idx, num_labels, is_training):
+  """Returns the logits of the early exit classifier after `layer_idx`.
+
+  The classifier is a pooler and an output layer on the first token, like the
+  one on the last layer, with its own variables under "early_exit/".
+  """
+  layer_output = tf.cast(layer_output, tf.float32)
+  hidden_size = layer_output.shape[-1].value
+  with tf.variable_scope("early_exit/layer_%d" % layer_idx):
+    first_token_tensor = tf.squeeze(layer_output[:, 0:1, :], axis=1)
+    pooled_output = tf.layers.dense(
+        first_token_tensor,
+        hidden_size,
+        activation=tf.tanh,
+        name="pooler",
+        kernel_initializer=modeling.create_initializer())
+    if is_training:
+      pooled_output = tf.nn.dropout(pooled_output, keep_prob=0.9)
+    logits = tf.layers.dense(
+        pooled_output,
+        num_labels,
+        name="output",
+        kernel_initializer=modeling.create_initializer())
+  return logits
+
+
+def create_early_exit_model(bert_config, input_ids, input_mask, segment_ids,
+                            labels, num_labels, use_one_hot_embeddings,
+                            entropy_threshold):
+  """Creates an inference-only classifier whose examples may exit early.
+
+  After every encoder layer but the last, the examples whose early exit
+  classifier has a prediction entropy below `entropy_threshold` take that
+  prediction and are removed from the batch, so the later layers only run on
+  the remaining examples.
+
+  Returns:
+    A tuple of the probabilities, of shape [batch_size, num_labels], and of
+    the number of encoder layers computed for each example, of shape
+    [batch_size].
+  """
+  batch_size = tf.shape(input_ids)[0]
+  # The early exit classifiers are called inside the encoder's variable scope
+  # but must create the same variables as `create_model`.
+  outer_scope = tf.get_variable_scope()
+  exits = []
+
+  def early_exit_fn(layer_idx, layer_output, remaining_indices):
+    with tf.variable_scope(outer_scope):
+      logits = create_early_exit_layer(layer_output, layer_idx, num_labels,
+                                       False)
+    probabilities = tf.nn.softmax(logits, axis=-1)
+    log_probs = tf.nn.log_softmax(logits, axis=-1)
+    entropy = -tf.reduce_sum(probabilities * log_probs, axis=-1)
+    # 熵小于阈值说明已经足够确定，直接在这一层输出
+    is_exit = entropy < entropy_threshold
+    exits.append((tf.boolean_mask(remaining_indices, is_exit),
+                  tf.boolean_mask(probabilities, is_exit), layer_idx + 1))
+    return is_exit
+
+  model = modeling.BertModel(
+      config=bert_config,
+      is_training=False,
+      input_ids=input_ids,
+      input_mask=input_mask,
+      token_type_ids=segment_ids,
+      use_one_hot_embeddings=use_one_hot_embeddings,
+      early_exit_fn=early_exit_fn,
+      cls_only_last_layer=True)
+  remaining_indices = model.get_remaining_indices()
+  (_, _, _, probabilities) = create_classification_layer(
+      model.get_pooled_output(), False, tf.gather(labels, remaining_indices),
+      num_labels)
+  exits.append((remaining_indices, probabilities,
+                bert_config.num_hidden_layers))
+
+  all_probabilities = tf.zeros([batch_size, num_labels])
+  num_layers = tf.zeros([batch_size], dtype=tf.int32)
+  for (indices, exit_probabilities, exit_num_layers) in exits:
+    indices = tf.expand_dims(indices, axis=1)
+    all_probabilities += tf.scatter_nd(indices, exit_probabilities,
+                                       [batch_size, num_labels])
+    num_layers += tf.scatter_nd(
+        indices, tf.fill(tf.shape(indices)[:1], exit_num_layers),
+        [batch_size])
+  return (all_probabilities, num_layers)
+
+
 def model_fn_builder(bert_config, num_labels, init_checkpoint, learning_rate,
                      num_train_steps, num_warmup_steps, use_tpu,
-                     use_one_hot_embeddings):
+                     use_one_hot_embeddings, gradient_accumulation_steps=1,
+                     train_early_exits=False, early_exit_post_hoc=False,
+                     early_exit_entropy=0.0):
   """Returns `model_fn` closure for TPUEstimator."""
 
   def model_fn(features, labels, mode, params):  # pylint: disable=unused-argument
@@ -640,9 +1106,17 @@ def model_fn_builder(bert_config, num_labels, init_checkpoint, learning_rate,
 
     is_training = (mode == tf.estimator.ModeKeys.TRAIN)
 
-    (total_loss, per_example_loss, logits, probabilities) = create_model(
-        bert_config, is_training, input_ids, input_mask, segment_ids, label_ids,
-        num_labels, use_one_hot_embeddings)
+    num_layers = None
+    if mode == tf.estimator.ModeKeys.PREDICT and early_exit_entropy > 0:
+      (probabilities, num_layers) = create_early_exit_model(
+          bert_config, input_ids, input_mask, segment_ids, label_ids,
+          num_labels, use_one_hot_embeddings, early_exit_entropy)
+    else:
+      (total_loss, per_example_loss, logits, probabilities) = create_model(
+          bert_config, is_training, input_ids, input_mask, segment_ids,
+          label_ids, num_labels, use_one_hot_embeddings,
+          train_early_exits=train_early_exits,
+          early_exit_post_hoc=early_exit_post_hoc)
 
     tvars = tf.trainable_variables()
     initialized_variable_names = {}
@@ -653,12 +1127,12 @@ def model_fn_builder(bert_config, num_labels, init_checkpoint, learning_rate,
       if use_tpu:
 
         def tpu_scaffold():
-          tf.train.init_from_checkpoint(init_checkpoint, assignment_map)
+          modeling.init_from_checkpoint(init_checkpoint, assignment_map)
           return tf.train.Scaffold()
 
         scaffold_fn = tpu_scaffold
       else:
-        tf.train.init_from_checkpoint(init_checkpoint, assignment_map)
+        modeling.init_from_checkpoint(init_checkpoint, assignment_map)
 
     tf.logging.info("**** Trainable Variables ****")
     for var in tvars:
@@ -672,7 +1146,9 @@ def model_fn_builder(bert_config, num_labels, init_checkpoint, learning_rate,
     if mode == tf.estimator.ModeKeys.TRAIN:
 
       train_op = optimization.create_optimizer(
-          total_loss, learning_rate, num_train_steps, num_warmup_steps, use_tpu)
+          total_loss, learning_rate, num_train_steps, num_warmup_steps, use_tpu,
+          gradient_accumulation_steps,
+          use_dynamic_loss_scaling=(bert_config.compute_dtype == "float16"))
 
       output_spec = tf.contrib.tpu.TPUEstimatorSpec(
           mode=mode,
@@ -699,15 +1175,38 @@ def model_fn_builder(bert_config, num_labels, init_checkpoint, learning_rate,
           eval_metrics=eval_metrics,
           scaffold_fn=scaffold_fn)
     else:
+      predictions = {"probabilities": probabilities}
+      if num_layers is not None:
+        predictions["num_layers"] = num_layers
       output_spec = tf.contrib.tpu.TPUEstimatorSpec(
-          mode=mode,
-          predictions={"probabilities": probabilities},
-          scaffold_fn=scaffold_fn)
+          mode=mode, predictions=predictions, scaffold_fn=scaffold_fn)
     return output_spec
 
   return model_fn
 
 
+def predict_with_timing(estimator, input_fn, batch_size):
+  """Runs `estimator.predict` and measures its throughput.
+
+  The first batch also builds the graph and restores the checkpoint, so it is
+  left out of the measurement.
+
+  Returns:
+    A tuple of the list of predictions and of the number of examples per
+    second after the first batch, or None if there is only one batch.
+  """
+  predictions = []
+  start_time = None
+  for prediction in estimator.predict(input_fn=input_fn):
+    predictions.append(prediction)
+    if len(predictions) == batch_size:
+      start_time = time.time()
+  if start_time is None or len(predictions) == batch_size:
+    return (predictions, None)
+  return (predictions,
+          (len(predictions) - batch_size) / (time.time() - start_time))
+
+
 # This function is not used by this file but is still used by the Colab and
 # people who depend on it.
 def input_fn_builder(features, seq_length, is_training, drop_remainder):
@@ -768,36 +1267,126 @@ def convert_examples_to_features(examples, label_list, max_seq_length,
                                  tokenizer):
   """Convert a set of `InputExample`s to a list of `InputFeatures`."""
 
+  label_map = create_label_map(label_list)
   features = []
   for (ex_index, example) in enumerate(examples):
     if ex_index % 10000 == 0:
       tf.logging.info("Writing example %d of %d" % (ex_index, len(examples)))
 
     feature = convert_single_example(ex_index, example, label_list,
-                                     max_seq_length, tokenizer)
+                                     max_seq_length, tokenizer,
+                                     label_map=label_map)
 
     features.append(feature)
   return features
 
 
+class StreamedExamples(object):
+  """The examples of a set, read lazily every time they are iterated.
+
+  Unlike the iterator of `DataProcessor.iter_examples`, it can be sent to the
+  worker processes of `parallel_convert_examples_to_features`.
+  """
+
+  def __init__(self, processor, data_dir, set_type, padding_examples=None):
+    self.processor = processor
+    self.data_dir = data_dir
+    self.set_type = set_type
+    self.padding_examples = padding_examples or []
+
+  def __iter__(self):
+    return itertools.chain(
+        self.processor.iter_examples(self.data_dir, self.set_type),
+        self.padding_examples)
+
+
+def read_examples(processor, data_dir, set_type, streaming,
+                  pad_to_batch_size=None):
+  """Reads the examples of a set, padded to a multiple of a batch size.
+
+  Args:
+    processor: `DataProcessor` of the data set.
+    data_dir: The data directory.
+    set_type: "train", "dev" or "test".
+    streaming: bool. Whether to return `StreamedExamples` reading the
+      examples lazily instead of a list.
+    pad_to_batch_size: (optional) int. If set, `PaddingInputExample`s are
+      appended until the number of examples is a multiple of it.
+
+  Returns:
+    A tuple of the examples, of their number and of the number of actual
+    examples, i.e. without the padding ones.
+  """
+  if streaming:
+    # 流式读取，样本数由文件行数得到
+    num_actual_examples = processor.count_examples(data_dir, set_type)
+    examples = processor.iter_examples(data_dir, set_type)
+  else:
+    examples = getattr(processor, "get_%s_examples" % set_type)(data_dir)
+    num_actual_examples = len(examples)
+
+  num_examples = num_actual_examples
+  if pad_to_batch_size:
+    num_examples += -num_actual_examples % pad_to_batch_size
+  padding_examples = [PaddingInputExample()] * (
+      num_examples - num_actual_examples)
+  if streaming:
+    examples = StreamedExamples(processor, data_dir, set_type,
+                                padding_examples)
+  else:
+    examples = examples + padding_examples
+  return (examples, num_examples, num_actual_examples)
+
+
+def check_num_examples(num_written, num_examples):
+  """Checks that as many examples were written as were counted."""
+  if num_written != num_examples:
+    raise ValueError(
+        "%d examples were counted but %d were written. Every line of the "
+        "data files but the header must be one example, or else do not use "
+        "`streaming_examples`." %
+        (num_examples, num_written))
+
+
+PROCESSORS = {
+    "cola": ColaProcessor,
+    "mnli": MnliProcessor,
+    "mrpc": MrpcProcessor,
+    "xnli": XnliProcessor,
+}
+
+
 def main(_):
   tf.logging.set_verbosity(tf.logging.INFO)
 
-  processors = {
-      "cola": ColaProcessor,
-      "mnli": MnliProcessor,
-      "mrpc": MrpcProcessor,
-      "xnli": XnliProcessor,
-  }
-
   tokenization.validate_case_matches_checkpoint(FLAGS.do_lower_case,
                                                 FLAGS.init_checkpoint)
 
-  if not FLAGS.do_train and not FLAGS.do_eval and not FLAGS.do_predict:
+  if (not FLAGS.do_train and not FLAGS.do_eval and not FLAGS.do_predict and
+      not FLAGS.do_export):
     raise ValueError(
-        "At least one of `do_train`, `do_eval` or `do_predict' must be True.")
+        "At least one of `do_train`, `do_eval`, `do_predict' or `do_export' "
+        "must be True.")
 
   bert_config = modeling.BertConfig.from_json_file(FLAGS.bert_config_file)
+  bert_config.recompute_grad_layers = FLAGS.recompute_grad_layers
+  bert_config.compute_dtype = FLAGS.compute_dtype
+  bert_config.unpadded_encoder = FLAGS.unpadded_encoder
+
+  if FLAGS.dynamic_seq_length and FLAGS.use_tpu:
+    raise ValueError("`dynamic_seq_length` is not supported on TPU.")
+
+  if FLAGS.early_exit_entropy > 0 and FLAGS.use_tpu:
+    raise ValueError("`early_exit_entropy` is not supported on TPU.")
+
+  if FLAGS.num_export_benchmark_requests == 1:
+    raise ValueError(
+        "`num_export_benchmark_requests` must be 0 or at least 2, the first "
+        "request being part of the cold start.")
+
+  length_bucket_boundaries = None
+  if FLAGS.length_bucket_boundaries:
+    length_bucket_boundaries = [int(x) for x in FLAGS.length_bucket_boundaries]
 
   if FLAGS.max_seq_length > bert_config.max_position_embeddings:
     raise ValueError(
@@ -809,10 +1398,10 @@ def main(_):
 
   task_name = FLAGS.task_name.lower()
 
-  if task_name not in processors:
+  if task_name not in PROCESSORS:
     raise ValueError("Task not found: %s" % (task_name))
 
-  processor = processors[task_name]()
+  processor = PROCESSORS[task_name]()
 
   label_list = processor.get_labels()
 
@@ -838,10 +1427,16 @@ def main(_):
   train_examples = None
   num_train_steps = None
   num_warmup_steps = None
+  num_train_examples = None
   if FLAGS.do_train:
-    train_examples = processor.get_train_examples(FLAGS.data_dir)
+    (train_examples, num_train_examples, _) = read_examples(
+        processor, FLAGS.data_dir, "train", FLAGS.streaming_examples)
+    # A training step is one weight update, i.e. one effective batch of
+    # `train_batch_size * gradient_accumulation_steps` examples.
     num_train_steps = int(
-        len(train_examples) / FLAGS.train_batch_size * FLAGS.num_train_epochs)
+        num_train_examples /
+        (FLAGS.train_batch_size * FLAGS.gradient_accumulation_steps) *
+        FLAGS.num_train_epochs)
     num_warmup_steps = int(num_train_steps * FLAGS.warmup_proportion)
 
   model_fn = model_fn_builder(
@@ -852,7 +1447,11 @@ def main(_):
       num_train_steps=num_train_steps,
       num_warmup_steps=num_warmup_steps,
       use_tpu=FLAGS.use_tpu,
-      use_one_hot_embeddings=FLAGS.use_tpu)
+      use_one_hot_embeddings=None,
+      gradient_accumulation_steps=FLAGS.gradient_accumulation_steps,
+      train_early_exits=FLAGS.train_early_exits,
+      early_exit_post_hoc=FLAGS.early_exit_post_hoc,
+      early_exit_entropy=FLAGS.early_exit_entropy)
 
   # If TPU is not available, this will fall back to normal Estimator on CPU
   # or GPU.
@@ -864,41 +1463,64 @@ def main(_):
       eval_batch_size=FLAGS.eval_batch_size,
       predict_batch_size=FLAGS.predict_batch_size)
 
+  def write_tf_records(examples, num_examples, output_file):
+    """Converts examples to `output_file`, or to shards of it in parallel."""
+    if FLAGS.num_conversion_workers > 1:
+      return parallel_convert_examples_to_features(
+          examples, label_list, FLAGS.max_seq_length, FLAGS.vocab_file,
+          FLAGS.do_lower_case, output_file, FLAGS.num_conversion_workers,
+          FLAGS.compression_type, not FLAGS.dynamic_seq_length,
+          num_examples=num_examples)
+    num_written = file_based_convert_examples_to_features(
+        examples, label_list, FLAGS.max_seq_length, tokenizer, output_file,
+        FLAGS.compression_type, not FLAGS.dynamic_seq_length,
+        num_examples=num_examples)
+    return ([output_file], num_written)
+
   if FLAGS.do_train:
-    train_file = os.path.join(FLAGS.output_dir, "train.tf_record")
-    file_based_convert_examples_to_features(
-        train_examples, label_list, FLAGS.max_seq_length, tokenizer, train_file)
+    (train_files, num_written) = write_tf_records(
+        train_examples, num_train_examples,
+        os.path.join(FLAGS.output_dir, "train.tf_record"))
+    if num_written != num_train_examples:
+      tf.logging.warning(
+          "%d training examples were counted but %d were written, so the "
+          "number of training steps is off.", num_train_examples, num_written)
     tf.logging.info("***** Running training *****")
-    tf.logging.info("  Num examples = %d", len(train_examples))
+    tf.logging.info("  Num examples = %d", num_train_examples)
     tf.logging.info("  Batch size = %d", FLAGS.train_batch_size)
+    tf.logging.info("  Gradient accumulation steps = %d",
+                    FLAGS.gradient_accumulation_steps)
     tf.logging.info("  Num steps = %d", num_train_steps)
     train_input_fn = file_based_input_fn_builder(
-        input_file=train_file,
+        input_file=train_files,
         seq_length=FLAGS.max_seq_length,
         is_training=True,
-        drop_remainder=True)
+        drop_remainder=True,
+        compression_type=FLAGS.compression_type,
+        dynamic_seq_length=FLAGS.dynamic_seq_length,
+        length_bucket_boundaries=length_bucket_boundaries)
     estimator.train(input_fn=train_input_fn, max_steps=num_train_steps)
 
   if FLAGS.do_eval:
-    eval_examples = processor.get_dev_examples(FLAGS.data_dir)
-    num_actual_eval_examples = len(eval_examples)
-    if FLAGS.use_tpu:
-      # TPU requires a fixed batch size for all batches, therefore the number
-      # of examples must be a multiple of the batch size, or else examples
-      # will get dropped. So we pad with fake examples which are ignored
-      # later on. These do NOT count towards the metric (all tf.metrics
-      # support a per-instance weight, and these get a weight of 0.0).
-      while len(eval_examples) % FLAGS.eval_batch_size != 0:
-        eval_examples.append(PaddingInputExample())
-
-    eval_file = os.path.join(FLAGS.output_dir, "eval.tf_record")
-    file_based_convert_examples_to_features(
-        eval_examples, label_list, FLAGS.max_seq_length, tokenizer, eval_file)
+    # TPU requires a fixed batch size for all batches, therefore the number
+    # of examples must be a multiple of the batch size, or else examples
+    # will get dropped. So we pad with fake examples which are ignored
+    # later on. These do NOT count towards the metric (all tf.metrics
+    # support a per-instance weight, and these get a weight of 0.0).
+    (eval_examples, num_eval_examples,
+     num_actual_eval_examples) = read_examples(
+         processor, FLAGS.data_dir, "dev", FLAGS.streaming_examples,
+         pad_to_batch_size=FLAGS.eval_batch_size if FLAGS.use_tpu else None)
+
+    (eval_files, num_written) = write_tf_records(
+        eval_examples, num_eval_examples,
+        os.path.join(FLAGS.output_dir, "eval.tf_record"))
+    check_num_examples(num_written, num_eval_examples)
 
     tf.logging.info("***** Running evaluation *****")
     tf.logging.info("  Num examples = %d (%d actual, %d padding)",
-                    len(eval_examples), num_actual_eval_examples,
-                    len(eval_examples) - num_actual_eval_examples)
+                    num_eval_examples, num_actual_eval_examples,
+                    num_eval_examples - num_actual_eval_examples)
     tf.logging.info("  Batch size = %d", FLAGS.eval_batch_size)
 
     # This tells the estimator to run through the entire set.
@@ -906,15 +1528,17 @@ def main(_):
     # However, if running eval on the TPU, you will need to specify the
     # number of steps.
     if FLAGS.use_tpu:
-      assert len(eval_examples) % FLAGS.eval_batch_size == 0
-      eval_steps = int(len(eval_examples) // FLAGS.eval_batch_size)
+      assert num_eval_examples % FLAGS.eval_batch_size == 0
+      eval_steps = int(num_eval_examples // FLAGS.eval_batch_size)
 
     eval_drop_remainder = True if FLAGS.use_tpu else False
     eval_input_fn = file_based_input_fn_builder(
-        input_file=eval_file,
+        input_file=eval_files,
         seq_length=FLAGS.max_seq_length,
         is_training=False,
-        drop_remainder=eval_drop_remainder)
+        drop_remainder=eval_drop_remainder,
+        compression_type=FLAGS.compression_type,
+        dynamic_seq_length=FLAGS.dynamic_seq_length)
 
     result = estimator.evaluate(input_fn=eval_input_fn, steps=eval_steps)
 
@@ -926,35 +1550,37 @@ def main(_):
         writer.write("%s = %s\n" % (key, str(result[key])))
 
   if FLAGS.do_predict:
-    predict_examples = processor.get_test_examples(FLAGS.data_dir)
-    num_actual_predict_examples = len(predict_examples)
-    if FLAGS.use_tpu:
-      # TPU requires a fixed batch size for all batches, therefore the number
-      # of examples must be a multiple of the batch size, or else examples
-      # will get dropped. So we pad with fake examples which are ignored
-      # later on.
-      while len(predict_examples) % FLAGS.predict_batch_size != 0:
-        predict_examples.append(PaddingInputExample())
-
-    predict_file = os.path.join(FLAGS.output_dir, "predict.tf_record")
-    file_based_convert_examples_to_features(predict_examples, label_list,
-                                            FLAGS.max_seq_length, tokenizer,
-                                            predict_file)
+    # TPU requires a fixed batch size for all batches, therefore the number
+    # of examples must be a multiple of the batch size, or else examples
+    # will get dropped. So we pad with fake examples which are ignored
+    # later on.
+    (predict_examples, num_predict_examples,
+     num_actual_predict_examples) = read_examples(
+         processor, FLAGS.data_dir, "test", FLAGS.streaming_examples,
+         pad_to_batch_size=FLAGS.predict_batch_size if FLAGS.use_tpu else None)
+
+    (predict_files, num_written) = write_tf_records(
+        predict_examples, num_predict_examples,
+        os.path.join(FLAGS.output_dir, "predict.tf_record"))
+    check_num_examples(num_written, num_predict_examples)
 
     tf.logging.info("***** Running prediction*****")
     tf.logging.info("  Num examples = %d (%d actual, %d padding)",
-                    len(predict_examples), num_actual_predict_examples,
-                    len(predict_examples) - num_actual_predict_examples)
+                    num_predict_examples, num_actual_predict_examples,
+                    num_predict_examples - num_actual_predict_examples)
     tf.logging.info("  Batch size = %d", FLAGS.predict_batch_size)
 
     predict_drop_remainder = True if FLAGS.use_tpu else False
     predict_input_fn = file_based_input_fn_builder(
-        input_file=predict_file,
+        input_file=predict_files,
         seq_length=FLAGS.max_seq_length,
         is_training=False,
-        drop_remainder=predict_drop_remainder)
+        drop_remainder=predict_drop_remainder,
+        compression_type=FLAGS.compression_type,
+        dynamic_seq_length=FLAGS.dynamic_seq_length)
 
-    result = estimator.predict(input_fn=predict_input_fn)
+    (result, examples_per_sec) = predict_with_timing(
+        estimator, predict_input_fn, FLAGS.predict_batch_size)
 
     output_predict_file = os.path.join(FLAGS.output_dir, "test_results.tsv")
     with tf.gfile.GFile(output_predict_file, "w") as writer:
@@ -971,6 +1597,102 @@ def main(_):
         num_written_lines += 1
     assert num_written_lines == num_actual_predict_examples
 
+    if FLAGS.early_exit_entropy > 0:
+      # Runs the full model on the same examples for the throughput gain.
+      full_estimator = tf.contrib.tpu.TPUEstimator(
+          use_tpu=FLAGS.use_tpu,
+          model_fn=model_fn_builder(
+              bert_config=bert_config,
+              num_labels=len(label_list),
+              init_checkpoint=FLAGS.init_checkpoint,
+              learning_rate=FLAGS.learning_rate,
+              num_train_steps=num_train_steps,
+              num_warmup_steps=num_warmup_steps,
+              use_tpu=FLAGS.use_tpu,
+              use_one_hot_embeddings=None),
+          config=run_config,
+          train_batch_size=FLAGS.train_batch_size,
+          eval_batch_size=FLAGS.eval_batch_size,
+          predict_batch_size=FLAGS.predict_batch_size)
+      (_, full_examples_per_sec) = predict_with_timing(
+          full_estimator, predict_input_fn, FLAGS.predict_batch_size)
+
+      num_layers = [
+          x["num_layers"] for x in result[:num_actual_predict_examples]
+      ]
+      early_exit_result = {
+          "average_num_layers": sum(num_layers) / float(len(num_layers)),
+          "early_exit_examples_per_sec": examples_per_sec,
+          "full_examples_per_sec": full_examples_per_sec,
+      }
+      if examples_per_sec and full_examples_per_sec:
+        early_exit_result["throughput_gain"] = (
+            examples_per_sec / full_examples_per_sec)
+
+      output_early_exit_file = os.path.join(FLAGS.output_dir,
+                                            "early_exit_results.txt")
+      with tf.gfile.GFile(output_early_exit_file, "w") as writer:
+        tf.logging.info("***** Early exit results *****")
+        for key in sorted(early_exit_result.keys()):
+          tf.logging.info("  %s = %s", key, str(early_exit_result[key]))
+          writer.write("%s = %s\n" % (key, str(early_exit_result[key])))
+
+  if FLAGS.do_export:
+    export_dir = FLAGS.export_dir or os.path.join(FLAGS.output_dir, "export")
+
+    # 导出的图里没有dropout，变量都被固化成常量
+    def create_outputs(input_ids, input_mask, segment_ids):
+      (_, _, logits, probabilities) = create_model(
+          bert_config, False, input_ids, input_mask, segment_ids,
+          tf.zeros_like(input_ids[:, 0]), len(label_list),
+          use_one_hot_embeddings=None)
+      return {"logits": logits, "probabilities": probabilities}
+
+    frozen_graph_file = inference_graph.export_inference_graph(
+        create_outputs,
+        tf.train.latest_checkpoint(FLAGS.output_dir) or FLAGS.init_checkpoint,
+        FLAGS.max_seq_length, export_dir)
+
+    if FLAGS.num_export_benchmark_requests > 0:
+      benchmark_examples = processor.get_dev_examples(
+          FLAGS.data_dir)[:FLAGS.num_export_benchmark_requests]
+      benchmark_features = convert_examples_to_features(
+          benchmark_examples, label_list, FLAGS.max_seq_length, tokenizer)
+
+      def load_frozen_graph():
+        predict_fn = inference_graph.create_frozen_graph_predict_fn(
+            frozen_graph_file, ["probabilities"])
+        return lambda feature: predict_fn([feature.input_ids],
+                                          [feature.input_mask],
+                                          [feature.segment_ids])
+
+      # Every `estimator.predict` call builds the graph and restores the
+      # checkpoint again.
+      def load_estimator():
+        return lambda feature: list(estimator.predict(
+            input_fn=input_fn_builder(
+                features=[feature],
+                seq_length=FLAGS.max_seq_length,
+                is_training=False,
+                drop_remainder=False)))
+
+      export_result = {}
+      (export_result["frozen_graph_cold_start_secs"],
+       export_result["frozen_graph_secs_per_request"]) = (
+           inference_graph.measure_latency(load_frozen_graph,
+                                           benchmark_features))
+      (export_result["estimator_cold_start_secs"],
+       export_result["estimator_secs_per_request"]) = (
+           inference_graph.measure_latency(load_estimator,
+                                           benchmark_features))
+
+      output_export_file = os.path.join(FLAGS.output_dir, "export_results.txt")
+      with tf.gfile.GFile(output_export_file, "w") as writer:
+        tf.logging.info("***** Export results *****")
+        for key in sorted(export_result.keys()):
+          tf.logging.info("  %s = %s", key, str(export_result[key]))
+          writer.write("%s = %s\n" % (key, str(export_result[key])))
+
 
 if __name__ == "__main__":
   flags.mark_flag_as_required("data_dir")
@@ -0,0 +1,88 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import run_classifier
+import tensorflow as tf
+import tokenization
+
+
+class RunClassifierTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(RunClassifierTest, self).setUp()
+    vocab_tokens = [
+        "[UNK]", "[CLS]", "[SEP]", "want", "##want", "##ed", "wa", "un", "runn",
+        "##ing", ","
+    ]
+    self.vocab_file = os.path.join(self.get_temp_dir(), "vocab.txt")
+    with tf.gfile.GFile(self.vocab_file, "w") as writer:
+      writer.write("".join([x + "\n" for x in vocab_tokens]))
+
+    # An MRPC train set: a header, then label, ids and the two sentences.
+    self.data_dir = self.get_temp_dir()
+    texts = ["unwanted running", "want", "wa , runn", "running unwanted"]
+    train_file = os.path.join(self.data_dir, "train.tsv")
+    with tf.gfile.GFile(train_file, "w") as writer:
+      writer.write("Quality\t#1 ID\t#2 ID\t#1 String\t#2 String\n")
+      for i in range(7):
+        writer.write("%d\t%d\t%d\t%s\t%s\n" % (i % 2, i, i + 100,
+                                               texts[i % len(texts)],
+                                               texts[(i + 1) % len(texts)]))
+    self.processor = run_classifier.MrpcProcessor()
+    self.label_list = self.processor.get_labels()
+
+  def read_records(self, input_files):
+    records = []
+    for input_file in input_files:
+      records.extend(tf.python_io.tf_record_iterator(input_file))
+    return records
+
+  def test_parallel_convert_examples_to_features(self):
+    examples = self.processor.get_train_examples(self.data_dir)
+    examples.append(run_classifier.PaddingInputExample())
+    serial_file = os.path.join(self.get_temp_dir(), "serial.tf_record")
+    num_written = run_classifier.file_based_convert_examples_to_features(
+        examples, self.label_list, 16,
+        tokenization.FullTokenizer(self.vocab_file), serial_file)
+    self.assertEqual(num_written, 8)
+    expected = self.read_records([serial_file])
+
+    streamed_examples = run_classifier.StreamedExamples(
+        self.processor, self.data_dir, "train",
+        [run_classifier.PaddingInputExample()])
+    for (name, parallel_examples) in [("list", examples),
+                                      ("streamed", streamed_examples)]:
+      (shard_files, num_written) = (
+          run_classifier.parallel_convert_examples_to_features(
+              parallel_examples,
+              self.label_list,
+              16,
+              self.vocab_file,
+              True,
+              os.path.join(self.get_temp_dir(), name + ".tf_record"),
+              num_workers=2,
+              num_examples=8))
+      self.assertEqual(len(shard_files), 2)
+      self.assertEqual(num_written, 8)
+      self.assertEqual(self.read_records(shard_files), expected)
+
+
+if __name__ == "__main__":
+  tf.test.main()
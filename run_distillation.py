@@ -0,0 +1,536 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Distills a fine-tuned BERT classifier into a smaller student model.
+
+The teacher is a classifier fine-tuned with `run_classifier.py`. Its logits
+(and the [CLS] vectors of the layers in `intermediate_layer_map`) are computed
+once over the training set and cached in `teacher_logits_file`. The student,
+described by `bert_config_file`, is then trained on the cache against the
+softened teacher distribution and the true labels, without running the
+teacher again. The student checkpoints in `output_dir` have the variables of
+`run_classifier.create_model`, so `run_classifier.py` can evaluate and serve
+them with `--bert_config_file` set to the student config, e.g.:
+
+  python run_distillation.py --task_name=MRPC --data_dir=$GLUE_DIR/MRPC \
+    --vocab_file=$BERT_BASE_DIR/vocab.txt \
+    --teacher_bert_config_file=$BERT_BASE_DIR/bert_config.json \
+    --teacher_checkpoint=/tmp/mrpc_output/model.ckpt-343 \
+    --bert_config_file=$STUDENT_DIR/bert_config.json \
+    --init_checkpoint=$STUDENT_DIR/bert_model.ckpt \
+    --intermediate_layer_map=1:3,3:7,5:11 \
+    --do_train=true --do_eval=true --output_dir=/tmp/mrpc_student
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import os
+import modeling
+import optimization
+import run_classifier
+import tokenization
+import tensorflow as tf
+
+flags = tf.flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string(
+    "teacher_bert_config_file", None,
+    "The config json file of the fine-tuned teacher model.")
+
+flags.DEFINE_string(
+    "teacher_checkpoint", None,
+    "The checkpoint of the fine-tuned teacher, e.g. the output of "
+    "run_classifier.py.")
+
+flags.DEFINE_string(
+    "teacher_logits_file", None,
+    "Where the teacher outputs on the training set are cached. They are "
+    "computed if the file does not exist. Defaults to "
+    "`output_dir`/teacher_logits.tf_record.")
+
+flags.DEFINE_float(
+    "distillation_temperature", 2.0,
+    "Temperature of the softmax over the teacher and student logits.")
+
+flags.DEFINE_float(
+    "distillation_loss_weight", 0.5,
+    "Weight of the loss against the teacher logits. The loss against the true "
+    "labels gets 1 - `distillation_loss_weight`.")
+
+flags.DEFINE_list(
+    "intermediate_layer_map", None,
+    "Comma-separated `student_layer:teacher_layer` pairs of 0-based encoder "
+    "layers whose normalized [CLS] vectors are matched, e.g. 1:3,3:7,5:11.")
+
+flags.DEFINE_float(
+    "intermediate_loss_weight", 100.0,
+    "Weight of the mean squared distance between the normalized [CLS] vectors "
+    "of the layers in `intermediate_layer_map`.")
+
+
+def parse_layer_map(layer_map):
+  """Parses `student:teacher` strings into a list of (int, int) pairs."""
+  result = []
+  for entry in layer_map or []:
+    (student_layer, teacher_layer) = entry.split(":")
+    result.append((int(student_layer), int(teacher_layer)))
+  return result
+
+
+def get_cls_vector(layer_output):
+  """Returns the [CLS] vector of a [batch_size, seq_length, hidden] layer."""
+  return tf.squeeze(layer_output[:, 0:1, :], axis=1)
+
+
+def teacher_model_fn_builder(bert_config, num_labels, init_checkpoint,
+                             teacher_layers, use_tpu, use_one_hot_embeddings):
+  """Returns a predict-only `model_fn` that outputs the teacher's targets."""
+
+  def model_fn(features, labels, mode, params):  # pylint: disable=unused-argument
+    """The `model_fn` for TPUEstimator."""
+    if mode != tf.estimator.ModeKeys.PREDICT:
+      raise ValueError("Only PREDICT mode is supported: %s" % (mode))
+
+    model = modeling.BertModel(
+        config=bert_config,
+        is_training=False,
+        input_ids=features["input_ids"],
+        input_mask=features["input_mask"],
+        token_type_ids=features["segment_ids"],
+        use_one_hot_embeddings=use_one_hot_embeddings)
+    (_, _, logits, _) = run_classifier.create_classification_layer(
+        model.get_pooled_output(), False, features["label_ids"], num_labels)
+
+    tvars = tf.trainable_variables()
+    (assignment_map, _) = modeling.get_assignment_map_from_checkpoint(
+        tvars, init_checkpoint)
+    scaffold_fn = None
+    if use_tpu:
+
+      def tpu_scaffold():
+        modeling.init_from_checkpoint(init_checkpoint, assignment_map)
+        return tf.train.Scaffold()
+
+      scaffold_fn = tpu_scaffold
+    else:
+      modeling.init_from_checkpoint(init_checkpoint, assignment_map)
+
+    # The inputs are passed through, so that they are written to the cache
+    # next to the teacher outputs.
+    predictions = dict(features)
+    predictions["teacher_logits"] = logits
+    all_encoder_layers = model.get_all_encoder_layers()
+    for layer_idx in teacher_layers:
+      predictions["teacher_layer_%d" % layer_idx] = get_cls_vector(
+          all_encoder_layers[layer_idx])
+
+    return tf.contrib.tpu.TPUEstimatorSpec(
+        mode=mode, predictions=predictions, scaffold_fn=scaffold_fn)
+
+  return model_fn
+
+
+def write_teacher_outputs(predictions, teacher_layers, output_file):
+  """Writes the inputs and the teacher outputs of the real examples."""
+  writer = tf.python_io.TFRecordWriter(output_file)
+
+  def create_int_feature(values):
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=list(values)))
+
+  def create_float_feature(values):
+    return tf.train.Feature(float_list=tf.train.FloatList(value=list(values)))
+
+  num_written = 0
+  for prediction in predictions:
+    if not prediction["is_real_example"]:
+      continue
+    features = collections.OrderedDict()
+    features["input_ids"] = create_int_feature(prediction["input_ids"])
+    features["input_mask"] = create_int_feature(prediction["input_mask"])
+    features["segment_ids"] = create_int_feature(prediction["segment_ids"])
+    features["label_ids"] = create_int_feature([prediction["label_ids"]])
+    features["teacher_logits"] = create_float_feature(
+        prediction["teacher_logits"])
+    for layer_idx in teacher_layers:
+      name = "teacher_layer_%d" % layer_idx
+      features[name] = create_float_feature(prediction[name])
+
+    tf_example = tf.train.Example(features=tf.train.Features(feature=features))
+    writer.write(tf_example.SerializeToString())
+    num_written += 1
+  writer.close()
+  return num_written
+
+
+def distillation_input_fn_builder(input_file, seq_length, num_labels,
+                                  teacher_layers, teacher_hidden_size,
+                                  is_training, drop_remainder):
+  """Creates an `input_fn` over the cached teacher outputs."""
+
+  name_to_features = {
+      "input_ids": tf.FixedLenFeature([seq_length], tf.int64),
+      "input_mask": tf.FixedLenFeature([seq_length], tf.int64),
+      "segment_ids": tf.FixedLenFeature([seq_length], tf.int64),
+      "label_ids": tf.FixedLenFeature([], tf.int64),
+      "teacher_logits": tf.FixedLenFeature([num_labels], tf.float32),
+  }
+  for layer_idx in teacher_layers:
+    name_to_features["teacher_layer_%d" % layer_idx] = tf.FixedLenFeature(
+        [teacher_hidden_size], tf.float32)
+
+  def _decode_record(record, name_to_features):
+    """Decodes a record to a TensorFlow example."""
+    example = tf.parse_single_example(record, name_to_features)
+
+    # tf.Example only supports tf.int64, but the TPU only supports tf.int32.
+    # So cast all int64 to int32.
+    for name in list(example.keys()):
+      t = example[name]
+      if t.dtype == tf.int64:
+        t = tf.to_int32(t)
+      example[name] = t
+
+    return example
+
+  def input_fn(params):
+    """The actual input function."""
+    batch_size = params["batch_size"]
+
+    d = tf.data.TFRecordDataset(input_file)
+    if is_training:
+      d = d.repeat()
+      d = d.shuffle(buffer_size=100)
+
+    d = d.apply(
+        tf.contrib.data.map_and_batch(
+            lambda record: _decode_record(record, name_to_features),
+            batch_size=batch_size,
+            drop_remainder=drop_remainder))
+
+    return d
+
+  return input_fn
+
+
+def model_fn_builder(bert_config, num_labels, init_checkpoint, learning_rate,
+                     num_train_steps, num_warmup_steps, use_tpu,
+                     use_one_hot_embeddings, layer_map, temperature,
+                     distillation_loss_weight, intermediate_loss_weight,
+                     gradient_accumulation_steps=1):
+  """Returns the training `model_fn` of the student for TPUEstimator."""
+
+  def model_fn(features, labels, mode, params):  # pylint: disable=unused-argument
+    """The `model_fn` for TPUEstimator."""
+    if mode != tf.estimator.ModeKeys.TRAIN:
+      raise ValueError("Only TRAIN mode is supported: %s" % (mode))
+
+    tf.logging.info("*** Features ***")
+    for name in sorted(features.keys()):
+      tf.logging.info("  name = %s, shape = %s" % (name, features[name].shape))
+
+    # Same variables as `run_classifier.create_model`, so the checkpoints can
+    # be loaded by `run_classifier.model_fn_builder`.
+    model = modeling.BertModel(
+        config=bert_config,
+        is_training=True,
+        input_ids=features["input_ids"],
+        input_mask=features["input_mask"],
+        token_type_ids=features["segment_ids"],
+        use_one_hot_embeddings=use_one_hot_embeddings)
+    (hard_loss, _, logits, _) = run_classifier.create_classification_layer(
+        model.get_pooled_output(), True, features["label_ids"], num_labels)
+
+    with tf.variable_scope("distillation"):
+      # Soft targets (Hinton et al.): cross entropy against the teacher's
+      # distribution at `temperature`, scaled by temperature^2 so that its
+      # gradients keep the same magnitude as the hard loss.
+      # 软标签的loss乘以T^2，保证梯度和硬标签的loss在一个量级
+      teacher_probs = tf.nn.softmax(features["teacher_logits"] / temperature)
+      student_log_probs = tf.nn.log_softmax(logits / temperature)
+      soft_loss = -tf.reduce_mean(
+          tf.reduce_sum(teacher_probs * student_log_probs, axis=-1))
+      soft_loss *= temperature * temperature
+
+      total_loss = ((1.0 - distillation_loss_weight) * hard_loss +
+                    distillation_loss_weight * soft_loss)
+
+      all_encoder_layers = model.get_all_encoder_layers()
+      for (student_layer, teacher_layer) in layer_map:
+        student_vector = get_cls_vector(all_encoder_layers[student_layer])
+        teacher_vector = features["teacher_layer_%d" % teacher_layer]
+        teacher_hidden_size = teacher_vector.shape[-1].value
+        if bert_config.hidden_size != teacher_hidden_size:
+          # 学生和老师的hidden size不同时，先把学生的向量投影过去
+          student_vector = tf.layers.dense(
+              student_vector,
+              teacher_hidden_size,
+              name="layer_%d_projection" % student_layer,
+              kernel_initializer=modeling.create_initializer(
+                  bert_config.initializer_range))
+        distance = (tf.nn.l2_normalize(student_vector, axis=-1) -
+                    tf.nn.l2_normalize(teacher_vector, axis=-1))
+        total_loss += intermediate_loss_weight * tf.reduce_mean(
+            tf.reduce_sum(tf.square(distance), axis=-1))
+
+    tvars = tf.trainable_variables()
+    initialized_variable_names = {}
+    scaffold_fn = None
+    if init_checkpoint:
+      (assignment_map, initialized_variable_names
+      ) = modeling.get_assignment_map_from_checkpoint(tvars, init_checkpoint)
+      if use_tpu:
+
+        def tpu_scaffold():
+          modeling.init_from_checkpoint(init_checkpoint, assignment_map)
+          return tf.train.Scaffold()
+
+        scaffold_fn = tpu_scaffold
+      else:
+        modeling.init_from_checkpoint(init_checkpoint, assignment_map)
+
+    tf.logging.info("**** Trainable Variables ****")
+    for var in tvars:
+      init_string = ""
+      if var.name in initialized_variable_names:
+        init_string = ", *INIT_FROM_CKPT*"
+      tf.logging.info("  name = %s, shape = %s%s", var.name, var.shape,
+                      init_string)
+
+    train_op = optimization.create_optimizer(
+        total_loss, learning_rate, num_train_steps, num_warmup_steps, use_tpu,
+        gradient_accumulation_steps,
+        use_dynamic_loss_scaling=(bert_config.compute_dtype == "float16"))
+
+    return tf.contrib.tpu.TPUEstimatorSpec(
+        mode=mode,
+        loss=total_loss,
+        train_op=train_op,
+        scaffold_fn=scaffold_fn)
+
+  return model_fn
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  if not FLAGS.do_train and not FLAGS.do_eval:
+    raise ValueError("At least one of `do_train` or `do_eval` must be True.")
+
+  bert_config = modeling.BertConfig.from_json_file(FLAGS.bert_config_file)
+  teacher_config = modeling.BertConfig.from_json_file(
+      FLAGS.teacher_bert_config_file)
+  layer_map = parse_layer_map(FLAGS.intermediate_layer_map)
+  for (student_layer, teacher_layer) in layer_map:
+    if (student_layer >= bert_config.num_hidden_layers or
+        teacher_layer >= teacher_config.num_hidden_layers):
+      raise ValueError("Invalid `intermediate_layer_map` entry %d:%d" %
+                       (student_layer, teacher_layer))
+  teacher_layers = sorted(set(x[1] for x in layer_map))
+
+  for config in [bert_config, teacher_config]:
+    if FLAGS.max_seq_length > config.max_position_embeddings:
+      raise ValueError(
+          "Cannot use sequence length %d because the BERT model "
+          "was only trained up to sequence length %d" %
+          (FLAGS.max_seq_length, config.max_position_embeddings))
+
+  tf.gfile.MakeDirs(FLAGS.output_dir)
+
+  task_name = FLAGS.task_name.lower()
+  if task_name not in run_classifier.PROCESSORS:
+    raise ValueError("Task not found: %s" % (task_name))
+
+  processor = run_classifier.PROCESSORS[task_name]()
+  label_list = processor.get_labels()
+
+  tokenizer = tokenization.FullTokenizer(
+      vocab_file=FLAGS.vocab_file, do_lower_case=FLAGS.do_lower_case)
+
+  tpu_cluster_resolver = None
+  if FLAGS.use_tpu and FLAGS.tpu_name:
+    tpu_cluster_resolver = tf.contrib.cluster_resolver.TPUClusterResolver(
+        FLAGS.tpu_name, zone=FLAGS.tpu_zone, project=FLAGS.gcp_project)
+
+  is_per_host = tf.contrib.tpu.InputPipelineConfig.PER_HOST_V2
+
+  def create_estimator(model_fn, model_dir):
+    run_config = tf.contrib.tpu.RunConfig(
+        cluster=tpu_cluster_resolver,
+        master=FLAGS.master,
+        model_dir=model_dir,
+        save_checkpoints_steps=FLAGS.save_checkpoints_steps,
+        tpu_config=tf.contrib.tpu.TPUConfig(
+            iterations_per_loop=FLAGS.iterations_per_loop,
+            num_shards=FLAGS.num_tpu_cores,
+            per_host_input_for_training=is_per_host))
+    # If TPU is not available, this will fall back to normal Estimator on CPU
+    # or GPU.
+    return tf.contrib.tpu.TPUEstimator(
+        use_tpu=FLAGS.use_tpu,
+        model_fn=model_fn,
+        config=run_config,
+        train_batch_size=FLAGS.train_batch_size,
+        eval_batch_size=FLAGS.eval_batch_size,
+        predict_batch_size=FLAGS.predict_batch_size)
+
+  if FLAGS.do_train:
+    train_examples = processor.get_train_examples(FLAGS.data_dir)
+    teacher_logits_file = FLAGS.teacher_logits_file or os.path.join(
+        FLAGS.output_dir, "teacher_logits.tf_record")
+
+    if tf.gfile.Exists(teacher_logits_file):
+      tf.logging.info("Using the cached teacher outputs in %s",
+                      teacher_logits_file)
+    else:
+      if FLAGS.use_tpu:
+        # TPU requires a fixed batch size for all batches. The padding
+        # examples are not written to the cache.
+        while len(train_examples) % FLAGS.predict_batch_size != 0:
+          train_examples.append(run_classifier.PaddingInputExample())
+
+      train_file = os.path.join(FLAGS.output_dir, "train.tf_record")
+      run_classifier.file_based_convert_examples_to_features(
+          train_examples, label_list, FLAGS.max_seq_length, tokenizer,
+          train_file)
+
+      tf.logging.info("***** Running the teacher *****")
+      tf.logging.info("  Num examples = %d", len(train_examples))
+      tf.logging.info("  Batch size = %d", FLAGS.predict_batch_size)
+      teacher_estimator = create_estimator(
+          teacher_model_fn_builder(
+              bert_config=teacher_config,
+              num_labels=len(label_list),
+              init_checkpoint=FLAGS.teacher_checkpoint,
+              teacher_layers=teacher_layers,
+              use_tpu=FLAGS.use_tpu,
+              use_one_hot_embeddings=None),
+          os.path.join(FLAGS.output_dir, "teacher"))
+      teacher_input_fn = run_classifier.file_based_input_fn_builder(
+          input_file=train_file,
+          seq_length=FLAGS.max_seq_length,
+          is_training=False,
+          drop_remainder=FLAGS.use_tpu)
+      num_written = write_teacher_outputs(
+          teacher_estimator.predict(input_fn=teacher_input_fn),
+          teacher_layers, teacher_logits_file)
+      tf.logging.info("Wrote the teacher outputs of %d examples to %s",
+                      num_written, teacher_logits_file)
+      train_examples = [
+          x for x in train_examples
+          if not isinstance(x, run_classifier.PaddingInputExample)
+      ]
+
+    # A training step is one weight update, i.e. one effective batch of
+    # `train_batch_size * gradient_accumulation_steps` examples.
+    num_train_steps = int(
+        len(train_examples) /
+        (FLAGS.train_batch_size * FLAGS.gradient_accumulation_steps) *
+        FLAGS.num_train_epochs)
+    num_warmup_steps = int(num_train_steps * FLAGS.warmup_proportion)
+
+    estimator = create_estimator(
+        model_fn_builder(
+            bert_config=bert_config,
+            num_labels=len(label_list),
+            init_checkpoint=FLAGS.init_checkpoint,
+            learning_rate=FLAGS.learning_rate,
+            num_train_steps=num_train_steps,
+            num_warmup_steps=num_warmup_steps,
+            use_tpu=FLAGS.use_tpu,
+            use_one_hot_embeddings=None,
+            layer_map=layer_map,
+            temperature=FLAGS.distillation_temperature,
+            distillation_loss_weight=FLAGS.distillation_loss_weight,
+            intermediate_loss_weight=FLAGS.intermediate_loss_weight,
+            gradient_accumulation_steps=FLAGS.gradient_accumulation_steps),
+        FLAGS.output_dir)
+
+    tf.logging.info("***** Running distillation *****")
+    tf.logging.info("  Num examples = %d", len(train_examples))
+    tf.logging.info("  Batch size = %d", FLAGS.train_batch_size)
+    tf.logging.info("  Num steps = %d", num_train_steps)
+    train_input_fn = distillation_input_fn_builder(
+        input_file=teacher_logits_file,
+        seq_length=FLAGS.max_seq_length,
+        num_labels=len(label_list),
+        teacher_layers=teacher_layers,
+        teacher_hidden_size=teacher_config.hidden_size,
+        is_training=True,
+        drop_remainder=True)
+    estimator.train(input_fn=train_input_fn, max_steps=num_train_steps)
+
+  if FLAGS.do_eval:
+    # The student is evaluated with the unchanged `run_classifier` model_fn,
+    # restored from the latest checkpoint in `output_dir`.
+    estimator = create_estimator(
+        run_classifier.model_fn_builder(
+            bert_config=bert_config,
+            num_labels=len(label_list),
+            init_checkpoint=None,
+            learning_rate=FLAGS.learning_rate,
+            num_train_steps=None,
+            num_warmup_steps=None,
+            use_tpu=FLAGS.use_tpu,
+            use_one_hot_embeddings=None), FLAGS.output_dir)
+
+    eval_examples = processor.get_dev_examples(FLAGS.data_dir)
+    num_actual_eval_examples = len(eval_examples)
+    if FLAGS.use_tpu:
+      while len(eval_examples) % FLAGS.eval_batch_size != 0:
+        eval_examples.append(run_classifier.PaddingInputExample())
+
+    eval_file = os.path.join(FLAGS.output_dir, "eval.tf_record")
+    run_classifier.file_based_convert_examples_to_features(
+        eval_examples, label_list, FLAGS.max_seq_length, tokenizer, eval_file)
+
+    tf.logging.info("***** Running evaluation *****")
+    tf.logging.info("  Num examples = %d (%d actual, %d padding)",
+                    len(eval_examples), num_actual_eval_examples,
+                    len(eval_examples) - num_actual_eval_examples)
+    tf.logging.info("  Batch size = %d", FLAGS.eval_batch_size)
+
+    eval_steps = None
+    if FLAGS.use_tpu:
+      eval_steps = int(len(eval_examples) // FLAGS.eval_batch_size)
+
+    eval_input_fn = run_classifier.file_based_input_fn_builder(
+        input_file=eval_file,
+        seq_length=FLAGS.max_seq_length,
+        is_training=False,
+        drop_remainder=FLAGS.use_tpu)
+
+    result = estimator.evaluate(input_fn=eval_input_fn, steps=eval_steps)
+
+    output_eval_file = os.path.join(FLAGS.output_dir, "eval_results.txt")
+    with tf.gfile.GFile(output_eval_file, "w") as writer:
+      tf.logging.info("***** Eval results *****")
+      for key in sorted(result.keys()):
+        tf.logging.info("  %s = %s", key, str(result[key]))
+        writer.write("%s = %s\n" % (key, str(result[key])))
+
+
+if __name__ == "__main__":
+  flags.mark_flag_as_required("data_dir")
+  flags.mark_flag_as_required("task_name")
+  flags.mark_flag_as_required("vocab_file")
+  flags.mark_flag_as_required("bert_config_file")
+  flags.mark_flag_as_required("teacher_bert_config_file")
+  flags.mark_flag_as_required("teacher_checkpoint")
+  flags.mark_flag_as_required("output_dir")
+  tf.app.run()
@@ -19,6 +19,7 @@ from __future__ import division
 from __future__ import print_function
 
 import os
+import time
 import modeling
 import optimization
 import tensorflow as tf
@@ -57,17 +58,51 @@ flags.DEFINE_integer(
     "Maximum number of masked LM predictions per sequence. "
     "Must match data generation.")
 
+flags.DEFINE_enum(
+    "compression_type", "", ["", "GZIP", "ZLIB"],
+    "Compression of the input TFRecord files. Must match data generation.")
+
 flags.DEFINE_bool("do_train", False, "Whether to run training.")
 
 flags.DEFINE_bool("do_eval", False, "Whether to run eval on the dev set.")
 
+flags.DEFINE_bool(
+    "do_input_benchmark", False,
+    "Whether to measure the records/sec of the training input pipeline alone, "
+    "decoupled from the model.")
+
+flags.DEFINE_integer("input_benchmark_steps", 1000,
+                     "Number of batches to time when `do_input_benchmark`.")
+
 flags.DEFINE_integer("train_batch_size", 32, "Total batch size for training.")
 
+flags.DEFINE_integer(
+    "gradient_accumulation_steps", 1,
+    "Number of micro-batches of `train_batch_size` whose gradients are "
+    "accumulated before each weight update. The effective batch size is "
+    "`train_batch_size * gradient_accumulation_steps`.")
+
+flags.DEFINE_integer(
+    "recompute_grad_layers", 0,
+    "If > 0, recompute the activations of every group of this many encoder "
+    "layers in the backward pass instead of keeping them in memory.")
+
+flags.DEFINE_enum(
+    "compute_dtype", "float32", ["float32", "float16", "bfloat16"],
+    "The dtype the encoder computes in. Weights are kept in float32. float16 "
+    "training uses dynamic loss scaling.")
+
+flags.DEFINE_bool(
+    "unpadded_encoder", False,
+    "Whether the encoder's dense layers and layer normalization skip the "
+    "padding tokens. Not supported on TPU.")
+
 flags.DEFINE_integer("eval_batch_size", 8, "Total batch size for eval.")
 
 flags.DEFINE_float("learning_rate", 5e-5, "The initial learning rate for Adam.")
 
-flags.DEFINE_integer("num_train_steps", 100000, "Number of training steps.")
+flags.DEFINE_integer("num_train_steps", 100000,
+                     "Number of training steps (weight updates).")
 
 flags.DEFINE_integer("num_warmup_steps", 10000, "Number of warmup steps.")
 
@@ -108,7 +143,7 @@ flags.DEFINE_integer(
 
 def model_fn_builder(bert_config, init_checkpoint, learning_rate,
                      num_train_steps, num_warmup_steps, use_tpu,
-                     use_one_hot_embeddings):
+                     use_one_hot_embeddings, gradient_accumulation_steps=1):
   """Returns `model_fn` closure for TPUEstimator."""
 
   def model_fn(features, labels, mode, params):  # pylint: disable=unused-argument
@@ -162,12 +197,12 @@ def model_fn_builder(bert_config, init_checkpoint, learning_rate,
       if use_tpu:
 
         def tpu_scaffold():
-          tf.train.init_from_checkpoint(init_checkpoint, assignment_map)
+          modeling.init_from_checkpoint(init_checkpoint, assignment_map)
           return tf.train.Scaffold()
 
         scaffold_fn = tpu_scaffold
       else:
-        tf.train.init_from_checkpoint(init_checkpoint, assignment_map)
+        modeling.init_from_checkpoint(init_checkpoint, assignment_map)
 
     tf.logging.info("**** Trainable Variables ****")
     for var in tvars:
@@ -181,7 +216,9 @@ def model_fn_builder(bert_config, init_checkpoint, learning_rate,
     # 训练过程，获得spec
     if mode == tf.estimator.ModeKeys.TRAIN:
       train_op = optimization.create_optimizer(
-          total_loss, learning_rate, num_train_steps, num_warmup_steps, use_tpu)
+          total_loss, learning_rate, num_train_steps, num_warmup_steps, use_tpu,
+          gradient_accumulation_steps,
+          use_dynamic_loss_scaling=(bert_config.compute_dtype == "float16"))
 
       output_spec = tf.contrib.tpu.TPUEstimatorSpec(
           mode=mode,
@@ -254,10 +291,13 @@ def get_masked_lm_output(bert_config, input_tensor, output_weights, positions,
     # We apply one more non-linear transformation before the output layer.
     # This matrix is not used after pre-training.
     # 在输出之前添加一个非线性变换，只在预训练阶段起作用
+    # With a factorized embedding the transform projects the hidden states
+    # down to `embedding_size`, the width of the tied output weights.
+    # 因式分解embedding时，变换到和词向量相同的维度
     with tf.variable_scope("transform"):
       input_tensor = tf.layers.dense(
           input_tensor,
-          units=bert_config.hidden_size,
+          units=bert_config.embedding_size or bert_config.hidden_size,
           activation=modeling.get_activation(bert_config.hidden_act),
           kernel_initializer=modeling.create_initializer(
               bert_config.initializer_range))
@@ -340,9 +380,13 @@ def input_fn_builder(input_files,
                      max_seq_length,
                      max_predictions_per_seq,
                      is_training,
-                     num_cpu_threads=4):
+                     num_cpu_threads=4,
+                     compression_type=None):
   """Creates an `input_fn` closure to be passed to TPUEstimator."""
 
+  def _read_tfrecord(filename):
+    return tf.data.TFRecordDataset(filename, compression_type=compression_type)
+
   def input_fn(params):
     """The actual input function."""
     batch_size = params["batch_size"]
@@ -378,12 +422,12 @@ def input_fn_builder(input_files,
       # even more randomness to the training pipeline.
       d = d.apply(
           tf.contrib.data.parallel_interleave(
-              tf.data.TFRecordDataset,
+              _read_tfrecord,
               sloppy=is_training,
               cycle_length=cycle_length))
       d = d.shuffle(buffer_size=100)
     else:
-      d = tf.data.TFRecordDataset(input_files)
+      d = _read_tfrecord(input_files)
       # Since we evaluate for a fixed number of steps we don't want to encounter
       # out-of-range exceptions.
       d = d.repeat()
@@ -392,23 +436,26 @@ def input_fn_builder(input_files,
     # size dimensions. For eval, we assume we are evaluating on the CPU or GPU
     # and we *don't* want to drop the remainder, otherwise we wont cover
     # every sample.
-    d = d.apply(
-        tf.contrib.data.map_and_batch(
-            lambda record: _decode_record(record, name_to_features),
-            batch_size=batch_size,
-            num_parallel_batches=num_cpu_threads,
-            drop_remainder=True))
+    #
+    # The serialized records are batched first so that a whole batch is
+    # parsed by one vectorized `tf.parse_example` call instead of one
+    # `tf.parse_single_example` call per record.
+    d = d.batch(batch_size=batch_size, drop_remainder=True)
+    d = d.map(
+        lambda records: _decode_record(records, name_to_features),
+        num_parallel_calls=num_cpu_threads)
+    d = d.prefetch(tf.contrib.data.AUTOTUNE)
     return d
 
   return input_fn
 
 
-def _decode_record(record, name_to_features):
-  """Decodes a record to a TensorFlow example."""
-  example = tf.parse_single_example(record, name_to_features)
+def _decode_record(records, name_to_features):
+  """Decodes a batch of records to a dict of batched TensorFlow features."""
+  example = tf.parse_example(records, name_to_features)
 
   # tf.Example only supports tf.int64, but the TPU only supports tf.int32.
-  # So cast all int64 to int32.
+  # So cast all int64 to int32, once per batch rather than once per record.
   for name in list(example.keys()):
     t = example[name]
     if t.dtype == tf.int64:
@@ -418,13 +465,48 @@ def _decode_record(record, name_to_features):
   return example
 
 
+def benchmark_input_fn(input_fn, batch_size, num_steps, num_warmup_steps=10):
+  """Measures the records/sec of `input_fn` alone, without building a model.
+
+  Args:
+    input_fn: An `input_fn` as returned by `input_fn_builder`.
+    batch_size: int. The batch size passed to `input_fn` through `params`.
+    num_steps: int. Number of batches to time.
+    num_warmup_steps: int. Number of batches to fetch before timing starts, so
+      that file opening and buffer filling are not counted.
+
+  Returns:
+    float. Records per second over the `num_steps` timed batches.
+  """
+  with tf.Graph().as_default():
+    d = input_fn({"batch_size": batch_size})
+    features = d.make_one_shot_iterator().get_next()
+    # Reducing to a scalar keeps the host->client copy out of the measurement.
+    fetch = tf.group(*[tf.reduce_sum(t) for t in features.values()])
+
+    with tf.Session() as sess:
+      for _ in range(num_warmup_steps):
+        sess.run(fetch)
+      start_time = time.time()
+      for _ in range(num_steps):
+        sess.run(fetch)
+      elapsed = time.time() - start_time
+
+  return num_steps * batch_size / elapsed
+
+
 def main(_):
   tf.logging.set_verbosity(tf.logging.INFO)
 
-  if not FLAGS.do_train and not FLAGS.do_eval:
-    raise ValueError("At least one of `do_train` or `do_eval` must be True.")
+  if not FLAGS.do_train and not FLAGS.do_eval and not FLAGS.do_input_benchmark:
+    raise ValueError(
+        "At least one of `do_train`, `do_eval` or `do_input_benchmark` must "
+        "be True.")
 
   bert_config = modeling.BertConfig.from_json_file(FLAGS.bert_config_file)
+  bert_config.recompute_grad_layers = FLAGS.recompute_grad_layers
+  bert_config.compute_dtype = FLAGS.compute_dtype
+  bert_config.unpadded_encoder = FLAGS.unpadded_encoder
 
   tf.gfile.MakeDirs(FLAGS.output_dir)
 
@@ -436,6 +518,26 @@ def main(_):
   for input_file in input_files:
     tf.logging.info("  %s" % input_file)
 
+  if FLAGS.do_input_benchmark:
+    tf.logging.info("***** Running input benchmark *****")
+    tf.logging.info("  Batch size = %d", FLAGS.train_batch_size)
+    input_benchmark_fn = input_fn_builder(
+        input_files=input_files,
+        max_seq_length=FLAGS.max_seq_length,
+        max_predictions_per_seq=FLAGS.max_predictions_per_seq,
+        is_training=True,
+        compression_type=FLAGS.compression_type)
+    records_per_sec = benchmark_input_fn(
+        input_benchmark_fn, FLAGS.train_batch_size,
+        FLAGS.input_benchmark_steps)
+
+    output_benchmark_file = os.path.join(FLAGS.output_dir,
+                                         "input_benchmark_results.txt")
+    with tf.gfile.GFile(output_benchmark_file, "w") as writer:
+      tf.logging.info("***** Input benchmark results *****")
+      tf.logging.info("  records_per_sec = %.1f", records_per_sec)
+      writer.write("records_per_sec = %.1f\n" % records_per_sec)
+
   tpu_cluster_resolver = None
   if FLAGS.use_tpu and FLAGS.tpu_name:
     tpu_cluster_resolver = tf.contrib.cluster_resolver.TPUClusterResolver(
@@ -460,7 +562,8 @@ def main(_):
       num_train_steps=FLAGS.num_train_steps,
       num_warmup_steps=FLAGS.num_warmup_steps,
       use_tpu=FLAGS.use_tpu,
-      use_one_hot_embeddings=FLAGS.use_tpu)
+      use_one_hot_embeddings=None,
+      gradient_accumulation_steps=FLAGS.gradient_accumulation_steps)
 
   # If TPU is not available, this will fall back to normal Estimator on CPU
   # or GPU.
@@ -475,11 +578,14 @@ def main(_):
   if FLAGS.do_train:
     tf.logging.info("***** Running training *****")
     tf.logging.info("  Batch size = %d", FLAGS.train_batch_size)
+    tf.logging.info("  Gradient accumulation steps = %d",
+                    FLAGS.gradient_accumulation_steps)
     train_input_fn = input_fn_builder(
         input_files=input_files,
         max_seq_length=FLAGS.max_seq_length,
         max_predictions_per_seq=FLAGS.max_predictions_per_seq,
-        is_training=True)
+        is_training=True,
+        compression_type=FLAGS.compression_type)
     estimator.train(input_fn=train_input_fn, max_steps=FLAGS.num_train_steps)
 
   if FLAGS.do_eval:
@@ -490,7 +596,8 @@ def main(_):
         input_files=input_files,
         max_seq_length=FLAGS.max_seq_length,
         max_predictions_per_seq=FLAGS.max_predictions_per_seq,
-        is_training=False)
+        is_training=False,
+        compression_type=FLAGS.compression_type)
 
     result = estimator.evaluate(
         input_fn=eval_input_fn, steps=FLAGS.max_eval_steps)
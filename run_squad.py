@@ -23,6 +23,8 @@ import json
 import math
 import os
 import random
+import inference_graph
+import input_pipeline
 import modeling
 import optimization
 import tokenization
@@ -79,10 +81,36 @@ flags.DEFINE_integer(
     "The maximum number of tokens for the question. Questions longer than "
     "this will be truncated to this length.")
 
+flags.DEFINE_bool(
+    "dynamic_seq_length", False,
+    "Whether to store the features unpadded and pad each batch only to its "
+    "longest feature instead of to `max_seq_length`. Not supported on TPU.")
+
+flags.DEFINE_list(
+    "length_bucket_boundaries", None,
+    "Only used if `dynamic_seq_length` is True. Comma separated sequence "
+    "lengths at which the training features are split into buckets, so that "
+    "each training batch holds features of a similar length, e.g. "
+    "\"128,256\".")
+
+flags.DEFINE_enum(
+    "compression_type", "", ["", "GZIP", "ZLIB"],
+    "Compression of the intermediate TFRecord files written to `output_dir`.")
+
 flags.DEFINE_bool("do_train", False, "Whether to run training.")
 
 flags.DEFINE_bool("do_predict", False, "Whether to run eval on the dev set.")
 
+flags.DEFINE_bool(
+    "do_export", False,
+    "Whether to export the model as a frozen, optimized inference graph and "
+    "SavedModel to `export_dir`.")
+
+flags.DEFINE_string(
+    "export_dir", None,
+    "Only used if `do_export` is True. Where to export the inference graph. "
+    "Defaults to `output_dir`/export.")
+
 flags.DEFINE_integer("train_batch_size", 32, "Total batch size for training.")
 
 flags.DEFINE_integer("predict_batch_size", 8,
@@ -224,33 +252,44 @@ class InputFeatures(object):
     self.is_impossible = is_impossible
 
 
-def read_squad_examples(input_file, is_training):
-  """Read a SQuAD json file into a list of SquadExample."""
-  with tf.gfile.Open(input_file, "r") as reader:
-    input_data = json.load(reader)["data"]
+def split_paragraph(paragraph_text):
+  """Splits a paragraph on whitespace.
+
+  Returns:
+    A tuple of the list of the words of the paragraph and of the list of the
+    index of the word of every character.
+  """
 
   def is_whitespace(c):
     if c == " " or c == "\t" or c == "\r" or c == "\n" or ord(c) == 0x202F:
       return True
     return False
 
+  doc_tokens = []
+  char_to_word_offset = []
+  prev_is_whitespace = True
+  for c in paragraph_text:
+    if is_whitespace(c):
+      prev_is_whitespace = True
+    else:
+      if prev_is_whitespace:
+        doc_tokens.append(c)
+      else:
+        doc_tokens[-1] += c
+      prev_is_whitespace = False
+    char_to_word_offset.append(len(doc_tokens) - 1)
+  return (doc_tokens, char_to_word_offset)
+
+
+def read_squad_examples(input_file, is_training):
+  """Read a SQuAD json file into a list of SquadExample."""
+  with tf.gfile.Open(input_file, "r") as reader:
+    input_data = json.load(reader)["data"]
+
   examples = []
   for entry in input_data:
     for paragraph in entry["paragraphs"]:
-      paragraph_text = paragraph["context"]
-      doc_tokens = []
-      char_to_word_offset = []
-      prev_is_whitespace = True
-      for c in paragraph_text:
-        if is_whitespace(c):
-          prev_is_whitespace = True
-        else:
-          if prev_is_whitespace:
-            doc_tokens.append(c)
-          else:
-            doc_tokens[-1] += c
-          prev_is_whitespace = False
-        char_to_word_offset.append(len(doc_tokens) - 1)
+      (doc_tokens, char_to_word_offset) = split_paragraph(paragraph["context"])
 
       for qa in paragraph["qas"]:
         qas_id = qa["id"]
@@ -308,8 +347,13 @@ def read_squad_examples(input_file, is_training):
 
 def convert_examples_to_features(examples, tokenizer, max_seq_length,
                                  doc_stride, max_query_length, is_training,
-                                 output_fn):
-  """Loads a data file into a list of `InputBatch`s."""
+                                 output_fn, pad_to_max_seq_length=True,
+                                 log_examples=True):
+  """Loads a data file into a list of `InputBatch`s.
+
+  If `pad_to_max_seq_length` is False, the features are left unpadded. If
+  `log_examples` is False, the first examples are not logged.
+  """
 
   unique_id = 1000000000
 
@@ -395,14 +439,15 @@ def convert_examples_to_features(examples, tokenizer, max_seq_length,
       input_mask = [1] * len(input_ids)
 
       # Zero-pad up to the sequence length.
-      while len(input_ids) < max_seq_length:
-        input_ids.append(0)
-        input_mask.append(0)
-        segment_ids.append(0)
+      if pad_to_max_seq_length:
+        while len(input_ids) < max_seq_length:
+          input_ids.append(0)
+          input_mask.append(0)
+          segment_ids.append(0)
 
-      assert len(input_ids) == max_seq_length
-      assert len(input_mask) == max_seq_length
-      assert len(segment_ids) == max_seq_length
+        assert len(input_ids) == max_seq_length
+        assert len(input_mask) == max_seq_length
+        assert len(segment_ids) == max_seq_length
 
       start_position = None
       end_position = None
@@ -427,7 +472,7 @@ def convert_examples_to_features(examples, tokenizer, max_seq_length,
         start_position = 0
         end_position = 0
 
-      if example_index < 20:
+      if log_examples and example_index < 20:
         tf.logging.info("*** Example ***")
         tf.logging.info("unique_id: %s" % (unique_id))
         tf.logging.info("example_index: %s" % (example_index))
@@ -635,12 +680,12 @@ def model_fn_builder(bert_config, init_checkpoint, learning_rate,
       if use_tpu:
 
         def tpu_scaffold():
-          tf.train.init_from_checkpoint(init_checkpoint, assignment_map)
+          modeling.init_from_checkpoint(init_checkpoint, assignment_map)
           return tf.train.Scaffold()
 
         scaffold_fn = tpu_scaffold
       else:
-        tf.train.init_from_checkpoint(init_checkpoint, assignment_map)
+        modeling.init_from_checkpoint(init_checkpoint, assignment_map)
 
     tf.logging.info("**** Trainable Variables ****")
     for var in tvars:
@@ -695,14 +740,26 @@ def model_fn_builder(bert_config, init_checkpoint, learning_rate,
   return model_fn
 
 
-def input_fn_builder(input_file, seq_length, is_training, drop_remainder):
-  """Creates an `input_fn` closure to be passed to TPUEstimator."""
+def input_fn_builder(input_file, seq_length, is_training, drop_remainder,
+                     compression_type=None, dynamic_seq_length=False,
+                     length_bucket_boundaries=None):
+  """Creates an `input_fn` closure to be passed to TPUEstimator.
+
+  If `dynamic_seq_length` is True, `input_file` must hold unpadded features
+  and every batch is padded only to its longest feature. The training batches
+  are then also grouped by `length_bucket_boundaries`, if given.
+  """
+
+  if dynamic_seq_length:
+    seq_feature = tf.VarLenFeature(tf.int64)
+  else:
+    seq_feature = tf.FixedLenFeature([seq_length], tf.int64)
 
   name_to_features = {
       "unique_ids": tf.FixedLenFeature([], tf.int64),
-      "input_ids": tf.FixedLenFeature([seq_length], tf.int64),
-      "input_mask": tf.FixedLenFeature([seq_length], tf.int64),
-      "segment_ids": tf.FixedLenFeature([seq_length], tf.int64),
+      "input_ids": seq_feature,
+      "input_mask": seq_feature,
+      "segment_ids": seq_feature,
   }
 
   if is_training:
@@ -717,6 +774,8 @@ def input_fn_builder(input_file, seq_length, is_training, drop_remainder):
     # So cast all int64 to int32.
     for name in list(example.keys()):
       t = example[name]
+      if isinstance(t, tf.SparseTensor):
+        t = tf.sparse_tensor_to_dense(t)
       if t.dtype == tf.int64:
         t = tf.to_int32(t)
       example[name] = t
@@ -729,11 +788,21 @@ def input_fn_builder(input_file, seq_length, is_training, drop_remainder):
 
     # For training, we want a lot of parallel reading and shuffling.
     # For eval, we want no shuffling and parallel reading doesn't matter.
-    d = tf.data.TFRecordDataset(input_file)
+    d = tf.data.TFRecordDataset(input_file, compression_type=compression_type)
     if is_training:
       d = d.repeat()
       d = d.shuffle(buffer_size=100)
 
+    if dynamic_seq_length:
+      d = d.map(lambda record: _decode_record(record, name_to_features))
+      d = input_pipeline.padded_batch_by_length(
+          d,
+          batch_size=batch_size,
+          drop_remainder=drop_remainder,
+          length_bucket_boundaries=(
+              length_bucket_boundaries if is_training else None))
+      return d
+
     d = d.apply(
         tf.contrib.data.map_and_batch(
             lambda record: _decode_record(record, name_to_features),
@@ -756,6 +825,30 @@ def write_predictions(all_examples, all_features, all_results, n_best_size,
   tf.logging.info("Writing predictions to: %s" % (output_prediction_file))
   tf.logging.info("Writing nbest to: %s" % (output_nbest_file))
 
+  (all_predictions, all_nbest_json, scores_diff_json) = compute_predictions(
+      all_examples, all_features, all_results, n_best_size, max_answer_length,
+      do_lower_case)
+
+  with tf.gfile.GFile(output_prediction_file, "w") as writer:    # 写入最终的预测答案
+    writer.write(json.dumps(all_predictions, indent=4) + "\n")
+
+  with tf.gfile.GFile(output_nbest_file, "w") as writer:    # 写入最终的nbest个预测结果
+    writer.write(json.dumps(all_nbest_json, indent=4) + "\n")
+
+  if FLAGS.version_2_with_negative:    # 如果是SQuAD2.0，则写入预测的空答案的概率
+    with tf.gfile.GFile(output_null_log_odds_file, "w") as writer:
+      writer.write(json.dumps(scores_diff_json, indent=4) + "\n")
+
+
+def compute_predictions(all_examples, all_features, all_results, n_best_size,
+                        max_answer_length, do_lower_case):
+  """Computes the final predictions and the log-odds of null.
+
+  Returns:
+    A tuple of the `OrderedDict`s from the `qas_id`s of the examples to their
+    predicted answers, to their n-best predictions and, for SQuAD 2.0, to
+    their null score differences.
+  """
   example_index_to_features = collections.defaultdict(list)
   for feature in all_features:
     example_index_to_features[feature.example_index].append(feature)
@@ -924,15 +1017,7 @@ def write_predictions(all_examples, all_features, all_results, n_best_size,
 
     all_nbest_json[example.qas_id] = nbest_json
 
-  with tf.gfile.GFile(output_prediction_file, "w") as writer:    # 写入最终的预测答案
-    writer.write(json.dumps(all_predictions, indent=4) + "\n")
-
-  with tf.gfile.GFile(output_nbest_file, "w") as writer:    # 写入最终的nbest个预测结果
-    writer.write(json.dumps(all_nbest_json, indent=4) + "\n")
-
-  if FLAGS.version_2_with_negative:    # 如果是SQuAD2.0，则写入预测的空答案的概率
-    with tf.gfile.GFile(output_null_log_odds_file, "w") as writer:
-      writer.write(json.dumps(scores_diff_json, indent=4) + "\n")
+  return (all_predictions, all_nbest_json, scores_diff_json)
 
 
 def get_final_text(pred_text, orig_text, do_lower_case):
@@ -1069,11 +1154,16 @@ def _compute_softmax(scores):
 class FeatureWriter(object):
   """Writes InputFeature to TF example file."""
 
-  def __init__(self, filename, is_training):
+  def __init__(self, filename, is_training, compression_type=None):
     self.filename = filename
     self.is_training = is_training
+    self.compression_type = compression_type
     self.num_features = 0
-    self._writer = tf.python_io.TFRecordWriter(filename)
+    options = None
+    if compression_type:
+      options = tf.python_io.TFRecordOptions(
+          getattr(tf.python_io.TFRecordCompressionType, compression_type))
+    self._writer = tf.python_io.TFRecordWriter(filename, options=options)
 
   def process_feature(self, feature):
     """Write a InputFeature to the TFRecordWriter as a tf.train.Example."""
@@ -1110,8 +1200,9 @@ def validate_flags_or_throw(bert_config):
   tokenization.validate_case_matches_checkpoint(FLAGS.do_lower_case,
                                                 FLAGS.init_checkpoint)
 
-  if not FLAGS.do_train and not FLAGS.do_predict:
-    raise ValueError("At least one of `do_train` or `do_predict` must be True.")
+  if not FLAGS.do_train and not FLAGS.do_predict and not FLAGS.do_export:
+    raise ValueError(
+        "At least one of `do_train`, `do_predict` or `do_export` must be True.")
 
   if FLAGS.do_train:
     if not FLAGS.train_file:
@@ -1122,6 +1213,9 @@ def validate_flags_or_throw(bert_config):
       raise ValueError(
           "If `do_predict` is True, then `predict_file` must be specified.")
 
+  if FLAGS.dynamic_seq_length and FLAGS.use_tpu:
+    raise ValueError("`dynamic_seq_length` is not supported on TPU.")
+
   if FLAGS.max_seq_length > bert_config.max_position_embeddings:
     raise ValueError(
         "Cannot use sequence length %d because the BERT model "
@@ -1146,6 +1240,10 @@ def main(_):
   tokenizer = tokenization.FullTokenizer(
       vocab_file=FLAGS.vocab_file, do_lower_case=FLAGS.do_lower_case)
 
+  length_bucket_boundaries = None
+  if FLAGS.length_bucket_boundaries:
+    length_bucket_boundaries = [int(x) for x in FLAGS.length_bucket_boundaries]
+
   tpu_cluster_resolver = None
   if FLAGS.use_tpu and FLAGS.tpu_name:
     tpu_cluster_resolver = tf.contrib.cluster_resolver.TPUClusterResolver(
@@ -1184,7 +1282,7 @@ def main(_):
       num_train_steps=num_train_steps,
       num_warmup_steps=num_warmup_steps,
       use_tpu=FLAGS.use_tpu,
-      use_one_hot_embeddings=FLAGS.use_tpu)
+      use_one_hot_embeddings=None)
 
   # If TPU is not available, this will fall back to normal Estimator on CPU
   # or GPU.
@@ -1200,7 +1298,8 @@ def main(_):
     # in memory.
     train_writer = FeatureWriter(
         filename=os.path.join(FLAGS.output_dir, "train.tf_record"),
-        is_training=True)
+        is_training=True,
+        compression_type=FLAGS.compression_type)
     convert_examples_to_features(
         examples=train_examples,
         tokenizer=tokenizer,
@@ -1208,7 +1307,8 @@ def main(_):
         doc_stride=FLAGS.doc_stride,
         max_query_length=FLAGS.max_query_length,
         is_training=True,
-        output_fn=train_writer.process_feature)
+        output_fn=train_writer.process_feature,
+        pad_to_max_seq_length=not FLAGS.dynamic_seq_length)
     train_writer.close()
 
     tf.logging.info("***** Running training *****")
@@ -1222,7 +1322,10 @@ def main(_):
         input_file=train_writer.filename,
         seq_length=FLAGS.max_seq_length,
         is_training=True,
-        drop_remainder=True)
+        drop_remainder=True,
+        compression_type=train_writer.compression_type,
+        dynamic_seq_length=FLAGS.dynamic_seq_length,
+        length_bucket_boundaries=length_bucket_boundaries)
     estimator.train(input_fn=train_input_fn, max_steps=num_train_steps)
 
   if FLAGS.do_predict:
@@ -1231,7 +1334,8 @@ def main(_):
 
     eval_writer = FeatureWriter(
         filename=os.path.join(FLAGS.output_dir, "eval.tf_record"),
-        is_training=False)
+        is_training=False,
+        compression_type=FLAGS.compression_type)
     eval_features = []
 
     def append_feature(feature):
@@ -1245,7 +1349,8 @@ def main(_):
         doc_stride=FLAGS.doc_stride,
         max_query_length=FLAGS.max_query_length,
         is_training=False,
-        output_fn=append_feature)
+        output_fn=append_feature,
+        pad_to_max_seq_length=not FLAGS.dynamic_seq_length)
     eval_writer.close()
 
     tf.logging.info("***** Running predictions *****")
@@ -1259,7 +1364,9 @@ def main(_):
         input_file=eval_writer.filename,
         seq_length=FLAGS.max_seq_length,
         is_training=False,
-        drop_remainder=False)
+        drop_remainder=False,
+        compression_type=eval_writer.compression_type,
+        dynamic_seq_length=FLAGS.dynamic_seq_length)
 
     # If running eval on the TPU, you will need to specify the number of
     # steps.
@@ -1286,6 +1393,20 @@ def main(_):
                       FLAGS.do_lower_case, output_prediction_file,
                       output_nbest_file, output_null_log_odds_file)
 
+  if FLAGS.do_export:
+    export_dir = FLAGS.export_dir or os.path.join(FLAGS.output_dir, "export")
+
+    def create_outputs(input_ids, input_mask, segment_ids):
+      (start_logits, end_logits) = create_model(
+          bert_config, False, input_ids, input_mask, segment_ids,
+          use_one_hot_embeddings=None)
+      return {"start_logits": start_logits, "end_logits": end_logits}
+
+    inference_graph.export_inference_graph(
+        create_outputs,
+        tf.train.latest_checkpoint(FLAGS.output_dir) or FLAGS.init_checkpoint,
+        FLAGS.max_seq_length, export_dir)
+
 
 if __name__ == "__main__":
   flags.mark_flag_as_required("vocab_file")
@@ -0,0 +1,88 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Serves a fine-tuned `run_classifier.py` checkpoint over HTTP.
+
+The model flags are those of `run_classifier.py`, and `predict_batch_size` is
+the maximum size of the micro-batches:
+
+  python serve_classifier.py \
+    --task_name=MRPC \
+    --vocab_file=$BERT_BASE_DIR/vocab.txt \
+    --bert_config_file=$BERT_BASE_DIR/bert_config.json \
+    --init_checkpoint=$TRAINED_CLASSIFIER \
+    --max_seq_length=128 --predict_batch_size=16 --port=8000
+
+  curl -d '{"instances": [["The cat sat.", "A cat was sitting."]]}' \
+    http://localhost:8000/predict
+
+Every instance is a text, or a [text_a, text_b] pair for sentence pair tasks,
+and every prediction the list of the class probabilities.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import modeling
+import predictor
+import run_classifier
+import serving
+import tokenization
+import tensorflow as tf
+
+flags = tf.flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string("host", "localhost", "The address to listen on.")
+
+flags.DEFINE_integer("port", 8000, "The port to listen on.")
+
+flags.DEFINE_float(
+    "max_wait_ms", 5.0,
+    "How long the oldest pending example waits for others to fill its "
+    "micro-batch.")
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  task_name = FLAGS.task_name.lower()
+  if task_name not in run_classifier.PROCESSORS:
+    raise ValueError("Task not found: %s" % (task_name))
+  label_list = run_classifier.PROCESSORS[task_name]().get_labels()
+
+  bert_config = modeling.BertConfig.from_json_file(FLAGS.bert_config_file)
+  bert_config.compute_dtype = FLAGS.compute_dtype
+  tokenizer = tokenization.FullTokenizer(
+      vocab_file=FLAGS.vocab_file, do_lower_case=FLAGS.do_lower_case)
+
+  bert_predictor = predictor.BertPredictor(
+      bert_config,
+      FLAGS.init_checkpoint,
+      label_list,
+      tokenizer,
+      FLAGS.max_seq_length,
+      max_batch_size=FLAGS.predict_batch_size,
+      max_wait_secs=FLAGS.max_wait_ms / 1000.0)
+  serving.serve(bert_predictor, FLAGS.host, FLAGS.port)
+
+
+if __name__ == "__main__":
+  flags.mark_flag_as_required("task_name")
+  flags.mark_flag_as_required("vocab_file")
+  flags.mark_flag_as_required("bert_config_file")
+  flags.mark_flag_as_required("init_checkpoint")
+  tf.app.run()
@@ -0,0 +1,175 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Serves a fine-tuned `run_squad.py` checkpoint over HTTP.
+
+The model and answer flags are those of `run_squad.py`, and
+`predict_batch_size` is the maximum size of the micro-batches:
+
+  python serve_squad.py \
+    --vocab_file=$BERT_BASE_DIR/vocab.txt \
+    --bert_config_file=$BERT_BASE_DIR/bert_config.json \
+    --init_checkpoint=$SQUAD_DIR/model.ckpt \
+    --max_seq_length=384 --doc_stride=128 --port=8000
+
+  curl -d '{"instances": [["Who sat?", "The cat sat on the mat."]]}' \
+    http://localhost:8000/predict
+
+Every instance is a [question, context] pair, and every prediction holds the
+answer `text` and the `nbest` answers with their probabilities.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import modeling
+import run_squad
+import serving
+import tokenization
+import tensorflow as tf
+
+flags = tf.flags
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string("host", "localhost", "The address to listen on.")
+
+flags.DEFINE_integer("port", 8000, "The port to listen on.")
+
+flags.DEFINE_float(
+    "max_wait_ms", 5.0,
+    "How long the oldest pending example waits for others to fill its "
+    "micro-batch.")
+
+
+class SquadPredictor(serving.BatchingPredictor):
+  """Answers questions with a fine-tuned `run_squad.py` checkpoint.
+
+  The `version_2_with_negative` and `null_score_diff_threshold` flags of
+  `run_squad.py` apply.
+  """
+
+  def __init__(self,
+               bert_config,
+               init_checkpoint,
+               tokenizer,
+               max_seq_length,
+               doc_stride,
+               max_query_length,
+               n_best_size=20,
+               max_answer_length=30,
+               do_lower_case=True,
+               max_batch_size=8,
+               max_wait_secs=0.005):
+    self._tokenizer = tokenizer
+    self._max_seq_length = max_seq_length
+    self._doc_stride = doc_stride
+    self._max_query_length = max_query_length
+    self._n_best_size = n_best_size
+    self._max_answer_length = max_answer_length
+    self._do_lower_case = do_lower_case
+
+    def create_outputs(input_ids, input_mask, segment_ids):
+      return list(
+          run_squad.create_model(
+              bert_config, False, input_ids, input_mask, segment_ids,
+              use_one_hot_embeddings=None))
+
+    super(SquadPredictor, self).__init__(
+        create_outputs,
+        init_checkpoint,
+        max_batch_size=max_batch_size,
+        max_wait_secs=max_wait_secs)
+
+  def predict(self, questions):
+    """Answers questions.
+
+    Args:
+      questions: List of (question, context) pairs.
+
+    Returns:
+      List of dicts with the answer `text` and the `nbest` answers of every
+      question.
+    """
+    examples = []
+    for (i, (question, context)) in enumerate(questions):
+      (doc_tokens, _) = run_squad.split_paragraph(context)
+      examples.append(
+          run_squad.SquadExample(
+              qas_id=i, question_text=question, doc_tokens=doc_tokens))
+
+    # A long context is split into several features, see `doc_stride`.
+    features = []
+    run_squad.convert_examples_to_features(
+        examples=examples,
+        tokenizer=self._tokenizer,
+        max_seq_length=self._max_seq_length,
+        doc_stride=self._doc_stride,
+        max_query_length=self._max_query_length,
+        is_training=False,
+        output_fn=features.append,
+        pad_to_max_seq_length=False,
+        log_examples=False)
+
+    all_results = []
+    for (feature, (start_logits, end_logits)) in zip(
+        features, self.predict_features(features)):
+      all_results.append(
+          run_squad.RawResult(
+              unique_id=feature.unique_id,
+              start_logits=[float(x) for x in start_logits],
+              end_logits=[float(x) for x in end_logits]))
+
+    (all_predictions, all_nbest_json, _) = run_squad.compute_predictions(
+        examples, features, all_results, self._n_best_size,
+        self._max_answer_length, self._do_lower_case)
+
+    predictions = []
+    for example in examples:
+      prediction = collections.OrderedDict()
+      prediction["text"] = all_predictions[example.qas_id]
+      prediction["nbest"] = all_nbest_json[example.qas_id]
+      predictions.append(prediction)
+    return predictions
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+
+  bert_config = modeling.BertConfig.from_json_file(FLAGS.bert_config_file)
+  tokenizer = tokenization.FullTokenizer(
+      vocab_file=FLAGS.vocab_file, do_lower_case=FLAGS.do_lower_case)
+
+  squad_predictor = SquadPredictor(
+      bert_config,
+      FLAGS.init_checkpoint,
+      tokenizer,
+      FLAGS.max_seq_length,
+      FLAGS.doc_stride,
+      FLAGS.max_query_length,
+      n_best_size=FLAGS.n_best_size,
+      max_answer_length=FLAGS.max_answer_length,
+      do_lower_case=FLAGS.do_lower_case,
+      max_batch_size=FLAGS.predict_batch_size,
+      max_wait_secs=FLAGS.max_wait_ms / 1000.0)
+  serving.serve(squad_predictor, FLAGS.host, FLAGS.port)
+
+
+if __name__ == "__main__":
+  flags.mark_flag_as_required("vocab_file")
+  flags.mark_flag_as_required("bert_config_file")
+  flags.mark_flag_as_required("init_checkpoint")
+  tf.app.run()
@@ -0,0 +1,349 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Micro-batching predictors and a local HTTP server around them.
+
+`BatchingPredictor` keeps a session open on a task head. The examples of all
+the pending `predict_features` calls are run by a single thread, in batches
+of up to `max_batch_size` examples that are formed as soon as they are full or
+the oldest example has waited `max_wait_secs`. Every batch holds the oldest
+pending example and the pending examples closest to it in length, and is only
+padded to its longest example.
+
+`create_server` serves a predictor over HTTP:
+
+  POST /predict  {"instances": [...]}  ->  {"predictions": [...]}
+  GET /metrics   ->  the latency percentiles, the throughput and the batches.
+
+See `serve_classifier.py`, `serve_squad.py` and `load_generator.py`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import json
+import threading
+import time
+import inference_graph
+import modeling
+import six
+import tensorflow as tf
+
+
+def percentile(values, p):
+  """Returns the nearest-rank `p`th percentile of a non-empty list."""
+  values = sorted(values)
+  index = int(round(p / 100.0 * (len(values) - 1)))
+  return values[index]
+
+
+class _PredictRequest(object):
+  """The features of one example and, once run, its outputs."""
+
+  def __init__(self, feature):
+    self.feature = feature
+    self.length = len(feature.input_ids)
+    self.start_time = time.time()
+    self.result = None
+    self.error = None
+    self.done = threading.Event()
+
+
+class BatchingPredictor(object):
+  """Runs a task head on micro-batches of the examples of concurrent calls."""
+
+  def __init__(self,
+               create_outputs_fn,
+               init_checkpoint,
+               max_batch_size=8,
+               max_wait_secs=0.005):
+    """Builds the graph, restores the checkpoint and starts the batch thread.
+
+    Args:
+      create_outputs_fn: Function taking the `input_ids`, `input_mask` and
+        `segment_ids` tensors of shape [batch_size, seq_length] and returning
+        a list of tensors whose first dimension is the batch. It must build
+        the model with `is_training=False`.
+      init_checkpoint: The checkpoint the variables are restored from.
+      max_batch_size: (optional) int. The maximum number of examples run at
+        once.
+      max_wait_secs: (optional) float. How long the oldest pending example
+        waits for others to fill its batch.
+    """
+    self._max_batch_size = max_batch_size
+    self._max_wait_secs = max_wait_secs
+
+    graph = tf.Graph()
+    with graph.as_default():
+      # Every batch is only padded to its longest example.
+      # 每个batch只padding到其中最长的样本
+      self._inputs = [
+          tf.placeholder(tf.int32, [None, None], name=name)
+          for name in inference_graph.INPUT_NAMES
+      ]
+      self._outputs = create_outputs_fn(*self._inputs)
+
+      (assignment_map, _) = modeling.get_assignment_map_from_checkpoint(
+          tf.global_variables(), init_checkpoint)
+      modeling.init_from_checkpoint(init_checkpoint, assignment_map)
+      self._sess = tf.Session(graph=graph)
+      self._sess.run(tf.global_variables_initializer())
+      # The caches of the weights, see `modeling.fused_qkv_projection`.
+      self._sess.run(tf.local_variables_initializer())
+    graph.finalize()
+
+    self._stats_lock = threading.Lock()
+    self._num_batches = 0
+    self._num_examples = 0
+    self._num_tokens = 0
+    self._num_padded_tokens = 0
+
+    self._queue = six.moves.queue.Queue()
+    self._thread = threading.Thread(target=self._run_batches)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def predict_features(self, features):
+    """Runs the task head on features.
+
+    Args:
+      features: List of objects with unpadded `input_ids`, `input_mask` and
+        `segment_ids` lists.
+
+    Returns:
+      List with, for every feature, the list of its rows of the outputs of
+      `create_outputs_fn`.
+    """
+    requests = [_PredictRequest(feature) for feature in features]
+    for request in requests:
+      self._queue.put(request)
+
+    results = []
+    for request in requests:
+      request.done.wait()
+      if request.error is not None:
+        raise request.error
+      results.append(request.result)
+    return results
+
+  def get_batch_metrics(self):
+    """Returns the number and the mean size and padding of the batches run."""
+    with self._stats_lock:
+      metrics = {"num_batches": self._num_batches}
+      if self._num_batches:
+        metrics["mean_batch_size"] = (
+            self._num_examples / float(self._num_batches))
+        metrics["padding_ratio"] = (
+            self._num_padded_tokens / float(self._num_tokens))
+      return metrics
+
+  def close(self):
+    """Runs the pending examples, then stops the thread and the session."""
+    self._queue.put(None)
+    self._thread.join()
+    self._sess.close()
+
+  def _run_batches(self):
+    """Runs the pending examples in batches until `close` is called."""
+    pending = []
+    stopped = False
+    while pending or not stopped:
+      if not pending:
+        request = self._queue.get()
+        if request is None:
+          stopped = True
+          continue
+        pending.append(request)
+
+      # Waits until the batch is full or the oldest example waited long
+      # enough, then also takes the examples that are already queued, so that
+      # the batch can be grouped by length.
+      deadline = pending[0].start_time + self._max_wait_secs
+      while not stopped:
+        try:
+          if len(pending) < self._max_batch_size:
+            request = self._queue.get(timeout=max(deadline - time.time(), 0))
+          else:
+            request = self._queue.get_nowait()
+        except six.moves.queue.Empty:
+          break
+        if request is None:
+          stopped = True
+        else:
+          pending.append(request)
+
+      batch = self._select_batch(pending)
+      selected = set(id(request) for request in batch)
+      pending = [request for request in pending if id(request) not in selected]
+      self._run_batch(batch)
+
+  def _select_batch(self, pending):
+    """Picks the oldest pending example and those closest to it in length."""
+    oldest = pending[0]
+    # sorted() is stable, so the older examples win the ties.
+    others = sorted(pending[1:], key=lambda x: abs(x.length - oldest.length))
+    return [oldest] + others[:self._max_batch_size - 1]
+
+  def _run_batch(self, batch):
+    seq_length = max(request.length for request in batch)
+    feed_dict = {}
+    for (placeholder, name) in zip(self._inputs,
+                                   inference_graph.INPUT_NAMES):
+      feed_dict[placeholder] = [
+          list(getattr(request.feature, name)) + [0] *
+          (seq_length - request.length) for request in batch
+      ]
+
+    try:
+      outputs = self._sess.run(self._outputs, feed_dict=feed_dict)
+    except Exception as e:  # pylint: disable=broad-except
+      for request in batch:
+        request.error = e
+        request.done.set()
+      return
+
+    with self._stats_lock:
+      self._num_batches += 1
+      self._num_examples += len(batch)
+      self._num_tokens += len(batch) * seq_length
+      self._num_padded_tokens += sum(
+          seq_length - request.length for request in batch)
+
+    for (i, request) in enumerate(batch):
+      request.result = [output[i] for output in outputs]
+      request.done.set()
+
+
+class ServingMetrics(object):
+  """Thread-safe latency and throughput of the served requests."""
+
+  def __init__(self, max_num_latencies=10000):
+    self._lock = threading.Lock()
+    self._latencies = collections.deque(maxlen=max_num_latencies)
+    self._num_requests = 0
+    self._num_examples = 0
+    self._start_time = None
+
+  def record_request(self, start_time, num_examples):
+    """Records a request that started at `start_time` and just ended."""
+    end_time = time.time()
+    with self._lock:
+      if self._start_time is None:
+        self._start_time = start_time
+      self._latencies.append(end_time - start_time)
+      self._num_requests += 1
+      self._num_examples += num_examples
+
+  def get_metrics(self):
+    """Returns the p50/p99 latency of the last requests and the throughput."""
+    with self._lock:
+      metrics = {
+          "num_requests": self._num_requests,
+          "num_examples": self._num_examples,
+      }
+      if self._num_requests:
+        elapsed_secs = time.time() - self._start_time
+        metrics["p50_latency_ms"] = percentile(self._latencies, 50) * 1000.0
+        metrics["p99_latency_ms"] = percentile(self._latencies, 99) * 1000.0
+        metrics["requests_per_sec"] = self._num_requests / elapsed_secs
+        metrics["examples_per_sec"] = self._num_examples / elapsed_secs
+      return metrics
+
+
+def _to_json(value):
+  """Converts the NumPy arrays and scalars of the predictions."""
+  return value.tolist()
+
+
+class _ThreadingHTTPServer(six.moves.socketserver.ThreadingMixIn,
+                           six.moves.BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+
+def create_server(predictor, host="localhost", port=8000):
+  """Creates an HTTP server around a predictor.
+
+  Args:
+    predictor: Object with a `predict(instances)` method returning one
+      prediction per instance and a `get_batch_metrics()` method, e.g. a
+      `BatchingPredictor`.
+    host: (optional) The address to listen on.
+    port: (optional) int. The port to listen on, or 0 for any free port.
+
+  Returns:
+    The server, whose `serve_forever()` method serves the requests.
+  """
+  metrics = ServingMetrics()
+
+  class _Handler(six.moves.BaseHTTPServer.BaseHTTPRequestHandler):
+    """Handles the /predict and /metrics requests."""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+      if self.path != "/metrics":
+        self._send_json(404, {"error": "Not found: %s" % self.path})
+        return
+      result = metrics.get_metrics()
+      result.update(predictor.get_batch_metrics())
+      self._send_json(200, result)
+
+    def do_POST(self):  # pylint: disable=invalid-name
+      if self.path != "/predict":
+        self._send_json(404, {"error": "Not found: %s" % self.path})
+        return
+      start_time = time.time()
+      try:
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        instances = json.loads(body.decode("utf-8"))["instances"]
+        if not isinstance(instances, list):
+          raise ValueError("`instances` must be a list.")
+      except (KeyError, TypeError, ValueError) as e:
+        self._send_json(400, {"error": str(e)})
+        return
+
+      try:
+        predictions = predictor.predict(instances)
+      except Exception as e:  # pylint: disable=broad-except
+        tf.logging.error("Prediction failed: %s", e)
+        self._send_json(500, {"error": str(e)})
+        return
+      metrics.record_request(start_time, len(instances))
+      self._send_json(200, {"predictions": predictions})
+
+    def _send_json(self, code, value):
+      body = json.dumps(value, default=_to_json).encode("utf-8")
+      self.send_response(code)
+      self.send_header("Content-Type", "application/json")
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+      tf.logging.debug(format, *args)
+
+  return _ThreadingHTTPServer((host, port), _Handler)
+
+
+def serve(predictor, host, port):
+  """Serves a predictor until interrupted, then closes it."""
+  server = create_server(predictor, host, port)
+  tf.logging.info("Serving on http://%s:%d", host, server.server_port)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    predictor.close()
@@ -0,0 +1,147 @@
+# coding=utf-8
+# Copyright 2018 The Google AI Language Team Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import json
+import os
+import threading
+
+import serving
+import six
+import tensorflow as tf
+
+_Feature = collections.namedtuple("_Feature",
+                                  ["input_ids", "input_mask", "segment_ids"])
+
+
+def create_feature(input_ids):
+  return _Feature(
+      input_ids=input_ids,
+      input_mask=[1] * len(input_ids),
+      segment_ids=[0] * len(input_ids))
+
+
+class _EchoPredictor(object):
+
+  def predict(self, instances):
+    return [len(x) for x in instances]
+
+  def get_batch_metrics(self):
+    return {"num_batches": 0}
+
+
+class ServingTest(tf.test.TestCase):
+
+  def create_predictor(self, max_batch_size):
+    init_checkpoint = os.path.join(self.get_temp_dir(), "model.ckpt")
+    with tf.Graph().as_default():
+      tf.get_variable("scale", initializer=2.0)
+      with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        tf.train.Saver().save(sess, init_checkpoint)
+
+    def create_outputs(input_ids, input_mask, segment_ids):
+      del segment_ids  # Unused.
+      scale = tf.get_variable("scale", initializer=1.0)
+      return [
+          scale * tf.to_float(tf.reduce_sum(input_ids * input_mask, axis=1)),
+          tf.shape(input_ids)[1] + tf.zeros_like(input_ids[:, 0]),
+      ]
+
+    return serving.BatchingPredictor(
+        create_outputs,
+        init_checkpoint,
+        max_batch_size=max_batch_size,
+        max_wait_secs=0.05)
+
+  def test_percentile(self):
+    values = list(range(101))
+    self.assertEqual(serving.percentile(values, 50), 50)
+    self.assertEqual(serving.percentile(values, 99), 99)
+    self.assertEqual(serving.percentile([3.0], 99), 3.0)
+
+  def test_predict_features(self):
+    predictor = self.create_predictor(max_batch_size=4)
+    features = [create_feature([1] * n) for n in [1, 9, 2, 8, 3]]
+    results = predictor.predict_features(features)
+    predictor.close()
+
+    self.assertAllClose([2.0, 18.0, 4.0, 16.0, 6.0],
+                        [sums for (sums, _) in results])
+    for (feature, (_, seq_length)) in zip(features, results):
+      self.assertBetween(seq_length, len(feature.input_ids), 9)
+    metrics = predictor.get_batch_metrics()
+    self.assertGreaterEqual(metrics["num_batches"], 2)
+    self.assertGreater(metrics["padding_ratio"], 0.0)
+
+  def test_select_batch(self):
+    predictor = self.create_predictor(max_batch_size=4)
+    pending = [
+        serving._PredictRequest(create_feature([1] * n))
+        for n in [1, 9, 2, 8, 3]
+    ]
+    batch = predictor._select_batch(pending)
+    predictor.close()
+    # The oldest example is batched with the three closest to it in length.
+    self.assertEqual([1, 2, 3, 8], [request.length for request in batch])
+
+  def test_concurrent_predict_features(self):
+    predictor = self.create_predictor(max_batch_size=8)
+    results = [None] * 16
+
+    def predict(i):
+      results[i] = predictor.predict_features([create_feature([i] * (i + 1))])
+
+    threads = [threading.Thread(target=predict, args=(i,)) for i in range(16)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    predictor.close()
+
+    for (i, result) in enumerate(results):
+      self.assertAllClose(result[0][0], 2.0 * i * (i + 1))
+    self.assertLess(predictor.get_batch_metrics()["num_batches"], 16)
+
+  def test_create_server(self):
+    server = serving.create_server(_EchoPredictor(), port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = "http://localhost:%d" % server.server_port
+    try:
+      request = six.moves.urllib.request.Request(
+          url + "/predict",
+          data=json.dumps({"instances": ["a", "abc"]}).encode("utf-8"))
+      response = six.moves.urllib.request.urlopen(request)
+      self.assertEqual(
+          json.loads(response.read().decode("utf-8")),
+          {"predictions": [1, 3]})
+
+      response = six.moves.urllib.request.urlopen(url + "/metrics")
+      metrics = json.loads(response.read().decode("utf-8"))
+      self.assertEqual(metrics["num_requests"], 1)
+      self.assertEqual(metrics["num_examples"], 2)
+      self.assertIn("p99_latency_ms", metrics)
+    finally:
+      server.shutdown()
+      server.server_close()
+      thread.join()
+
+
+if __name__ == "__main__":
+  tf.test.main()